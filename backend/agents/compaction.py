@@ -0,0 +1,265 @@
+# backend/agents/compaction.py
+"""
+代理输入压缩
+工具结果回传给代理、分析结果交给总结代理之前，先经过这里：
+按工具只保留代理需要的字段，数字用紧凑形式编码（1.23B、0.152），
+再按每个代理的 token 预算截断。token 用本地分词器统计，并记录压缩前后的 token 数。
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# 每个代理单次工具结果的 token 预算，总结代理为整份分析结果的预算
+TOKEN_BUDGETS = {
+    "fundamental": int(os.getenv("FUNDAMENTAL_AGENT_TOKEN_BUDGET", "800")),
+    "technical": int(os.getenv("TECHNICAL_AGENT_TOKEN_BUDGET", "1200")),
+    "valuation": int(os.getenv("VALUATION_AGENT_TOKEN_BUDGET", "600")),
+    "summary": int(os.getenv("SUMMARY_AGENT_TOKEN_BUDGET", "3000")),
+}
+# 技术面代理默认只看最近这么多根 K 线
+K_DATA_BARS = int(os.getenv("AGENT_K_DATA_BARS", "60"))
+
+# 各工具结果中代理需要的字段
+TOOL_FIELDS: Dict[str, List[str]] = {
+    "get_company_overview": [
+        "Symbol", "Name", "Sector", "Industry", "MarketCapitalization", "RevenueTTM", "GrossProfitTTM",
+        "EBITDA", "EPS", "ProfitMargin", "OperatingMarginTTM", "ReturnOnAssetsTTM", "ReturnOnEquityTTM",
+        "QuarterlyRevenueGrowthYOY", "QuarterlyEarningsGrowthYOY", "DividendYield", "Beta",
+    ],
+}
+# 财报只保留最近几期
+FINANCIAL_REPORTS = 4
+
+_MISSING = {"", "None", "none", "-", "N/A", "null"}
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?([eE][-+]?\d+)?$")
+_CJK = re.compile(r"[⺀-鿿가-힯＀-￯]")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """懒加载 tiktoken 的 o200k_base（gpt-4o 使用的分词），不可用时返回 None"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encoding = None
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """统计 token 数；分词表无法加载（如离线环境）时按中日韩字符 1 个、其他字符 4 个一 token 估算"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """按 token 预算截断文本，并标记被截断"""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:budget]) + "…[截断]"
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…[截断]"
+
+
+# (起始数量级, 除数, 后缀)：一万以下的数字保持原值，更大的数字用 K/M/B/T 后缀
+_SUFFIXES = ((1e12, 1e12, "T"), (1e9, 1e9, "B"), (1e6, 1e6, "M"), (1e4, 1e3, "K"))
+
+
+def compact_number(value: Any, suffix: bool = True) -> Any:
+    """数字紧凑编码，大数用 K/M/B/T 后缀（suffix=False 时保持数值，用于价格）；非数字原样返回，缺失值返回 None"""
+    if isinstance(value, str):
+        if value.strip() in _MISSING:
+            return None
+        if not _NUMBER.match(value.strip()):
+            return value
+        value = float(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    magnitude = abs(value)
+    if magnitude != magnitude or magnitude == float("inf"):
+        return None
+    if suffix:
+        for threshold, divisor, label in _SUFFIXES:
+            if magnitude >= threshold:
+                return f"{value / divisor:.4g}{label}"
+    if value == int(value):
+        return int(value)
+    # 价格类数字保留两位小数，比率类小数保留 4 位有效数字
+    return round(value, 2) if magnitude >= 1 else float(f"{value:.4g}")
+
+
+def encode_compact(payload: Any) -> str:
+    """去掉空白的 JSON 编码，中文不转义"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def project_fields(record: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    projected = {}
+    for field in fields:
+        value = compact_number(record.get(field))
+        if value is not None:
+            projected[field] = value
+    return projected
+
+
+def _project_financials(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """财报结果已按指标分列、按报告期倒序，只需截取最近几期并紧凑编码数字"""
+    def columns(group: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+        return {name: [compact_number(value) for value in values[:FINANCIAL_REPORTS]] for name, values in group.items()}
+
+    projected = {
+        "symbol": payload.get("symbol"),
+        "period": payload.get("period"),
+        "fiscal_dates": payload.get("fiscal_dates", [])[:FINANCIAL_REPORTS],
+        "statements": columns(payload.get("statements", {})),
+        "ratios": columns(payload.get("ratios", {})),
+        "dupont": columns(payload.get("dupont", {})),
+    }
+    if payload.get("stale"):
+        projected["stale"] = True
+    return projected
+
+
+def _project_k_data(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """K 线转为列名 + 行数组，省去每行重复的键名；OHLC 价格保持数值，只有成交量使用后缀"""
+    bars = payload.get("bars", [])[-K_DATA_BARS:]
+    columns = ["time", "open", "high", "low", "close", "volume"]
+    suffixed = {"volume"}
+    projected = {
+        "symbol": payload.get("symbol"),
+        "interval": payload.get("interval"),
+        "columns": columns,
+        "rows": [[compact_number(bar.get(column), column in suffixed) for column in columns] for bar in bars],
+    }
+    if payload.get("stale"):
+        projected["stale"] = True
+    return projected
+
+
+def compact_nested(value: Any) -> Any:
+    """递归紧凑编码嵌套结果中的数字，去掉缺失值"""
+    if isinstance(value, dict):
+        return {key: compact_nested(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [compact_nested(item) for item in value]
+    return compact_number(value)
+
+
+PROJECTIONS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "get_company_overview": lambda payload: project_fields(payload, TOOL_FIELDS["get_company_overview"]),
+    "get_stock_valuation": compact_nested,
+    "get_stock_financials": _project_financials,
+    "get_stock_k_data": _project_k_data,
+}
+
+
+class CompactionStats:
+    """按代理累计压缩前后的 token 数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, int]] = {}
+
+    def record(self, agent: str, before: int, after: int):
+        with self._lock:
+            entry = self._agents.setdefault(agent, {"calls": 0, "tokens_before": 0, "tokens_after": 0, "truncated": 0})
+            entry["calls"] += 1
+            entry["tokens_before"] += before
+            entry["tokens_after"] += after
+
+    def record_truncation(self, agent: str):
+        with self._lock:
+            self._agents.setdefault(agent, {"calls": 0, "tokens_before": 0, "tokens_after": 0, "truncated": 0})
+            self._agents[agent]["truncated"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._agents.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            agents = {}
+            for agent, entry in self._agents.items():
+                before = entry["tokens_before"]
+                agents[agent] = {
+                    **entry,
+                    "budget": TOKEN_BUDGETS.get(agent),
+                    "saved_ratio": round(1 - entry["tokens_after"] / before, 4) if before else 0.0,
+                }
+        return {"tokenizer": "o200k_base" if _get_encoding() is not None else "estimate", "agents": agents}
+
+
+compaction_stats = CompactionStats()
+
+
+def _fit_rows(projected: Dict[str, Any], budget: int) -> Dict[str, Any]:
+    """K 线等行数据超出预算时优先丢弃最早的行，保持 JSON 完整"""
+    rows = projected["rows"]
+    while len(rows) > 1 and count_tokens(encode_compact(projected)) > budget:
+        rows = rows[max(1, len(rows) // 4):]
+        projected = {**projected, "rows": rows}
+    return projected
+
+
+def compact_tool_result(agent: str, tool_name: str, payload: Any, budget: Optional[int] = None) -> str:
+    """把一次工具调用结果压缩为不超过代理预算的紧凑文本"""
+    budget = TOKEN_BUDGETS.get(agent, 1000) if budget is None else budget
+    raw = encode_compact(payload) if not isinstance(payload, str) else payload
+    before = count_tokens(raw)
+    projection = PROJECTIONS.get(tool_name)
+    if isinstance(payload, dict) and "error" not in payload and projection is not None:
+        projected = projection(payload)
+        if "rows" in projected:
+            projected = _fit_rows(projected, budget)
+        text = encode_compact(projected)
+    else:
+        text = raw
+    compacted = truncate_to_budget(text, budget)
+    if compacted is not text:
+        compaction_stats.record_truncation(agent)
+    compaction_stats.record(agent, before, count_tokens(compacted))
+    return compacted
+
+
+def compact_analysis_results(analysis_results: Dict[str, Any], budget: Optional[int] = None) -> str:
+    """
+    把各分支的分析结果整理为总结代理的输入：每个分支一节，空白合并，
+    总预算在各分支间平均分配，避免某一分支的长文挤掉其他分支
+    """
+    budget = TOKEN_BUDGETS["summary"] if budget is None else budget
+    raw = repr(analysis_results)
+    sections = {key: value for key, value in analysis_results.items() if key not in ("symbol", "missing")}
+    share = max(budget // max(len(sections), 1), 1)
+    parts = [f"股票: {analysis_results.get('symbol', '')}"]
+    for name, text in sections.items():
+        body = re.sub(r"\n\s*\n+", "\n", str(text)).strip()
+        fitted = truncate_to_budget(body, share)
+        if fitted is not body:
+            compaction_stats.record_truncation("summary")
+        parts.append(f"## {name}\n{fitted}")
+    if analysis_results.get("missing"):
+        parts.append("## missing\n" + encode_compact(analysis_results["missing"]))
+    text = "\n".join(parts)
+    compaction_stats.record("summary", count_tokens(raw), count_tokens(text))
+    return text
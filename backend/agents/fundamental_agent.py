@@ -5,37 +5,60 @@ from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
 
 # 假设 mcp_client.py 已经实现
-from mcp_client import get_mcp_tools, call_mcp_tool
+from typing import List
 
-def create_fundamental_agent():
+from mcp_client import get_mcp_tools, acall_mcp_tool, call_mcp_tools
+from agents.compaction import compact_tool_result
+
+# 基本面代理会用到的 MCP 工具
+FUNDAMENTAL_TOOL_NAMES = ('get_company_overview', 'get_stock_price', 'get_stock_financials')
+
+def create_fundamental_agent(model=None, mcp_tools=None):
     """
     创建一个基于 ReAct 框架的基本面分析代理。
+    model 为空时使用 gpt-4o，可传入其他聊天模型（如测试用的假模型）。
+    mcp_tools 为已缓存的 MCP 工具列表，为空时现场向 MCP Server 拉取；
+    代理只绑定列表中存在的工具，工具列表变化后由 AgentRegistry 重新构建。
     """
     # 1. 加载语言模型
     # 这里我们使用 ChatOpenAI，你需要确保 OPENAI_API_KEY 环境变量已设置
-    model = ChatOpenAI(model="gpt-4o", temperature=0)
+    model = model or ChatOpenAI(model="gpt-4o", temperature=0)
 
     # 2. 定义工具
-    # 我们从 MCP Server 获取工具，并将其包装为 LangChain 可用的格式
-    mcp_tools = get_mcp_tools()
-    
-    # 确保我们只获取基本面分析相关的工具
-    fundamental_tools = []
-    for tool in mcp_tools:
-        if tool['name'] in ['get_company_overview', 'get_stock_financials']:
-            # 将 MCP 工具包装成 LangChain 工具
-            # 注意：这里需要一个更复杂的包装逻辑来将 MCP 调用与 LangChain 工具类连接起来
-            # 我们先用一个简化的方式来演示
-            pass
+    # 我们从 MCP Server 获取工具列表（通常由 ToolCatalog 缓存并定期刷新），只绑定服务端当前实际提供的基本面工具
+    if mcp_tools is None:
+        mcp_tools = get_mcp_tools()
+    # 拿不到工具列表时（MCP Server 暂不可用）保留全部工具，由调用时的错误结果告知模型
+    available = {tool['name'] for tool in mcp_tools} or set(FUNDAMENTAL_TOOL_NAMES)
+
+    # 工具结果先经过压缩（字段裁剪 + token 预算）再交给模型
+    async def get_company_overview_tool(symbol: str):
+        """获取公司基本面概览（行业、市值、市盈率等）"""
+        return compact_tool_result("fundamental", 'get_company_overview', await acall_mcp_tool('get_company_overview', symbol=symbol))
+
+    async def get_stock_financials_tool(symbol: str, period: str = "quarterly"):
+        """获取财务报表摘要与预计算好的财务比率（ROE、ROA、利润率、同比增长、周转率、杠杆、现金流）及杜邦分解，period 为 quarterly 或 annual"""
+        return compact_tool_result("fundamental", 'get_stock_financials', await acall_mcp_tool('get_stock_financials', symbol=symbol, period=period))
 
-    # 简化的工具定义
-    def get_company_overview_tool(symbol: str):
-        return call_mcp_tool('get_company_overview', symbol=symbol)
+    snapshot_names = [name for name in FUNDAMENTAL_TOOL_NAMES if name in available]
 
-    def get_stock_financials_tool(symbol: str):
-        return call_mcp_tool('get_stock_financials', symbol=symbol)
+    async def get_companies_snapshot_tool(symbols: List[str]):
+        """一次获取多只股票（如同行业对比）的基本面概览、实时价格与财务报表"""
+        calls = [{"tool_name": name, "params": {"symbol": symbol}} for symbol in symbols for name in snapshot_names]
+        # 所有调用合并为一次请求，而不是每只股票、每个工具各一次
+        results = await call_mcp_tools(calls)
+        return "\n".join(
+            f"{call['params']['symbol']} {call['tool_name']}: {compact_tool_result('fundamental', call['tool_name'], result)}"
+            for call, result in zip(calls, results)
+        )
 
-    tools = [get_company_overview_tool, get_stock_financials_tool]
+    tools = []
+    if 'get_company_overview' in available:
+        tools.append(get_company_overview_tool)
+    if 'get_stock_financials' in available:
+        tools.append(get_stock_financials_tool)
+    if snapshot_names:
+        tools.append(get_companies_snapshot_tool)
     
     # 3. 构建详细的分析 Prompt
     # 这个 Prompt 将指导代理如何思考和行动
@@ -50,14 +73,15 @@ def create_fundamental_agent():
     - 现金流状况
     - 杜邦分析
     
+    财务比率与杜邦分解已由 get_stock_financials 预先算好（季度口径为最近四个季度滚动值），请直接引用，不要根据原始报表重新推导。
     请使用提供的工具获取所需数据，并以清晰、结构化的方式组织你的分析。
     """
     
     # 4. 创建 ReAct Agent
     # LangGraph 将自动处理“思考-行动”的循环
-    fundamental_agent = create_react_agent(model, tools=tools, messages_modifier=[
-        SystemMessage(content=system_prompt)
-    ])
+    fundamental_agent = create_react_agent(
+        model, tools=tools, state_modifier=SystemMessage(content=system_prompt)
+    )
     
     return fundamental_agent
 
@@ -0,0 +1,260 @@
+# backend/agents/llm_cache.py
+"""
+LLM 调用缓存
+作为 LangChain 的 BaseCache 挂在共享模型上，ReAct 代理与总结报告的每次模型调用都会先查缓存。
+键由规范化后的提示词与模型参数（模型名、温度、绑定的工具等）计算，只缓存温度为 0 的调用。
+数据保存在本地 SQLite 中，条目在下一个美股交易时段边界（开盘或收盘）过期，
+超过容量时淘汰最久未访问的条目。统计命中率与节省的 token 数。
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, Generation
+
+try:
+    from zoneinfo import ZoneInfo
+
+    MARKET_TZ = ZoneInfo("America/New_York")
+except Exception:  # 系统缺少时区数据时退化为美东标准时间
+    MARKET_TZ = timezone(timedelta(hours=-5))
+
+DATA_DIR = os.getenv("MARKET_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(DATA_DIR, "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# 美股常规交易时段（美东时间）
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 0)
+
+_WHITESPACE = re.compile(r"\s+")
+_TEMPERATURE = re.compile(r"""["']temperature["']\)?\s*[:,]\s*([0-9.]+)""")
+
+
+def next_session_boundary(now: Optional[float] = None) -> float:
+    """
+    返回下一个交易时段边界（开盘或收盘）的时间戳：
+    盘中生成的结果在当天收盘时过期，盘后生成的结果在下一个交易日开盘时过期（跳过周末）
+    """
+    current = datetime.fromtimestamp(time.time() if now is None else now, MARKET_TZ)
+    day = current.date()
+    while True:
+        if day.weekday() < 5:
+            for hour, minute in (MARKET_OPEN, MARKET_CLOSE):
+                boundary = datetime(day.year, day.month, day.day, hour, minute, tzinfo=MARKET_TZ)
+                if boundary > current:
+                    return boundary.timestamp()
+        day += timedelta(days=1)
+
+
+# 每次调用都会变化、与模型输出无关的消息字段
+_VOLATILE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", value).strip()
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        normalized = {key: _normalize(item) for key, item in value.items()}
+        kwargs = normalized.get("kwargs")
+        if isinstance(kwargs, dict):
+            normalized["kwargs"] = {k: v for k, v in kwargs.items() if k not in _VOLATILE_FIELDS}
+        return normalized
+    return value
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    规范化提示词：聊天模型传入的是序列化后的消息列表，去掉消息 ID、响应元数据等易变字段，
+    并合并各文本中的空白字符，使仅有格式差异的提示词命中同一条目
+    """
+    try:
+        return json.dumps(_normalize(json.loads(prompt)), ensure_ascii=False, sort_keys=True)
+    except ValueError:
+        return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def is_deterministic(llm_string: str) -> bool:
+    """只有温度为 0（或未设置温度）的调用结果才可复用"""
+    match = _TEMPERATURE.search(llm_string)
+    return match is None or float(match.group(1)) == 0.0
+
+
+def _generation_tokens(generation: Generation) -> int:
+    """读取一次生成消耗的 token 数，模型未返回用量时按字符数估算"""
+    message = getattr(generation, "message", None)
+    usage = getattr(message, "usage_metadata", None) if message is not None else None
+    if usage:
+        return int(usage.get("total_tokens", 0))
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") if message is not None else None
+    if token_usage:
+        return int(token_usage.get("total_tokens", 0))
+    return len(generation.text) // 4
+
+
+class SQLiteLLMCache(BaseCache):
+    """SQLite 持久化的 LLM 调用缓存，按交易时段过期、按容量 LRU 淘汰"""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        expires_at: Callable[[float], float] = next_session_boundary,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self._expires_at = expires_at
+        self._clock = clock
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(normalize_prompt(prompt).encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(llm_string.encode("utf-8"))
+        return digest.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        if not is_deterministic(llm_string):
+            return None
+        key = self.make_key(prompt, llm_string)
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, tokens, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] <= now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            self.tokens_saved += row[1]
+        return [loads(item) for item in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if not is_deterministic(llm_string):
+            self.skipped += 1
+            return
+        key = self.make_key(prompt, llm_string)
+        now = self._clock()
+        value = json.dumps([dumps(generation) for generation in return_val])
+        tokens = sum(_generation_tokens(generation) for generation in return_val)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, tokens, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, tokens, self._expires_at(now), now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        expired = self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+        self.evictions += max(overflow, 0) + max(expired, 0)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def size(self) -> int:
+        # 不实现 __len__：LangChain 以真值判断是否启用缓存，空缓存不能为假
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": self.size(),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "skipped_nondeterministic": self.skipped,
+            "evictions": self.evictions,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+_llm_cache: Optional[SQLiteLLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> SQLiteLLMCache:
+    """进程内共享的 LLM 调用缓存（懒加载）"""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = SQLiteLLMCache()
+        return _llm_cache
+
+
+async def cached_astream(model, messages: List[BaseMessage]) -> AsyncIterator[str]:
+    """
+    流式调用聊天模型，逐段产出文本。LangChain 的 astream 不经过模型缓存，
+    这里手动查询与回写：命中时一次性产出缓存的完整文本，未命中时边产出边累积，结束后写入缓存
+    """
+    cache = getattr(model, "cache", None)
+    if not isinstance(cache, BaseCache):
+        async for chunk in model.astream(messages):
+            yield chunk.content
+        return
+    prompt = dumps(messages)
+    llm_string = model._get_llm_string()
+    cached = await cache.alookup(prompt, llm_string)
+    if cached:
+        yield "".join(generation.text for generation in cached)
+        return
+    parts = []
+    async for chunk in model.astream(messages):
+        parts.append(chunk.content)
+        yield chunk.content
+    await cache.aupdate(prompt, llm_string, [ChatGeneration(message=AIMessage(content="".join(parts)))])
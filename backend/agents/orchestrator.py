@@ -0,0 +1,206 @@
+# backend/agents/orchestrator.py
+"""
+多代理编排
+基本面、技术面、估值三个分析代理在 LangGraph 中并行执行（fan-out），
+全部结束后汇入总结代理生成报告（fan-in）。每个分支有独立超时，
+超时或出错的分支记为缺失，总结仍基于其余结果生成，端到端耗时约等于最慢的分支。
+流式模式下每个分支完成即推送进度事件，总结报告逐段推送，首字节时间约等于首个 token 的延迟。
+"""
+
+import asyncio
+import operator
+import os
+import time
+from typing import Annotated, Any, AsyncIterator, Callable, Dict, Optional, TypedDict
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END, START, StateGraph
+
+# 单个分析分支的超时时间（秒）
+BRANCH_TIMEOUT = float(os.getenv("AGENT_BRANCH_TIMEOUT", "60"))
+
+BRANCH_PROMPTS = {
+    "fundamental": "请对股票 {symbol} 进行基本面分析。",
+    "technical": "请对股票 {symbol} 进行技术面分析。",
+    "valuation": "请对股票 {symbol} 进行估值分析。",
+}
+
+
+class AnalysisState(TypedDict, total=False):
+    symbol: str
+    # 各分支并行写入，按字典合并
+    results: Annotated[Dict[str, str], operator.or_]
+    errors: Annotated[Dict[str, str], operator.or_]
+    timings: Annotated[Dict[str, float], operator.or_]
+    report: str
+
+
+def _final_content(output: Any) -> str:
+    """取 ReAct 代理最后一条消息的文本"""
+    if isinstance(output, dict) and output.get("messages"):
+        return output["messages"][-1].content
+    return str(output)
+
+
+def _branch_node(name: str, agent, timeout: float):
+    async def run(state: AnalysisState) -> Dict[str, Any]:
+        started = time.perf_counter()
+        prompt = BRANCH_PROMPTS[name].format(symbol=state["symbol"])
+        try:
+            output = await asyncio.wait_for(
+                agent.ainvoke({"messages": [HumanMessage(content=prompt)]}),
+                timeout=timeout,
+            )
+            update = {"results": {name: _final_content(output)}}
+        except asyncio.TimeoutError:
+            update = {"errors": {name: f"超时（{timeout:g} 秒）"}}
+        except Exception as e:
+            update = {"errors": {name: str(e)}}
+        update["timings"] = {name: round(time.perf_counter() - started, 3)}
+        return update
+
+    return run
+
+
+def _summary_node(generate_report: Callable[[dict], str]):
+    async def run(state: AnalysisState, config: RunnableConfig) -> Dict[str, Any]:
+        results = state.get("results", {})
+        if not results:
+            return {"report": f"# {state['symbol']} 分析报告\n\n所有分析分支均失败，暂无法生成报告。"}
+        analysis_results = {"symbol": state["symbol"], **results}
+        if state.get("errors"):
+            analysis_results["missing"] = state["errors"]
+        # 调用方通过 configurable.on_report_token 订阅报告文本时走流式生成
+        on_token = (config or {}).get("configurable", {}).get("on_report_token")
+        astream = getattr(generate_report, "astream", None)
+        if on_token is not None and astream is not None:
+            parts = []
+            async for text in astream(analysis_results):
+                if text:
+                    parts.append(text)
+                    await on_token(text)
+            return {"report": "".join(parts)}
+        # generate_report 为同步调用，放到线程中避免阻塞事件循环
+        report = await asyncio.to_thread(generate_report, analysis_results)
+        return {"report": report}
+
+    return run
+
+
+def build_analysis_graph(
+    fundamental_agent,
+    technical_agent,
+    valuation_agent,
+    generate_report: Callable[[dict], str],
+    branch_timeout: Optional[float] = None,
+):
+    """
+    构建并编译分析图：START 同时触发三个分析分支，三者都结束后进入 summary。
+    """
+    timeout = BRANCH_TIMEOUT if branch_timeout is None else branch_timeout
+    agents = {
+        "fundamental": fundamental_agent,
+        "technical": technical_agent,
+        "valuation": valuation_agent,
+    }
+
+    graph = StateGraph(AnalysisState)
+    for name, agent in agents.items():
+        graph.add_node(name, _branch_node(name, agent, timeout))
+        graph.add_edge(START, name)
+    graph.add_node("summary", _summary_node(generate_report))
+    # 多个来源指向同一节点时，LangGraph 会等待所有来源完成后再执行
+    graph.add_edge(list(agents), "summary")
+    graph.add_edge("summary", END)
+    return graph.compile()
+
+
+def create_analysis_graph(model=None, branch_timeout: Optional[float] = None):
+    """使用默认代理构建分析图；model 为空时各代理使用 gpt-4o"""
+    from agents.fundamental_agent import create_fundamental_agent
+    from agents.summary_agent import create_summary_agent
+    from agents.technical_agent import create_technical_agent
+    from agents.valuation_agent import create_valuation_agent
+
+    return build_analysis_graph(
+        create_fundamental_agent(model),
+        create_technical_agent(model),
+        create_valuation_agent(model),
+        create_summary_agent(model),
+        branch_timeout,
+    )
+
+
+async def run_stock_analysis(symbol: str, graph=None) -> Dict[str, Any]:
+    """对一只股票执行完整的多代理分析，返回报告与各分支结果；默认复用注册表中已编译的分析图"""
+    if graph is None:
+        from agents.registry import agent_registry
+        graph = await agent_registry.aget("analysis")
+    state = await graph.ainvoke({"symbol": symbol.upper(), "results": {}, "errors": {}, "timings": {}})
+    return {
+        "symbol": symbol.upper(),
+        "report": state.get("report", ""),
+        "results": state.get("results", {}),
+        "errors": state.get("errors", {}),
+        "timings": state.get("timings", {}),
+    }
+
+
+_STREAM_END = object()
+
+
+async def stream_stock_analysis(symbol: str, graph=None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式执行多代理分析，依次产出：
+    progress（每个分析分支完成或失败时）、token（总结报告的每段文本）、done（完整结果）；出错时产出 error。
+    生成器被关闭（如客户端断开）时取消仍在执行的分析。
+    """
+    if graph is None:
+        from agents.registry import agent_registry
+        graph = await agent_registry.aget("analysis")
+    symbol = symbol.upper()
+    # 有界队列：客户端读得慢时总结节点会等待，而不是无限堆积 token
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def on_report_token(text: str):
+        await queue.put({"type": "token", "text": text})
+
+    async def run():
+        final = {"results": {}, "errors": {}, "timings": {}, "report": ""}
+        try:
+            async for update in graph.astream(
+                {"symbol": symbol, "results": {}, "errors": {}, "timings": {}},
+                config={"configurable": {"on_report_token": on_report_token}},
+                stream_mode="updates",
+            ):
+                for node, delta in update.items():
+                    if node == "summary":
+                        final["report"] = delta.get("report", "")
+                        continue
+                    for key in ("results", "errors", "timings"):
+                        final[key].update(delta.get(key, {}))
+                    await queue.put({
+                        "type": "progress",
+                        "agent": node,
+                        "status": "error" if node in delta.get("errors", {}) else "done",
+                        "error": delta.get("errors", {}).get(node),
+                        "elapsed": delta.get("timings", {}).get(node),
+                    })
+            await queue.put({"type": "done", "symbol": symbol, **final})
+        except Exception as e:
+            await queue.put({"type": "error", "symbol": symbol, "error": str(e)})
+        # 被取消时消费者已不再读取，无需结束标记
+        await queue.put(_STREAM_END)
+
+    task = asyncio.ensure_future(run())
+    try:
+        yield {"type": "start", "symbol": symbol, "agents": list(BRANCH_PROMPTS)}
+        while True:
+            record = await queue.get()
+            if record is _STREAM_END:
+                return
+            yield record
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
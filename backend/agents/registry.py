@@ -0,0 +1,243 @@
+# backend/agents/registry.py
+"""
+进程级代理注册表
+每个代理（以及组合后的分析图）只构建、编译一次，之后所有请求复用；
+所有代理共享同一个聊天模型实例及其 HTTP 连接池；
+MCP 工具列表在后台定期刷新，构建代理时不再同步请求 MCP Server；
+工具列表变化后，依赖它的代理在下次获取时重新构建。
+记录每个代理的冷启动（首次构建）与热路径（复用）耗时。
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from agents.compaction import compaction_stats
+from agents.llm_cache import get_llm_cache
+from mcp_client import get_mcp_tools
+
+logger = logging.getLogger(__name__)
+
+# 绑定了 MCP 工具列表的代理，工具列表变化后需要重新构建
+TOOL_DEPENDENT_AGENTS = ("fundamental", "analysis")
+# MCP 工具列表的刷新间隔（秒）
+TOOL_REFRESH_SECONDS = float(os.getenv("MCP_TOOL_REFRESH_SECONDS", "300"))
+# 模型客户端连接池大小
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# 是否缓存温度为 0 的模型调用结果
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+_shared_model = None
+_shared_model_lock = threading.Lock()
+
+
+def shared_chat_model():
+    """进程内共享的 gpt-4o 客户端，同步与异步调用各自复用一个连接池，并挂载 LLM 调用缓存"""
+    global _shared_model
+    with _shared_model_lock:
+        if _shared_model is None:
+            from langchain_openai import ChatOpenAI
+
+            limits = httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            )
+            timeout = httpx.Timeout(LLM_TIMEOUT)
+            _shared_model = ChatOpenAI(
+                model="gpt-4o",
+                temperature=0,
+                http_client=httpx.Client(limits=limits, timeout=timeout),
+                http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+                cache=get_llm_cache() if LLM_CACHE_ENABLED else None,
+            )
+        return _shared_model
+
+
+class ToolCatalog:
+    """缓存 MCP 工具列表并在后台定期刷新；刷新失败时保留上一次的结果，列表内容变化时递增 version"""
+
+    def __init__(self, fetch: Callable[[], List[Dict[str, Any]]] = get_mcp_tools, interval: float = TOOL_REFRESH_SECONDS):
+        self._fetch = fetch
+        self.interval = interval
+        self.tools: Optional[List[Dict[str, Any]]] = None
+        self.refreshed_at: Optional[float] = None
+        self.refreshes = 0
+        self.version = 0
+        self._signature = None
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self):
+        tools = self._fetch()
+        self.refreshes += 1
+        if tools:
+            signature = [(tool.get("name"), tool.get("description"), repr(tool.get("parameters"))) for tool in tools]
+            if signature != self._signature:
+                self._signature = signature
+                self.version += 1
+            self.tools = tools
+            self.refreshed_at = time.time()
+
+    def get(self) -> List[Dict[str, Any]]:
+        """返回缓存的工具列表，从未刷新过时同步拉取一次"""
+        if self.tools is None:
+            self.refresh()
+        return self.tools or []
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.warning(f"刷新 MCP 工具列表失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class AgentRegistry:
+    """按名称懒构建并缓存代理：fundamental / technical / valuation / summary / analysis"""
+
+    def __init__(self, model=None, tool_catalog: Optional[ToolCatalog] = None, branch_timeout: Optional[float] = None):
+        self._model = model
+        self.tool_catalog = tool_catalog or ToolCatalog()
+        self.branch_timeout = branch_timeout
+        self._agents: Dict[str, Any] = {}
+        self._cold_ms: Dict[str, float] = {}
+        self._warm_hits: Dict[str, int] = {}
+        self._warm_total_us: Dict[str, float] = {}
+        # 已构建的代理所用工具列表的版本
+        self._tool_version = self.tool_catalog.version
+        self.tool_rebuilds = 0
+        # analysis 的构建会递归获取其他代理，需要可重入锁
+        self._lock = threading.RLock()
+        self._builders: Dict[str, Callable[[], Any]] = {
+            "fundamental": self._build_fundamental,
+            "technical": self._build_technical,
+            "valuation": self._build_valuation,
+            "summary": self._build_summary,
+            "analysis": self._build_analysis,
+        }
+
+    @property
+    def model(self):
+        return self._model or shared_chat_model()
+
+    def _build_fundamental(self):
+        from agents.fundamental_agent import create_fundamental_agent
+        tools = self.tool_catalog.get()
+        self._tool_version = self.tool_catalog.version
+        return create_fundamental_agent(self.model, mcp_tools=tools)
+
+    def _build_technical(self):
+        from agents.technical_agent import create_technical_agent
+        return create_technical_agent(self.model)
+
+    def _build_valuation(self):
+        from agents.valuation_agent import create_valuation_agent
+        return create_valuation_agent(self.model)
+
+    def _build_summary(self):
+        from agents.summary_agent import create_summary_agent
+        return create_summary_agent(self.model)
+
+    def _build_analysis(self):
+        from agents.orchestrator import build_analysis_graph
+        return build_analysis_graph(
+            self.get("fundamental"),
+            self.get("technical"),
+            self.get("valuation"),
+            self.get("summary"),
+            self.branch_timeout,
+        )
+
+    def _drop_stale_tool_agents(self):
+        """工具列表已变化时丢弃绑定了旧工具的代理"""
+        with self._lock:
+            if self._tool_version == self.tool_catalog.version:
+                return
+            stale = [name for name in TOOL_DEPENDENT_AGENTS if self._agents.pop(name, None) is not None]
+            if stale:
+                self.tool_rebuilds += 1
+                logger.info("MCP 工具列表已变化，重新构建基本面代理与分析图")
+            self._tool_version = self.tool_catalog.version
+
+    def get(self, name: str):
+        """获取已构建的代理，首次调用时构建；工具列表变化后依赖它的代理会重新构建"""
+        started = time.perf_counter()
+        if self._tool_version != self.tool_catalog.version:
+            self._drop_stale_tool_agents()
+        agent = self._agents.get(name)
+        if agent is not None:
+            self._warm_hits[name] = self._warm_hits.get(name, 0) + 1
+            self._warm_total_us[name] = self._warm_total_us.get(name, 0.0) + (time.perf_counter() - started) * 1e6
+            return agent
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                if name not in self._builders:
+                    raise KeyError(f"未知代理: {name}")
+                agent = self._builders[name]()
+                self._agents[name] = agent
+                self._cold_ms[name] = round((time.perf_counter() - started) * 1000, 3)
+            return agent
+
+    async def aget(self, name: str):
+        """get 的异步版本：代理已构建时直接返回；需要构建（可能同步拉取 MCP 工具列表）时在线程中进行，不阻塞事件循环"""
+        if name in self._agents and self._tool_version == self.tool_catalog.version:
+            return self.get(name)
+        return await asyncio.to_thread(self.get, name)
+
+    def warm_up(self):
+        """预先构建全部代理，避免首个请求承担冷启动开销"""
+        self.get("analysis")
+
+    def reset(self):
+        with self._lock:
+            self._agents.clear()
+            self._cold_ms.clear()
+            self._warm_hits.clear()
+            self._warm_total_us.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        model = self._model or _shared_model
+        cache = getattr(model, "cache", None)
+        agents = {}
+        for name in self._builders:
+            hits = self._warm_hits.get(name, 0)
+            agents[name] = {
+                "built": name in self._agents,
+                "cold_build_ms": self._cold_ms.get(name),
+                "warm_hits": hits,
+                "warm_avg_us": round(self._warm_total_us[name] / hits, 3) if hits else None,
+            }
+        return {
+            "agents": agents,
+            "tools": {
+                "count": len(self.tool_catalog.tools or []),
+                "refreshed_at": self.tool_catalog.refreshed_at,
+                "refreshes": self.tool_catalog.refreshes,
+                "interval": self.tool_catalog.interval,
+                "version": self.tool_catalog.version,
+                "agent_rebuilds": self.tool_rebuilds,
+            },
+            "llm_cache": cache.stats() if hasattr(cache, "stats") else None,
+            "compaction": compaction_stats.stats(),
+        }
+
+
+# 进程内共享的代理注册表
+agent_registry = AgentRegistry()
@@ -3,26 +3,44 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
-def create_summary_agent():
+from agents.compaction import compact_analysis_results
+from agents.llm_cache import cached_astream
+
+def build_report_prompt(analysis_results: dict):
+    """总结代理的提示词：分析结果先压缩为按分支分节的紧凑文本，并受总结代理的 token 预算约束"""
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content="你是一位专业的金融报告撰写人，请根据提供的分析结果，撰写一份完整、清晰的股票分析报告，并以Markdown格式输出。"),
+        HumanMessage(content=f"请根据以下分析结果撰写报告：\n{compact_analysis_results(analysis_results)}")
+    ])
+
+def create_summary_agent(model=None):
     """
     创建一个总结代理，用于将其他代理的分析结果整合成最终报告。
+    model 为空时使用 gpt-4o，可传入其他聊天模型（如测试用的假模型）。
+    返回的 generate_report 同步生成完整报告；generate_report.astream 逐段产出报告文本，供流式接口使用。
     """
-    model = ChatOpenAI(model="gpt-4o", temperature=0)
+    model = model or ChatOpenAI(model="gpt-4o", temperature=0)
 
     def generate_report(analysis_results: dict):
         """
         根据分析结果，生成最终的 Markdown 报告。
         """
-        prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content="你是一位专业的金融报告撰写人，请根据提供的分析结果，撰写一份完整、清晰的股票分析报告，并以Markdown格式输出。"),
-            HumanMessage(content=f"请根据以下分析结果撰写报告：\n{analysis_results}")
-        ])
+        prompt = build_report_prompt(analysis_results)
         
         chain = prompt | model
         report = chain.invoke({"analysis_results": analysis_results})
         
         return report.content
 
+    async def stream_report(analysis_results: dict):
+        """
+        根据分析结果流式生成报告，模型每产出一段文本就立即返回。
+        """
+        messages = build_report_prompt(analysis_results).format_messages()
+        async for text in cached_astream(model, messages):
+            yield text
+
+    generate_report.astream = stream_report
     return generate_report
 
 if __name__ == '__main__':
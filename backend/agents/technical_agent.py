@@ -3,17 +3,20 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
-from mcp_client import get_mcp_tools, call_mcp_tool
+from mcp_client import get_mcp_tools, acall_mcp_tool
+from agents.compaction import compact_tool_result
 
-def create_technical_agent():
+def create_technical_agent(model=None):
     """
     创建一个基于 ReAct 框架的技术面分析代理。
+    model 为空时使用 gpt-4o，可传入其他聊天模型（如测试用的假模型）。
     """
-    model = ChatOpenAI(model="gpt-4o", temperature=0)
+    model = model or ChatOpenAI(model="gpt-4o", temperature=0)
 
     # 简化工具定义，假定 MCP Server 提供了这些工具
-    def get_stock_k_data_tool(symbol: str):
-        return call_mcp_tool('get_stock_k_data', symbol=symbol)
+    async def get_stock_k_data_tool(symbol: str):
+        """获取股票历史日 K 线（开高低收量）"""
+        return compact_tool_result("technical", 'get_stock_k_data', await acall_mcp_tool('get_stock_k_data', symbol=symbol))
 
     tools = [get_stock_k_data_tool]
     
@@ -22,9 +25,9 @@ def create_technical_agent():
     请使用提供的工具获取所需数据，并以清晰、结构化的方式组织你的分析。
     """
     
-    technical_agent = create_react_agent(model, tools=tools, messages_modifier=[
-        SystemMessage(content=system_prompt)
-    ])
+    technical_agent = create_react_agent(
+        model, tools=tools, state_modifier=SystemMessage(content=system_prompt)
+    )
     
     return technical_agent
 
@@ -3,28 +3,32 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
-from mcp_client import get_mcp_tools, call_mcp_tool
+from mcp_client import get_mcp_tools, acall_mcp_tool
+from agents.compaction import compact_tool_result
 
-def create_valuation_agent():
+def create_valuation_agent(model=None):
     """
     创建一个基于 ReAct 框架的估值分析代理。
+    model 为空时使用 gpt-4o，可传入其他聊天模型（如测试用的假模型）。
     """
-    model = ChatOpenAI(model="gpt-4o", temperature=0)
+    model = model or ChatOpenAI(model="gpt-4o", temperature=0)
 
     # 简化工具定义，假定 MCP Server 提供了这些工具
-    def get_stock_valuation_tool(symbol: str):
-        return call_mcp_tool('get_stock_valuation', symbol=symbol)
+    async def get_stock_valuation_tool(symbol: str):
+        """获取估值结果：多阶段 DCF（含情景与敏感性矩阵）、P/E、EV/EBITDA、P/B、P/S 及同行业百分位与隐含价格"""
+        return compact_tool_result("valuation", 'get_stock_valuation', await acall_mcp_tool('get_stock_valuation', symbol=symbol))
 
     tools = [get_stock_valuation_tool]
     
     system_prompt = """你是一位专业的股票估值分析师，擅长使用提供的工具对公司及其股价进行估值。
     你的任务是基于用户的输入，评估一家公司是否值得买入，并给出你的理由。
+    估值数字由 get_stock_valuation 确定性地计算，请直接引用（百分位越低表示该倍数在同行中越便宜），不要自行重新估算。
     请使用提供的工具获取所需数据，并以清晰、结构化的方式组织你的分析。
     """
     
-    valuation_agent = create_react_agent(model, tools=tools, messages_modifier=[
-        SystemMessage(content=system_prompt)
-    ])
+    valuation_agent = create_react_agent(
+        model, tools=tools, state_modifier=SystemMessage(content=system_prompt)
+    )
     
     return valuation_agent
 
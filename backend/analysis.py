@@ -0,0 +1,87 @@
+"""
+分析结果打分
+投资建议、目标价/止损价、短期趋势、beta 风险分档与 AI 洞察由 analysis_rules.json 中的声明式规则给出：
+报价、基本面与技术指标先整批解析成列数组，再由规则引擎一次求值；单只股票分析与批量分析共用同一套规则。
+批量计算技术指标时按 K 线长度分组堆叠成矩阵
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import indicators
+from rules import RuleEngine
+
+# 规则配置文件，修改后下次分析时自动重新编译
+ANALYSIS_RULES_PATH = os.getenv("ANALYSIS_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_rules.json"))
+DEFAULT_BETA = 1.0
+
+# 规则可引用的字段；has_quote / has_indicators 为 0/1 标记
+RULE_NUMERIC_FIELDS = ("price", "change", "change_percent", "volume", "beta", "pe", "dividend_yield", "rsi", "has_quote", "has_indicators")
+RULE_TEXT_FIELDS = ("symbol", "sector")
+
+analysis_rules = RuleEngine(ANALYSIS_RULES_PATH, RULE_NUMERIC_FIELDS, RULE_TEXT_FIELDS)
+
+
+def _float(value: Any) -> float:
+    if value is None or value == "None":
+        return np.nan
+    try:
+        return float(str(value).replace("%", "")) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_beta(value: Any) -> float:
+    """解析 OVERVIEW 中的 beta：缺失或为 "None" 时取 1.0，无法解析时为 NaN"""
+    if value is None or value == "None":
+        return DEFAULT_BETA
+    return _float(value)
+
+
+def rule_inputs(quotes: List[Dict[str, Any]], overviews: List[Dict[str, Any]], technical_indicators: List[Optional[Dict[str, Any]]]) -> Dict[str, np.ndarray]:
+    """把一批报价、基本面与技术指标解析成规则引擎的输入列；字符串只在这里解析一次"""
+    quotes = [q if q and "error" not in q else {} for q in quotes]
+    overviews = [o if o and "error" not in o else {} for o in overviews]
+    technical_indicators = [t or {} for t in technical_indicators]
+    columns = {
+        field: np.array([_float(q.get(field)) for q in quotes], dtype=np.float64)
+        for field in ("price", "change", "change_percent", "volume")
+    }
+    columns["beta"] = np.array([parse_beta(o.get("beta")) for o in overviews], dtype=np.float64)
+    columns["pe"] = np.array([_float(o.get("pe_ratio")) for o in overviews], dtype=np.float64)
+    columns["dividend_yield"] = np.array([_float(o.get("dividend_yield")) for o in overviews], dtype=np.float64)
+    columns["rsi"] = np.array([_float(t.get("rsi")) for t in technical_indicators], dtype=np.float64)
+    columns["has_quote"] = np.array([bool(q) for q in quotes], dtype=np.float64)
+    columns["has_indicators"] = np.array([bool(t) for t in technical_indicators], dtype=np.float64)
+    columns["symbol"] = np.array([q.get("symbol", "") for q in quotes], dtype=object)
+    columns["sector"] = np.array([o.get("sector") or "" for o in overviews], dtype=object)
+    return columns
+
+
+def score_batch(quotes: List[Dict[str, Any]], overviews: List[Dict[str, Any]], technical_indicators: List[Optional[Dict[str, Any]]]) -> Dict[str, List[Any]]:
+    """对一批股票同时计算建议、目标价、止损价、短期趋势、风险分档与 AI 洞察"""
+    return analysis_rules.evaluate(rule_inputs(quotes, overviews, technical_indicators))
+
+
+def batch_latest_indicators(bars_list: List[Optional[Dict[str, np.ndarray]]]) -> List[Optional[Dict[str, float]]]:
+    """
+    计算一批股票的最新指标值。K 线长度相同的股票堆叠为 (股票数, K 线数) 矩阵一次算完，
+    bars 为 None 的位置返回 None。
+    """
+    results: List[Optional[Dict[str, float]]] = [None] * len(bars_list)
+    groups: Dict[int, List[int]] = {}
+    for i, bars in enumerate(bars_list):
+        if bars is not None:
+            groups.setdefault(len(bars["close"]), []).append(i)
+
+    for members in groups.values():
+        matrix = {
+            column: np.stack([indicators.as_float_array(bars_list[i][column]) for i in members])
+            for column in ("high", "low", "close", "volume")
+        }
+        latest = indicators.latest_values(indicators.compute_indicators(matrix))
+        for row, i in enumerate(members):
+            results[i] = {name: float(values[row]) for name, values in latest.items()}
+    return results
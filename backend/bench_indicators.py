@@ -0,0 +1,59 @@
+"""
+技术指标引擎基准测试
+用随机游走生成一批股票的日线，整批计算全部指标，输出每只股票的平均耗时（微秒），
+以及增量更新单根 K 线的耗时
+
+用法: python bench_indicators.py [股票数] [K 线数] [重复次数]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from indicators import compute_indicators, latest_values
+from streaming_indicators import SymbolIndicators
+
+
+def make_bars(symbols: int, length: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.02, size=(symbols, length)), axis=1))
+    spread = np.abs(rng.normal(0, 0.01, size=close.shape)) * close
+    return {
+        "open": close + rng.normal(0, 0.005, size=close.shape) * close,
+        "high": close + spread,
+        "low": close - spread,
+        "close": close,
+        "volume": rng.integers(100_000, 10_000_000, size=close.shape).astype(np.float64),
+    }
+
+
+def main():
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 252
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    bars = make_bars(symbols, length)
+
+    # 预热一次，排除首次分配内存的开销
+    latest_values(compute_indicators(bars))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        latest_values(compute_indicators(bars))
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"{symbols} 只股票 x {length} 根 K 线，最佳 {best * 1000:.1f} ms，每只股票 {best / symbols * 1e6:.1f} µs")
+
+    # 增量更新：每来一根新 K 线只做 O(1) 计算
+    state = SymbolIndicators.from_bars({column: values[0] for column, values in bars.items()})
+    ticks = bars["close"][1].tolist()
+    started = time.perf_counter()
+    for price in ticks:
+        state.update(price * 1.01, price * 0.99, price, 1_000_000.0)
+    elapsed = time.perf_counter() - started
+    print(f"增量更新 {len(ticks)} 次，每次 {elapsed / len(ticks) * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
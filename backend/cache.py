@@ -0,0 +1,153 @@
+"""
+行情数据缓存
+进程内 TTL + LRU 缓存，支持按 Alpha Vantage function 设置过期时间，
+并对同一 key 的并发请求做合并（single-flight），保证只产生一次上游调用。
+可挂载 Redis 二级缓存（见 redis_cache.py），在多个副本之间共享数据
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# 各 Alpha Vantage function 的缓存时间（秒）：报价以秒计，基本面以小时计
+FUNCTION_TTLS: Dict[str, float] = {
+    "GLOBAL_QUOTE": float(os.getenv("CACHE_TTL_QUOTE", "15")),
+    "OVERVIEW": float(os.getenv("CACHE_TTL_OVERVIEW", str(6 * 3600))),
+    "INCOME_STATEMENT": float(os.getenv("CACHE_TTL_FUNDAMENTALS", str(12 * 3600))),
+    "BALANCE_SHEET": float(os.getenv("CACHE_TTL_FUNDAMENTALS", str(12 * 3600))),
+    "CASH_FLOW": float(os.getenv("CACHE_TTL_FUNDAMENTALS", str(12 * 3600))),
+}
+DEFAULT_TTL = float(os.getenv("CACHE_TTL_DEFAULT", "60"))
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+
+_MISSING = object()
+
+
+def ttl_for(function: str) -> float:
+    """返回指定 function 的缓存时间"""
+    return FUNCTION_TTLS.get(function, DEFAULT_TTL)
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存，超出容量时淘汰最久未使用的条目"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # 可选的二级缓存（如 Redis），需实现 get_or_load(key, loader, ttl, cacheable) -> (value, ttl)
+        self.l2 = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，未命中或已过期时返回 default"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """写入缓存，必要时淘汰最久未使用的条目"""
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """删除指定缓存条目"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """清空缓存（不重置统计）"""
+        self._entries.clear()
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        命中则直接返回；否则调用 loader 加载并写入缓存。
+        同一 key 的并发调用共享同一次加载结果，loader 抛出的异常会传递给所有等待者且不会被缓存。
+        cacheable 用于过滤不应缓存的结果（例如上游限流提示）。
+        """
+        while True:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 发起加载的请求被取消时，等待者重新尝试而不是一起失败
+                if not inflight.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.l2 is not None:
+                value, ttl = await self.l2.get_or_load(key, loader, ttl, cacheable)
+            else:
+                value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            if cacheable is None or cacheable(value):
+                self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中、未命中、淘汰等统计信息"""
+        lookups = self.hits + self.misses
+        stats = {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+        if self.l2 is not None:
+            stats["l2"] = self.l2.stats()
+        return stats
+
+
+# 进程内共享的行情缓存实例
+market_cache = TTLCache()
@@ -0,0 +1,309 @@
+"""
+财务报表采集与财务比率预计算
+拉取 INCOME_STATEMENT、BALANCE_SHEET、CASH_FLOW 三张报表（未配置 API key 时读取本地 fixtures），
+按报告期对齐为列式数组保存在本地，并一次性向量化计算各期的盈利、成长、营运、偿债、现金流比率与杜邦分解。
+基本面代理通过 get_stock_financials 一次拿到算好的紧凑结果，不必在提示词里自己推导。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import market_data
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("MARKET_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+FIXTURE_DIR = os.getenv(
+    "FUNDAMENTALS_FIXTURE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "fundamentals"),
+)
+# 财报按季度更新，本地数据在这段时间（秒）内视为最新
+FUNDAMENTALS_REFRESH_SECONDS = float(os.getenv("FUNDAMENTALS_REFRESH_SECONDS", str(24 * 3600)))
+
+# 各报表需要保留的字段
+STATEMENT_FIELDS: Dict[str, tuple] = {
+    "INCOME_STATEMENT": (
+        "totalRevenue", "costOfRevenue", "grossProfit", "operatingIncome", "netIncome", "ebitda",
+        "interestExpense", "incomeTaxExpense",
+    ),
+    "BALANCE_SHEET": (
+        "totalAssets", "totalCurrentAssets", "inventory", "currentNetReceivables", "totalLiabilities",
+        "totalCurrentLiabilities", "totalShareholderEquity", "cashAndCashEquivalentsAtCarryingValue",
+        "shortTermDebt", "longTermDebt",
+    ),
+    "CASH_FLOW": ("operatingCashflow", "capitalExpenditures", "dividendPayout"),
+}
+STATEMENT_FUNCTIONS = tuple(STATEMENT_FIELDS)
+FIELDS = tuple(field for fields in STATEMENT_FIELDS.values() for field in fields)
+# 时期型（利润表、现金流量表）字段，季度口径下按最近四个季度滚动求和（TTM）
+FLOW_FIELDS = STATEMENT_FIELDS["INCOME_STATEMENT"] + STATEMENT_FIELDS["CASH_FLOW"]
+
+PERIODS = {"quarterly": "quarterlyReports", "annual": "annualReports"}
+# 同比比较间隔的期数
+_YOY_LAG = {"quarterly": 4, "annual": 1}
+
+RATIOS = (
+    "gross_margin", "operating_margin", "net_margin", "roe", "roa",
+    "revenue_growth_yoy", "net_income_growth_yoy",
+    "asset_turnover", "inventory_turnover", "receivables_turnover",
+    "debt_to_assets", "debt_to_equity", "current_ratio",
+    "operating_cash_flow", "free_cash_flow", "fcf_margin", "cash_conversion",
+)
+DUPONT = ("net_margin", "asset_turnover", "equity_multiplier", "roe")
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_statements(payloads: Dict[str, Dict[str, Any]], period: str = "quarterly") -> Dict[str, np.ndarray]:
+    """
+    把三张报表的原始 JSON 按报告期对齐为列式数组（按时间升序），
+    某张报表缺少某一期时该期对应字段为 NaN，"None" 等缺失值同样记为 NaN
+    """
+    key = PERIODS[period]
+    reports: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for function, payload in payloads.items():
+        for report in payload.get(key) or []:
+            date = report.get("fiscalDateEnding")
+            if date:
+                reports.setdefault(date, {})[function] = report
+    dates = sorted(reports)
+    table = {"fiscal_date": np.asarray(dates, dtype="datetime64[D]")}
+    for function, fields in STATEMENT_FIELDS.items():
+        for field in fields:
+            table[field] = np.asarray(
+                [_to_float(reports[date].get(function, {}).get(field)) for date in dates], dtype=np.float64
+            )
+    return table
+
+
+def _divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """逐元素相除，分母为 0 或 NaN 时结果为 NaN"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = numerator / denominator
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def _rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """按最近 window 期滚动求和，不足 window 期时为 NaN"""
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        result[window - 1:] = windows.sum(axis=1)
+    return result
+
+
+def _lagged(values: np.ndarray, lag: int) -> np.ndarray:
+    result = np.full(len(values), np.nan)
+    if lag < len(values):
+        result[lag:] = values[:-lag]
+    return result
+
+
+def _growth(values: np.ndarray, lag: int) -> np.ndarray:
+    """相对 lag 期之前的增长率；基期为负（如亏损）时按绝对值计算，方向与改善一致"""
+    previous = _lagged(values, lag)
+    return _divide(values - previous, np.abs(previous))
+
+
+def _average(values: np.ndarray) -> np.ndarray:
+    """期初期末平均余额，没有上一期数据时用期末余额"""
+    previous = _lagged(values, 1)
+    return np.where(np.isnan(previous), values, (values + previous) / 2)
+
+
+def compute_ratios(table: Dict[str, np.ndarray], period: str = "quarterly") -> Dict[str, np.ndarray]:
+    """
+    对所有报告期一次性计算财务比率。
+    季度口径下利润、收入、现金流取最近四个季度之和（TTM），与资产负债表余额相除时使用期初期末平均值，
+    杜邦分解满足 roe = net_margin × asset_turnover × equity_multiplier
+    """
+    window = 4 if period == "quarterly" else 1
+    flow = {field: _rolling_sum(table[field], window) for field in FLOW_FIELDS}
+    revenue = flow["totalRevenue"]
+    net_income = flow["netIncome"]
+    average_assets = _average(table["totalAssets"])
+    average_equity = _average(table["totalShareholderEquity"])
+    free_cash_flow = flow["operatingCashflow"] - np.abs(flow["capitalExpenditures"])
+    lag = _YOY_LAG[period]
+
+    ratios = {
+        "gross_margin": _divide(flow["grossProfit"], revenue),
+        "operating_margin": _divide(flow["operatingIncome"], revenue),
+        "net_margin": _divide(net_income, revenue),
+        "roe": _divide(net_income, average_equity),
+        "roa": _divide(net_income, average_assets),
+        # 同比增长比较单期数据，与上年同期相比
+        "revenue_growth_yoy": _growth(table["totalRevenue"], lag),
+        "net_income_growth_yoy": _growth(table["netIncome"], lag),
+        "asset_turnover": _divide(revenue, average_assets),
+        "inventory_turnover": _divide(flow["costOfRevenue"], _average(table["inventory"])),
+        "receivables_turnover": _divide(revenue, _average(table["currentNetReceivables"])),
+        "debt_to_assets": _divide(table["totalLiabilities"], table["totalAssets"]),
+        "debt_to_equity": _divide(table["totalLiabilities"], table["totalShareholderEquity"]),
+        "current_ratio": _divide(table["totalCurrentAssets"], table["totalCurrentLiabilities"]),
+        "operating_cash_flow": flow["operatingCashflow"],
+        "free_cash_flow": free_cash_flow,
+        "fcf_margin": _divide(free_cash_flow, revenue),
+        "cash_conversion": _divide(flow["operatingCashflow"], net_income),
+    }
+    ratios["equity_multiplier"] = _divide(average_assets, average_equity)
+    return ratios
+
+
+class FundamentalsStore:
+    """按 <root>/<period>/<SYMBOL>.npz 保存对齐后的报表数组，meta.json 记录拉取时间"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(DATA_DIR, "fundamentals")
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str, period: str) -> str:
+        return os.path.join(self.root, period, f"{symbol.upper()}.npz")
+
+    def load(self, symbol: str, period: str = "quarterly") -> Optional[Dict[str, np.ndarray]]:
+        path = self._path(symbol, period)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save(self, symbol: str, period: str, table: Dict[str, np.ndarray]):
+        path = self._path(symbol, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **table)
+            os.replace(tmp_path, path)
+
+    def read_meta(self, symbol: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.root, "meta", f"{symbol.upper()}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_meta(self, symbol: str, meta: Dict[str, Any]):
+        directory = os.path.join(self.root, "meta")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{symbol.upper()}.json"), "w") as f:
+            json.dump(meta, f)
+
+
+# 进程内共享的财报存储
+fundamentals_store = FundamentalsStore()
+
+
+def load_fixture(symbol: str, function: str) -> Optional[Dict[str, Any]]:
+    """读取离线 fixture：<FIXTURE_DIR>/<SYMBOL>/<FUNCTION>.json"""
+    try:
+        with open(os.path.join(FIXTURE_DIR, symbol.upper(), f"{function}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def query_fundamental(symbol: str, function: str) -> Dict[str, Any]:
+    """
+    获取一份基本面原始数据（OVERVIEW、三张报表等）：配置了 API key 时经共享缓存请求上游，
+    否则读取离线 fixture。出错时返回 {"error": ...}
+    """
+    if not market_data.ALPHA_VANTAGE_API_KEY:
+        payload = load_fixture(symbol, function)
+        return payload if payload is not None else {"error": "Alpha Vantage API key not configured"}
+    try:
+        data = await market_data.query_alpha_vantage(function, symbol)
+    except RateLimitExceeded as e:
+        return {"error": str(e), "rate_limited": True}
+    except Exception as e:
+        return {"error": f"API request failed: {str(e)}"}
+    if not market_data.is_cacheable_payload(data):
+        return {"error": market_data.upstream_error_message(data), "rate_limited": market_data.is_throttled_payload(data)}
+    return data
+
+
+async def _fetch_statements(symbol: str) -> Dict[str, Any]:
+    """拉取三张报表，返回 {"payloads": {function: payload}, "source": ...}；任一报表出错时返回该错误"""
+    results = await asyncio.gather(*(query_fundamental(symbol, function) for function in STATEMENT_FUNCTIONS))
+    for data in results:
+        if "error" in data:
+            return data
+    source = "Alpha Vantage API" if market_data.ALPHA_VANTAGE_API_KEY else "fixture"
+    return {"payloads": dict(zip(STATEMENT_FUNCTIONS, results)), "source": source}
+
+
+async def ingest_fundamentals(symbol: str, store: Optional[FundamentalsStore] = None, force: bool = False) -> Dict[str, Any]:
+    """拉取三张报表并按季度、年度两种口径写入本地存储；刚刚更新过的数据直接跳过"""
+    store = store or fundamentals_store
+    symbol = symbol.upper()
+    meta = store.read_meta(symbol)
+    if not force and store.load(symbol) is not None and time.time() - meta.get("fetched_at", 0) < FUNDAMENTALS_REFRESH_SECONDS:
+        return {"symbol": symbol, "fetched": False, "source": meta.get("source")}
+
+    fetched = await _fetch_statements(symbol)
+    if "error" in fetched:
+        return {"symbol": symbol, **fetched}
+    counts = {}
+    for period in PERIODS:
+        table = parse_statements(fetched["payloads"], period)
+        store.save(symbol, period, table)
+        counts[period] = len(table["fiscal_date"])
+    store.write_meta(symbol, {"fetched_at": time.time(), "source": fetched["source"]})
+    logger.info(f"{symbol} 财报更新: {counts}")
+    return {"symbol": symbol, "fetched": True, "source": fetched["source"], "periods": counts}
+
+
+def _column(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else round(float(value), 4) for value in values]
+
+
+def summarize(table: Dict[str, np.ndarray], period: str = "quarterly", limit: int = 4) -> Dict[str, Any]:
+    """最近 limit 期的报表摘要、比率与杜邦分解，均按时间倒序、以列为单位返回"""
+    ratios = compute_ratios(table, period)
+    order = slice(None, -limit - 1 if limit < len(table["fiscal_date"]) else None, -1)
+    return {
+        "period": period,
+        "fiscal_dates": np.datetime_as_string(table["fiscal_date"][order]).tolist(),
+        "statements": {
+            field: _column(table[field][order])
+            for field in ("totalRevenue", "grossProfit", "operatingIncome", "netIncome", "totalAssets",
+                          "totalLiabilities", "totalShareholderEquity", "operatingCashflow", "capitalExpenditures")
+        },
+        "ratios": {name: _column(ratios[name][order]) for name in RATIOS},
+        "dupont": {name: _column(ratios[name][order]) for name in DUPONT},
+    }
+
+
+async def get_financials(
+    symbol: str,
+    period: str = "quarterly",
+    limit: int = 4,
+    store: Optional[FundamentalsStore] = None,
+) -> Dict[str, Any]:
+    """先按需更新本地财报，再返回预计算好的比率；上游不可用时仍返回已有的本地数据"""
+    if period not in PERIODS:
+        return {"error": f"不支持的报告期: {period}"}
+    store = store or fundamentals_store
+    result = await ingest_fundamentals(symbol, store=store)
+    table = store.load(symbol, period)
+    if table is None or not len(table["fiscal_date"]):
+        return result if "error" in result else {"error": f"{symbol.upper()} 没有财报数据"}
+    response = {"symbol": symbol.upper(), **summarize(table, period, max(limit, 1))}
+    if "error" in result:
+        response["stale"] = True
+        response["refresh_error"] = result["error"]
+    return response
@@ -0,0 +1,195 @@
+"""
+向量化技术指标引擎
+所有指标都作用于 float64 数组的最后一个轴：一维数组为单只股票，
+二维数组 (股票数, K 线数) 可一次性计算整批股票，没有逐根 K 线的 Python 循环。
+输出与输入等长，数据不足的位置为 NaN。
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# 分块计算指数平滑时允许的最大放大倍数，保证 (1 - alpha) ** -n 不溢出且精度可控
+_MAX_GROWTH_LOG = 100 * np.log(10)
+
+
+def as_float_array(values) -> np.ndarray:
+    """转换为连续的 float64 数组（已满足要求时不拷贝）"""
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def _nan_like(x: np.ndarray) -> np.ndarray:
+    return np.full(x.shape, np.nan, dtype=np.float64)
+
+
+def _ewm(x: np.ndarray, alpha: float, seed: np.ndarray) -> np.ndarray:
+    """
+    y[t] = (1 - alpha) * y[t-1] + alpha * x[t]，y[-1] = seed。
+    利用闭式解 y[t] = d^(t+1) * (seed + alpha * sum(x[k] / d^(k+1)))（d = 1 - alpha）按块求解，
+    块长度保证 d 的负幂不溢出，块间只传递最后一个值。
+    """
+    decay = 1.0 - alpha
+    n = x.shape[-1]
+    out = np.empty_like(x)
+    if n == 0:
+        return out
+    if decay <= 0.0:
+        out[...] = x
+        return out
+
+    block = max(1, min(n, int(_MAX_GROWTH_LOG / -np.log(decay))))
+    powers = decay ** np.arange(1, block + 1, dtype=np.float64)
+    state = np.asarray(seed, dtype=np.float64)
+    for start in range(0, n, block):
+        chunk = x[..., start:start + block]
+        p = powers[:chunk.shape[-1]]
+        acc = np.cumsum(chunk / p, axis=-1) * alpha
+        out[..., start:start + block] = p * (state[..., None] + acc)
+        state = out[..., start + chunk.shape[-1] - 1]
+    return out
+
+
+def _seeded_ewm(x: np.ndarray, window: int, alpha: float, start: int = 0) -> np.ndarray:
+    """
+    以 x[start:start+window] 的简单均值作为首个值，随后按 alpha 递推（TA-Lib 的 EMA/Wilder 约定）。
+    start 用于跳过输入开头本身就是 NaN 的部分。
+    """
+    out = _nan_like(x)
+    first = start + window - 1
+    if window < 1 or first >= x.shape[-1]:
+        return out
+    seed = x[..., start:first + 1].mean(axis=-1)
+    out[..., first] = seed
+    out[..., first + 1:] = _ewm(x[..., first + 1:], alpha, seed)
+    return out
+
+
+def sma(x, window: int) -> np.ndarray:
+    """简单移动平均"""
+    x = as_float_array(x)
+    out = _nan_like(x)
+    n = x.shape[-1]
+    if window < 1 or window > n:
+        return out
+    # 先减去首个值再累加，降低长序列的累计误差
+    base = x[..., :1]
+    csum = np.cumsum(x - base, axis=-1)
+    out[..., window - 1] = csum[..., window - 1]
+    out[..., window:] = csum[..., window:] - csum[..., :-window]
+    out[..., window - 1:] = out[..., window - 1:] / window + base
+    return out
+
+
+def ema(x, span: int) -> np.ndarray:
+    """指数移动平均，alpha = 2 / (span + 1)，以前 span 个值的均值作为起点"""
+    x = as_float_array(x)
+    return _seeded_ewm(x, span, 2.0 / (span + 1))
+
+
+def wilder(x, period: int, start: int = 0) -> np.ndarray:
+    """Wilder 平滑（alpha = 1 / period），用于 RSI 与 ATR"""
+    x = as_float_array(x)
+    return _seeded_ewm(x, period, 1.0 / period, start)
+
+
+def rsi(close, period: int = 14) -> np.ndarray:
+    """Wilder RSI，第一个有效值位于下标 period"""
+    close = as_float_array(close)
+    out = _nan_like(close)
+    if close.shape[-1] <= period:
+        return out
+    delta = np.diff(close, axis=-1)
+    avg_gain = wilder(np.maximum(delta, 0.0), period)
+    avg_loss = wilder(np.maximum(-delta, 0.0), period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    # 无下跌时 RSI 为 100，完全无波动时取中性值 50
+    value = np.where(avg_loss == 0.0, np.where(avg_gain == 0.0, 50.0, 100.0), value)
+    value[np.isnan(avg_gain)] = np.nan
+    out[..., 1:] = value
+    return out
+
+
+def macd(close, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MACD 线、信号线与柱状图"""
+    close = as_float_array(close)
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = _seeded_ewm(line, signal, 2.0 / (signal + 1), start=slow - 1)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, window: int = 20, num_std: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """布林带（上轨、中轨、下轨），标准差为总体标准差"""
+    close = as_float_array(close)
+    middle = sma(close, window)
+    # 以首个值为基准做平移后用滚动一阶、二阶矩求方差，避免大数相减带来的精度损失
+    shifted = close - close[..., :1]
+    mean = middle - close[..., :1]
+    std = np.sqrt(np.maximum(sma(shifted * shifted, window) - mean * mean, 0.0))
+    return middle + num_std * std, middle, middle - num_std * std
+
+
+def true_range(high, low, close) -> np.ndarray:
+    """真实波幅，第一根 K 线没有前收盘价，取最高价减最低价"""
+    high, low, close = as_float_array(high), as_float_array(low), as_float_array(close)
+    tr = high - low
+    prev_close = close[..., :-1]
+    tr[..., 1:] = np.maximum(
+        tr[..., 1:],
+        np.maximum(np.abs(high[..., 1:] - prev_close), np.abs(low[..., 1:] - prev_close)),
+    )
+    return tr
+
+
+def atr(high, low, close, period: int = 14) -> np.ndarray:
+    """平均真实波幅（Wilder），从第二根 K 线开始累计，第一个有效值位于下标 period"""
+    return wilder(true_range(high, low, close), period, start=1)
+
+
+def obv(close, volume) -> np.ndarray:
+    """能量潮，首根 K 线为 0"""
+    close, volume = as_float_array(close), as_float_array(volume)
+    signed = np.zeros_like(volume)
+    signed[..., 1:] = np.sign(np.diff(close, axis=-1)) * volume[..., 1:]
+    return np.cumsum(signed, axis=-1)
+
+
+def vwap(high, low, close, volume, window: Optional[int] = None) -> np.ndarray:
+    """成交量加权均价（典型价），window 为空时从序列起点累计，否则为滚动窗口"""
+    high, low, close, volume = (as_float_array(v) for v in (high, low, close, volume))
+    typical = (high + low + close) / 3.0
+    if window is None:
+        pv = np.cumsum(typical * volume, axis=-1)
+        vol = np.cumsum(volume, axis=-1)
+    else:
+        pv = sma(typical * volume, window)
+        vol = sma(volume, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(vol > 0, pv / vol, np.nan)
+
+
+def compute_indicators(
+    bars: Dict[str, np.ndarray],
+    ma_windows: Tuple[int, ...] = (20, 50),
+    rsi_period: int = 14,
+    vwap_window: int = 20,
+) -> Dict[str, np.ndarray]:
+    """
+    对一只或一批股票计算整套指标，返回完整序列。
+    bars 需包含 open/high/low/close/volume，可为一维或同形状的二维数组。
+    """
+    high, low, close, volume = (as_float_array(bars[c]) for c in ("high", "low", "close", "volume"))
+    result = {f"sma_{w}": sma(close, w) for w in ma_windows}
+    result.update({f"ema_{w}": ema(close, w) for w in ma_windows})
+    result["rsi"] = rsi(close, rsi_period)
+    result["macd"], result["macd_signal"], result["macd_histogram"] = macd(close)
+    result["bollinger_upper"], result["bollinger_middle"], result["bollinger_lower"] = bollinger(close)
+    result["atr"] = atr(high, low, close)
+    result["obv"] = obv(close, volume)
+    result["vwap"] = vwap(high, low, close, volume, vwap_window)
+    return result
+
+
+def latest_values(series: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """取每个指标的最后一个值；二维输入时得到每只股票一个值的数组"""
+    return {name: values[..., -1] for name, values in series.items()}
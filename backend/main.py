@@ -1,12 +1,52 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import asyncio
 import subprocess
 import os
-import requests
 import json
 from datetime import datetime
+from typing import List, Literal, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from agents.registry import agent_registry
+from analysis import analysis_rules, batch_latest_indicators, score_batch
+from cache import market_cache
+from rate_limiter import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_DEFAULT,
+    PRIORITY_INTERACTIVE,
+    priority_scope,
+    upstream_scheduler,
+)
+from quote_feed import MAX_SUBSCRIPTIONS, FeedSubscriber, QuoteFeed
+from price_history import SERIES_FUNCTIONS, get_price_history, history_store, ingest_history
+from redis_cache import close_redis_tier, configure_redis_tier
+from streaming import bounded_map, invalid_stream_format, stream_response
+from streaming_indicators import live_indicators
+from mcp_client import close_mcp_client
+from persistence import persistence
+from portfolio import DEFAULT_PORTFOLIO, PortfolioError, portfolio_manager
+from mcp_tools import registry as mcp_tool_registry
+from valuation import get_valuation, value_sector
+from screener import ScreenExpressionError, screener
+from market_data import (
+    ALPHA_VANTAGE_API_KEY,
+    close_http_client,
+    get_company_overview,
+    get_company_overviews,
+    get_stock_quote,
+    get_stock_quotes,
+)
+
+# 批量分析单次允许的最大股票数
+BATCH_MAX_SYMBOLS = int(os.getenv("BATCH_MAX_SYMBOLS", "500"))
+# 流式分析时同时在途的股票数
+STREAM_CONCURRENCY = int(os.getenv("STREAM_CONCURRENCY", "8"))
+# 流式市场扫描的观察池
+MARKET_UNIVERSE = [s.strip().upper() for s in os.getenv("MARKET_UNIVERSE", "AAPL,GOOGL,MSFT,TSLA,AMZN").split(",") if s.strip()]
 
 app = FastAPI(
     title="Agentic Stock System API",
@@ -14,79 +54,55 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Alpha Vantage API 配置
-ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY")
-BASE_URL = "https://www.alphavantage.co/query"
+# 计算完整技术指标所需的最少 K 线数量（MA50）
+MIN_HISTORY_BARS = 50
 
-def get_stock_quote(symbol: str):
-    """获取股票实时报价"""
-    if not ALPHA_VANTAGE_API_KEY:
-        return {"error": "Alpha Vantage API key not configured"}
-    
-    params = {
-        "function": "GLOBAL_QUOTE",
-        "symbol": symbol,
-        "apikey": ALPHA_VANTAGE_API_KEY
+def _rounded(value, digits=2):
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+def format_indicators(latest):
+    """把最新指标值整理为接口返回结构"""
+    histogram = float(latest["macd_histogram"])
+    return {
+        "rsi": _rounded(latest["rsi"], 1),
+        "macd": "positive" if histogram > 0 else "negative",
+        "macd_value": _rounded(latest["macd"], 4),
+        "macd_signal": _rounded(latest["macd_signal"], 4),
+        "macd_histogram": _rounded(histogram, 4),
+        "moving_average_20": _rounded(latest["sma_20"]),
+        "moving_average_50": _rounded(latest["sma_50"]),
+        "ema_20": _rounded(latest["ema_20"]),
+        "bollinger_upper": _rounded(latest["bollinger_upper"]),
+        "bollinger_lower": _rounded(latest["bollinger_lower"]),
+        "atr": _rounded(latest["atr"]),
+        "obv": _rounded(latest["obv"], 0),
+        "vwap_20": _rounded(latest["vwap"]),
+        "source": "history",
     }
-    
-    try:
-        response = requests.get(BASE_URL, params=params, timeout=10)
-        data = response.json()
-        
-        if "Global Quote" in data:
-            quote = data["Global Quote"]
-            return {
-                "symbol": quote.get("01. symbol", symbol),
-                "price": float(quote.get("05. price", 0)),
-                "change": float(quote.get("09. change", 0)),
-                "change_percent": quote.get("10. change percent", "0%").replace("%", ""),
-                "volume": int(quote.get("06. volume", 0)),
-                "high": float(quote.get("03. high", 0)),
-                "low": float(quote.get("04. low", 0)),
-                "open": float(quote.get("02. open", 0)),
-                "previous_close": float(quote.get("08. previous close", 0))
-            }
-        else:
-            return {"error": f"Failed to get data for {symbol}: {data.get('Note', 'Unknown error')}"}
-    except Exception as e:
-        return {"error": f"API request failed: {str(e)}"}
 
-def get_company_overview(symbol: str):
-    """获取公司基本面信息"""
-    if not ALPHA_VANTAGE_API_KEY:
-        return {"error": "Alpha Vantage API key not configured"}
-    
-    params = {
-        "function": "OVERVIEW",
-        "symbol": symbol,
-        "apikey": ALPHA_VANTAGE_API_KEY
+def _live_bar(price_data):
+    """把实时报价视为当日尚未收盘的一根 K 线"""
+    if not price_data or "price" not in price_data or not price_data.get("latest_trading_day"):
+        return None, None
+    bar = {
+        "high": float(price_data.get("high") or price_data["price"]),
+        "low": float(price_data.get("low") or price_data["price"]),
+        "close": float(price_data["price"]),
+        "volume": float(price_data.get("volume", 0)),
     }
-    
-    try:
-        response = requests.get(BASE_URL, params=params, timeout=10)
-        data = response.json()
-        
-        if "Symbol" in data:
-            return {
-                "symbol": data.get("Symbol", symbol),
-                "name": data.get("Name", ""),
-                "sector": data.get("Sector", ""),
-                "industry": data.get("Industry", ""),
-                "market_cap": data.get("MarketCapitalization", ""),
-                "pe_ratio": data.get("PERatio", ""),
-                "dividend_yield": data.get("DividendYield", ""),
-                "beta": data.get("Beta", ""),
-                "52_week_high": data.get("52WeekHigh", ""),
-                "52_week_low": data.get("52WeekLow", ""),
-                "description": data.get("Description", "")
-            }
-        else:
-            return {"error": f"Failed to get overview for {symbol}: {data.get('Note', 'Unknown error')}"}
-    except Exception as e:
-        return {"error": f"API request failed: {str(e)}"}
+    return bar, int(np.datetime64(price_data["latest_trading_day"], "s").astype(np.int64))
+
+def calculate_technical_indicators(price_data, bars=None):
+    """
+    计算技术指标：有足够的历史 K 线时基于真实数据，否则退化为基于单次报价的估算。
+    指标状态按股票常驻内存，只增量计入新的 K 线，盘中报价以 O(1) 预览叠加到最新一根上。
+    """
+    if bars is not None and len(bars["close"]) >= MIN_HISTORY_BARS:
+        live_bar, live_timestamp = _live_bar(price_data)
+        latest = live_indicators.evaluate(price_data["symbol"], bars, live_bar, live_timestamp)
+        return format_indicators(latest)
 
-def calculate_technical_indicators(price_data):
-    """计算技术指标（简化版本）"""
     if not price_data or "price" not in price_data:
         return {}
     
@@ -108,58 +124,82 @@ def calculate_technical_indicators(price_data):
         "rsi": round(rsi, 1),
         "macd": macd,
         "moving_average_20": round(ma_20, 2),
-        "moving_average_50": round(ma_50, 2)
+        "moving_average_50": round(ma_50, 2),
+        "source": "estimated"
     }
 
-def generate_ai_insights(quote_data, overview_data, technical_indicators):
-    """生成 AI 洞察"""
-    insights = []
-    
-    if "error" not in quote_data:
-        price = quote_data.get("price", 0)
-        change_percent = float(quote_data.get("change_percent", 0))
-        volume = quote_data.get("volume", 0)
-        
-        # 基于价格变化的洞察
-        if change_percent > 2:
-            insights.append("股价大幅上涨，成交量活跃，市场情绪积极")
-        elif change_percent < -2:
-            insights.append("股价出现回调，建议关注支撑位")
-        else:
-            insights.append("股价相对稳定，市场观望情绪浓厚")
-        
-        # 基于成交量的洞察
-        if volume > 1000000:
-            insights.append("成交量放大，表明市场关注度较高")
-        else:
-            insights.append("成交量相对较低，市场参与度一般")
-    
-    # 基于技术指标的洞察
-    if technical_indicators:
-        rsi = technical_indicators.get("rsi", 50)
-        if rsi > 70:
-            insights.append("RSI 指标显示超买，短期可能存在回调风险")
-        elif rsi < 30:
-            insights.append("RSI 指标显示超卖，可能存在反弹机会")
-        else:
-            insights.append("RSI 指标处于正常区间，技术面相对健康")
-    
-    # 基于基本面的洞察
-    if "error" not in overview_data and overview_data.get("sector"):
-        sector = overview_data.get("sector", "")
-        pe_ratio = overview_data.get("pe_ratio", "")
-        
-        if pe_ratio and pe_ratio != "None":
-            try:
-                pe = float(pe_ratio)
-                if pe < 15:
-                    insights.append(f"{sector} 行业估值偏低，具有投资价值")
-                elif pe > 25:
-                    insights.append(f"{sector} 行业估值偏高，需谨慎投资")
-            except:
-                pass
-    
-    return insights[:4]  # 返回最多4个洞察
+def mock_quote(symbol):
+    """Alpha Vantage 不可用时的模拟报价"""
+    return {
+        "symbol": symbol,
+        "price": 150.0 + hash(symbol) % 100,
+        "change": (hash(symbol) % 20) - 10,
+        "change_percent": str(((hash(symbol) % 20) - 10) * 0.1),
+        "volume": 1000000 + hash(symbol) % 5000000,
+        "high": 160.0,
+        "low": 140.0,
+        "open": 155.0,
+        "previous_close": 145.0
+    }
+
+def mock_overview(symbol):
+    """Alpha Vantage 不可用时的模拟公司信息"""
+    return {
+        "symbol": symbol,
+        "name": f"{symbol} Inc.",
+        "sector": "Technology",
+        "industry": "Software",
+        "market_cap": "1000000000",
+        "pe_ratio": "25.5",
+        "dividend_yield": "2.1",
+        "beta": "1.2",
+        "52_week_high": "200.0",
+        "52_week_low": "100.0",
+        "description": f"模拟的 {symbol} 公司信息"
+    }
+
+def build_analysis(symbol, quote_data, overview_data, technical_indicators, scores, i):
+    """组装单只股票的分析结果；scores 为 score_batch 的输出（含 AI 洞察），i 为该股票在批次中的下标"""
+    return {
+        "symbol": symbol,
+        "real_time_data": quote_data,
+        "company_info": overview_data if "error" not in overview_data else None,
+        "analysis": {
+            "technical_indicators": technical_indicators,
+            "trend_analysis": {
+                "short_term": scores["short_term"][i],
+                "medium_term": "基于技术指标分析",
+                "long_term": "基于基本面分析"
+            },
+            "risk_assessment": {
+                "volatility": scores["risk_level"][i],
+                "risk_level": scores["risk_level"][i],
+                "beta": scores["beta"][i]
+            },
+            "ai_insights": scores["insights"][i],
+            "recommendation": {
+                "action": scores["action"][i],
+                "confidence": scores["confidence"][i],
+                "target_price": scores["target_price"][i],
+                "stop_loss": scores["stop_loss"][i]
+            }
+        }
+    }
+
+class PortfolioTransactionRequest(BaseModel):
+    symbol: str
+    quantity: float
+    price: float
+    side: Literal["buy", "sell"] = "buy"
+    fees: float = 0.0
+    # 成交时间（Unix 秒），默认为当前时间；不能早于该组合最后一笔交易
+    timestamp: Optional[float] = None
+    portfolio: str = DEFAULT_PORTFOLIO
+
+class BatchAnalysisRequest(BaseModel):
+    symbols: List[str]
+    # 是否同时增量更新历史 K 线（会额外消耗上游配额）
+    refresh_history: bool = False
 
 # 配置 CORS
 app.add_middleware(
@@ -170,6 +210,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_event():
+    """编译分析规则；配置 REDIS_URL 时启用分布式二级缓存；在后台定期刷新 MCP 工具列表与选股数据；启动持久化写入任务"""
+    # 规则文件无效时直接启动失败，而不是在第一次分析时才报错
+    analysis_rules.reload()
+    configure_redis_tier()
+    try:
+        await persistence.start()
+        history_store.listeners.append(persistence.record_bars)
+    except Exception as e:
+        print(f"持久化存储不可用，分析结果与报价将不会落库: {e}")
+    history_store.listeners.append(portfolio_manager.on_bars)
+    agent_registry.tool_catalog.start()
+    screener.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止报价推送，写完待持久化的记录，关闭共享的上游、MCP HTTP 连接池、数据库与 Redis 连接"""
+    await quote_feed.close()
+    for listener in (persistence.record_bars, portfolio_manager.on_bars):
+        if listener in history_store.listeners:
+            history_store.listeners.remove(listener)
+    await persistence.close()
+    await screener.stop()
+    await agent_registry.tool_catalog.stop()
+    await close_mcp_client()
+    await close_http_client()
+    await close_redis_tier()
+
 @app.get("/")
 async def root():
     """根路径，用于验证服务是否启动"""
@@ -206,8 +275,11 @@ async def get_realtime_stocks():
     symbols = ["AAPL", "GOOGL", "MSFT", "TSLA", "AMZN"]
     stocks_data = []
     
-    for symbol in symbols:
-        quote_data = get_stock_quote(symbol)
+    # 并发拉取所有报价，整体耗时约等于最慢的一次请求；看板刷新属于后台任务，让位于交互式分析
+    with priority_scope(PRIORITY_BACKGROUND):
+        quotes = await get_stock_quotes(symbols)
+    simulated = []
+    for symbol, quote_data in zip(symbols, quotes):
         if "error" not in quote_data:
             stocks_data.append({
                 "symbol": quote_data["symbol"],
@@ -221,6 +293,7 @@ async def get_realtime_stocks():
             })
         else:
             # 如果 API 失败，使用模拟数据
+            simulated.append(symbol)
             stocks_data.append({
                 "symbol": symbol,
                 "price": 150.0 + hash(symbol) % 100,
@@ -235,9 +308,171 @@ async def get_realtime_stocks():
     return {
         "stocks": stocks_data,
         "timestamp": datetime.now().isoformat() + "Z",
-        "data_source": "Alpha Vantage API" if ALPHA_VANTAGE_API_KEY else "Simulated Data"
+        "data_source": "Simulated Data" if len(simulated) == len(symbols) else "Alpha Vantage API",
+        "simulated_symbols": simulated
     }
 
+@app.get("/api/stocks/{symbol}/history")
+async def get_stock_history(symbol: str, interval: str = "daily", limit: int = 100):
+    """获取历史 K 线：增量拉取比本地更新的数据后，从本地列式存储读取"""
+    if interval not in SERIES_FUNCTIONS:
+        return {"error": f"不支持的周期: {interval}", "status": "error"}
+    with priority_scope(PRIORITY_INTERACTIVE):
+        return await get_price_history(symbol, interval, limit)
+
+def observe_market_data(symbol, quote_data, overview_data=None, technical_indicators=None):
+    """把拉取到的报价、基本面与指标写入选股表，报价同时记录到持久化存储（未变化的报价不重复写入）并为持仓盯市"""
+    persistence.record_quote(quote_data)
+    portfolio_manager.on_quote(quote_data)
+    screener.update_quote(quote_data)
+    if overview_data:
+        screener.update_overview(overview_data)
+    if technical_indicators:
+        screener.update_indicators(symbol, technical_indicators)
+
+async def fetch_and_record_quote(symbol):
+    """报价推送的轮询函数：拉取报价后写入选股表与持久化存储"""
+    quote = await get_stock_quote(symbol)
+    observe_market_data(symbol, quote)
+    return quote
+
+@app.get("/api/stocks/{symbol}/valuation")
+async def get_stock_valuation(symbol: str):
+    """估值：多阶段 DCF（含情景与敏感性矩阵）、估值倍数、同行业百分位与隐含价格"""
+    with priority_scope(PRIORITY_INTERACTIVE):
+        return await get_valuation(symbol)
+
+@app.get("/api/valuation/sector")
+async def get_sector_valuation(sector: str):
+    """对观察池中某个行业的全部公司一次性估值，按上行空间排序"""
+    with priority_scope(PRIORITY_DEFAULT):
+        return await value_sector(sector)
+
+# 所有 WebSocket 连接共享的报价轮询
+quote_feed = QuoteFeed(fetch_and_record_quote)
+
+async def _send_quote_updates(websocket: WebSocket, subscriber: FeedSubscriber):
+    """把订阅者合并后的更新发给客户端；发送阻塞期间新的更新会继续合并"""
+    while True:
+        batch = await subscriber.next_batch()
+        for message in batch.values():
+            await websocket.send_json(message)
+
+@app.websocket("/api/ws/quotes")
+async def quotes_websocket(websocket: WebSocket):
+    """
+    实时报价推送。客户端发送 {"action": "subscribe" | "unsubscribe", "symbols": [...]}，
+    服务端先推送 snapshot，之后只推送发生变化的字段（update）
+    """
+    await websocket.accept()
+    subscriber = FeedSubscriber()
+    sender = asyncio.ensure_future(_send_quote_updates(websocket, subscriber))
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict) or not isinstance(message.get("symbols", []), list):
+                await websocket.send_json({"type": "error", "error": "消息必须是对象，且 symbols 必须是数组"})
+                continue
+            action = message.get("action")
+            symbols = [str(s).strip().upper() for s in message.get("symbols", []) if str(s).strip()]
+            if action == "subscribe":
+                if len(subscriber.symbols | set(symbols)) > MAX_SUBSCRIPTIONS:
+                    await websocket.send_json({"type": "error", "error": f"单个连接最多订阅 {MAX_SUBSCRIPTIONS} 只股票"})
+                    continue
+                for symbol in symbols:
+                    quote_feed.subscribe(subscriber, symbol)
+            elif action == "unsubscribe":
+                for symbol in symbols:
+                    quote_feed.unsubscribe(subscriber, symbol)
+            else:
+                await websocket.send_json({"type": "error", "error": f"未知操作: {action}"})
+                continue
+            await websocket.send_json({"type": "subscribed", "symbols": sorted(subscriber.symbols)})
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        quote_feed.disconnect(subscriber)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+@app.get("/api/stocks/{symbol}/quotes/history")
+async def get_quote_history(symbol: str, since: Optional[float] = None, limit: int = 100):
+    """已记录的报价历史（按时间倒序），since 为 Unix 秒"""
+    try:
+        return {"symbol": symbol.upper(), "quotes": await persistence.quote_history(symbol, since, min(limit, 1000))}
+    except Exception as e:
+        return {"error": str(e), "status": "error"}
+
+@app.get("/api/stocks/{symbol}/analyses")
+async def get_analysis_history(symbol: str, kind: Optional[str] = None, limit: int = 20):
+    """已记录的分析结果快照（按时间倒序），kind 可选 stock / batch / stream / report"""
+    try:
+        return {"symbol": symbol.upper(), "analyses": await persistence.analysis_history(symbol, min(limit, 200), kind)}
+    except Exception as e:
+        return {"error": str(e), "status": "error"}
+
+@app.get("/api/persistence/stats")
+async def persistence_stats():
+    """持久化写入队列深度、批次数、丢弃数与最近一次写入耗时"""
+    return persistence.stats()
+
+@app.get("/api/screen")
+async def screen_stocks(
+    filter: str = "",
+    sort: Optional[str] = None,
+    descending: bool = False,
+    limit: int = 50,
+    fields: Optional[str] = None,
+):
+    """
+    横截面选股：filter 为筛选表达式，如 sector == "TECHNOLOGY" and pe < 15 and rsi < 30 and volume > 1M，
+    支持 and/or/not、链式比较与 in [...]；sort 为排序字段，fields 为逗号分隔的附加返回字段
+    """
+    try:
+        extra = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        return screener.screen(filter, sort=sort, descending=descending, limit=limit, fields=extra)
+    except ScreenExpressionError as e:
+        return {"error": str(e), "status": "error"}
+
+@app.get("/api/screen/stats")
+async def screen_stats():
+    """选股表的股票数、刷新次数与排序索引重建次数"""
+    return screener.stats()
+
+@app.get("/api/rules")
+async def rules_status():
+    """当前生效的分析规则版本、加载时间与最近一次重新加载的错误"""
+    return analysis_rules.stats()
+
+@app.post("/api/rules/reload")
+async def reload_rules():
+    """立即重新读取并编译规则文件；新配置无效时继续使用旧规则并返回错误"""
+    analysis_rules.reload(force=True)
+    stats = analysis_rules.stats()
+    if stats["last_error"]:
+        return {"error": stats["last_error"], "status": "error", **stats}
+    return {"status": "success", **stats}
+
+@app.get("/api/ws/quotes/stats")
+async def quote_feed_stats():
+    """报价推送的订阅与轮询统计"""
+    return quote_feed.stats()
+
+@app.get("/api/agents/stats")
+async def agent_stats():
+    """代理构建统计：冷启动与复用耗时、MCP 工具列表刷新情况、LLM 调用缓存命中率与节省的 token 数、输入压缩前后的 token 数"""
+    return agent_registry.stats()
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """行情缓存命中率与淘汰统计"""
+    return market_cache.stats()
+
+@app.get("/api/upstream/stats")
+async def upstream_stats():
+    """Alpha Vantage 调用配额、排队深度与等待时间"""
+    return upstream_scheduler.stats()
+
 @app.get("/api/mcp/status")
 async def mcp_status():
     """MCP 服务器状态检查"""
@@ -253,270 +488,340 @@ async def mcp_status():
 
 @app.get("/api/mcp/tools")
 async def list_mcp_tools():
-    """列出 MCP 可用工具"""
-    return {
-        "tools": [
-            {
-                "name": "get_stock_info",
-                "description": "获取股票信息",
-                "parameters": ["symbol"]
-            },
-            {
-                "name": "analyze_market", 
-                "description": "分析市场趋势",
-                "parameters": ["timeframe"]
-            },
-            {
-                "name": "get_portfolio_status",
-                "description": "获取投资组合状态",
-                "parameters": []
-            }
-        ]
+    """列出 MCP 可用工具（与 MCP Server 共用同一个工具注册表）"""
+    return {"tools": mcp_tool_registry.list_tools()}
+
+def build_stock_report(symbol, quote_data, overview_data):
+    """根据已拉取的报价与基本面生成完整分析；报价失败时回退到模拟数据"""
+    # 检查是否有错误，如果有错误则使用模拟数据
+    fallback_reason = None
+    rate_limited = False
+    if "error" in quote_data:
+        fallback_reason = quote_data["error"]
+        rate_limited = bool(quote_data.get("rate_limited"))
+        print(f"API 失败，使用模拟数据: {quote_data['error']}")
+        quote_data = mock_quote(symbol)
+        overview_data = mock_overview(symbol)
+    
+    # 计算技术指标（读取本地 K 线，不访问网络）
+    technical_indicators = calculate_technical_indicators(quote_data, history_store.load(symbol, "daily"))
+    
+    # 投资建议、趋势与风险评估
+    scores = score_batch([quote_data], [overview_data], [technical_indicators])
+    
+    report = {
+        **build_analysis(symbol, quote_data, overview_data, technical_indicators, scores, 0),
+        "timestamp": datetime.now().isoformat() + "Z",
+        "status": "success",
+        "data_source": "模拟数据 (Alpha Vantage API 不可用)" if fallback_reason else "Alpha Vantage API",
+        "fallback_reason": fallback_reason,
+        "rate_limited": rate_limited
     }
+    # 模拟数据不落库，也不进入选股表
+    if not fallback_reason:
+        observe_market_data(symbol, quote_data, overview_data, technical_indicators)
+        persistence.record_analysis(report, "stock")
+    return report
+
+async def stream_stock_report(symbol):
+    """单只股票的流式分析：报价一到先推送，基本面与历史 K 线就绪后再推送完整结果"""
+    with priority_scope(PRIORITY_INTERACTIVE):
+        quote_task = asyncio.ensure_future(get_stock_quote(symbol))
+        rest_task = asyncio.ensure_future(asyncio.gather(
+            get_company_overview(symbol),
+            ingest_history(symbol, "daily"),
+        ))
+    try:
+        quote_data = await quote_task
+        if "error" not in quote_data:
+            yield {"type": "quote", "symbol": symbol, "real_time_data": quote_data}
+        overview_data, _ = await rest_task
+        yield {"type": "result", **build_stock_report(symbol, quote_data, overview_data)}
+    except Exception as e:
+        yield {"type": "error", "symbol": symbol, "error": str(e)}
+    finally:
+        quote_task.cancel()
+        rest_task.cancel()
 
 @app.post("/api/analyze/stock")
-async def analyze_stock(symbol: str):
-    """分析单个股票"""
+async def analyze_stock(symbol: str, stream: Optional[str] = None):
+    """分析单个股票；stream=ndjson|sse 时先推送实时报价，再推送完整分析"""
     try:
-        # 获取真实股票数据
-        quote_data = get_stock_quote(symbol)
-        overview_data = get_company_overview(symbol)
-        
-        # 检查是否有错误，如果有错误则使用模拟数据
+        invalid = invalid_stream_format(stream)
+        if invalid:
+            return invalid
+        if stream:
+            return stream_response(stream_stock_report(symbol), stream)
+
+        # 获取真实股票数据；交互式请求在上游调度队列中优先
+        with priority_scope(PRIORITY_INTERACTIVE):
+            quote_data, overview_data, _ = await asyncio.gather(
+                get_stock_quote(symbol),
+                get_company_overview(symbol),
+                ingest_history(symbol, "daily"),
+            )
+        return build_stock_report(symbol, quote_data, overview_data)
+    except Exception as e:
+        return {"error": str(e), "status": "error"}
+
+async def analyze_symbol(symbol):
+    """分析单只股票（不回退到模拟数据），供流式批量分析逐只调用"""
+    try:
+        quote_data, overview_data = await asyncio.gather(
+            get_stock_quote(symbol),
+            get_company_overview(symbol),
+        )
         if "error" in quote_data:
-            print(f"API 失败，使用模拟数据: {quote_data['error']}")
-            # 使用模拟数据
-            quote_data = {
+            return {
+                "type": "error",
                 "symbol": symbol,
-                "price": 150.0 + hash(symbol) % 100,
-                "change": (hash(symbol) % 20) - 10,
-                "change_percent": str(((hash(symbol) % 20) - 10) * 0.1),
-                "volume": 1000000 + hash(symbol) % 5000000,
-                "high": 160.0,
-                "low": 140.0,
-                "open": 155.0,
-                "previous_close": 145.0
+                "error": quote_data["error"],
+                "rate_limited": bool(quote_data.get("rate_limited")),
             }
-            
-            # 模拟公司信息
-            overview_data = {
+        technical_indicators = calculate_technical_indicators(quote_data, history_store.load(symbol, "daily"))
+        scores = score_batch([quote_data], [overview_data], [technical_indicators])
+        observe_market_data(symbol, quote_data, overview_data, technical_indicators)
+        result = build_analysis(symbol, quote_data, overview_data, technical_indicators, scores, 0)
+        persistence.record_analysis(result, "stream")
+        return {"type": "result", **result}
+    except Exception as e:
+        return {"type": "error", "symbol": symbol, "error": str(e), "rate_limited": False}
+
+async def stream_analyses(symbols, priority):
+    """按完成顺序逐只产出分析结果，最后附带汇总；在途数量受 STREAM_CONCURRENCY 限制"""
+    async def run(symbol):
+        with priority_scope(priority):
+            return await analyze_symbol(symbol)
+
+    requested = succeeded = 0
+    async for record in bounded_map(run, symbols, STREAM_CONCURRENCY):
+        requested += 1
+        succeeded += record["type"] == "result"
+        yield record
+    yield {
+        "type": "summary",
+        "requested": requested,
+        "succeeded": succeeded,
+        "failed": requested - succeeded,
+        "timestamp": datetime.now().isoformat() + "Z",
+    }
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(request: BatchAnalysisRequest, stream: Optional[str] = None):
+    """
+    批量分析多只股票：并发拉取报价与基本面（经共享缓存），
+    技术指标按矩阵整批计算，建议与风险分档以数组运算完成；单只股票失败不影响其他结果。
+    stream=ndjson|sse 时每只股票完成即推送，不等待最慢的一只
+    """
+    invalid = invalid_stream_format(stream)
+    if invalid:
+        return invalid
+    symbols = list(dict.fromkeys(s.strip().upper() for s in request.symbols if s.strip()))
+    if not symbols:
+        return {"error": "symbols 不能为空", "status": "error"}
+    if stream:
+        # 流式模式下在途数量固定，不受单次数量上限约束
+        return stream_response(stream_analyses(symbols, PRIORITY_DEFAULT), stream)
+    if len(symbols) > BATCH_MAX_SYMBOLS:
+        return {"error": f"单次最多分析 {BATCH_MAX_SYMBOLS} 只股票", "status": "error"}
+
+    # 批量筛选属于普通优先级，让位于交互式的单只股票分析
+    with priority_scope(PRIORITY_DEFAULT):
+        fetches = [get_stock_quotes(symbols), get_company_overviews(symbols)]
+        if request.refresh_history:
+            fetches.append(asyncio.gather(*(ingest_history(symbol, "daily") for symbol in symbols)))
+        quotes, overviews, *_ = await asyncio.gather(*fetches)
+
+    errors = []
+    ok = []
+    for symbol, quote_data, overview_data in zip(symbols, quotes, overviews):
+        if "error" in quote_data:
+            errors.append({
                 "symbol": symbol,
-                "name": f"{symbol} Inc.",
-                "sector": "Technology",
-                "industry": "Software",
-                "market_cap": "1000000000",
-                "pe_ratio": "25.5",
-                "dividend_yield": "2.1",
-                "beta": "1.2",
-                "52_week_high": "200.0",
-                "52_week_low": "100.0",
-                "description": f"模拟的 {symbol} 公司信息"
-            }
-        
-        # 计算技术指标
-        technical_indicators = calculate_technical_indicators(quote_data)
-        
-        # 生成 AI 洞察
-        ai_insights = generate_ai_insights(quote_data, overview_data, technical_indicators)
-        
-        # 生成投资建议
-        price = quote_data.get("price", 0)
-        change_percent = float(quote_data.get("change_percent", 0))
-        
-        if change_percent > 3:
-            action = "考虑减仓"
-            confidence = 0.8
-        elif change_percent < -3:
-            action = "考虑加仓"
-            confidence = 0.7
-        else:
-            action = "持有观望"
-            confidence = 0.6
-        
-        # 计算目标价和止损价
-        target_price = price * 1.1  # 10% 上涨目标
-        stop_loss = price * 0.95   # 5% 止损
-        
-        # 风险评估
-        beta = overview_data.get("beta", "1.0")
-        try:
-            beta_value = float(beta) if beta != "None" else 1.0
-            if beta_value > 1.5:
-                risk_level = "高"
-                volatility = "高"
-            elif beta_value > 1.0:
-                risk_level = "中高"
-                volatility = "中高"
-            else:
-                risk_level = "中低"
-                volatility = "中低"
-        except:
-            risk_level = "中等"
-            volatility = "中等"
-        
-        # 趋势分析
-        if change_percent > 1:
-            short_term = "上涨趋势"
-        elif change_percent < -1:
-            short_term = "下跌趋势"
+                "error": quote_data["error"],
+                "rate_limited": bool(quote_data.get("rate_limited")),
+            })
         else:
-            short_term = "横盘整理"
-        
-        analysis_result = {
-            "symbol": symbol,
-            "real_time_data": quote_data,
-            "company_info": overview_data if "error" not in overview_data else None,
-            "analysis": {
-                "technical_indicators": technical_indicators,
-                "trend_analysis": {
-                    "short_term": short_term,
-                    "medium_term": "基于技术指标分析",
-                    "long_term": "基于基本面分析"
-                },
-                "risk_assessment": {
-                    "volatility": volatility,
-                    "risk_level": risk_level,
-                    "beta": beta_value if 'beta_value' in locals() else 1.0
-                },
-                "ai_insights": ai_insights,
-                "recommendation": {
-                    "action": action,
-                    "confidence": confidence,
-                    "target_price": round(target_price, 2),
-                    "stop_loss": round(stop_loss, 2)
-                }
+            ok.append((symbol, quote_data, overview_data))
+
+    # 把报价作为当日未完成的一根 K 线拼到本地历史后面，与单只分析的口径一致
+    bars_list = []
+    for symbol, quote_data, _ in ok:
+        bars = history_store.load(symbol, "daily")
+        live_bar, live_timestamp = _live_bar(quote_data)
+        if live_bar is not None:
+            end = int(np.searchsorted(bars["timestamp"], live_timestamp, side="left"))
+            bars = {c: np.append(bars[c][:end], live_bar[c]) for c in ("high", "low", "close", "volume")}
+        bars_list.append(bars if len(bars["close"]) >= MIN_HISTORY_BARS else None)
+    latest_list = batch_latest_indicators(bars_list)
+
+    indicators_list = [
+        format_indicators(latest) if latest else calculate_technical_indicators(quote_data)
+        for (_, quote_data, _), latest in zip(ok, latest_list)
+    ]
+    scores = score_batch([q for _, q, _ in ok], [o for _, _, o in ok], indicators_list)
+
+    results = []
+    for i, ((symbol, quote_data, overview_data), technical_indicators) in enumerate(zip(ok, indicators_list)):
+        result = build_analysis(symbol, quote_data, overview_data, technical_indicators, scores, i)
+        observe_market_data(symbol, quote_data, overview_data, technical_indicators)
+        persistence.record_analysis(result, "batch")
+        results.append(result)
+
+    return {
+        "results": results,
+        "errors": errors,
+        "requested": len(symbols),
+        "succeeded": len(results),
+        "failed": len(errors),
+        "timestamp": datetime.now().isoformat() + "Z",
+        "status": "success" if not errors else ("partial" if results else "error"),
+        "data_source": "Alpha Vantage API"
+    }
+
+def build_market_analysis(timeframe):
+    """市场整体趋势概览"""
+    return {
+        "timeframe": timeframe,
+        "market_overview": {
+            "overall_trend": "震荡上行",
+            "market_sentiment": "谨慎乐观",
+            "volatility_index": 18.5,
+            "sector_performance": {
+                "科技股": "领涨",
+                "金融股": "稳定",
+                "能源股": "下跌",
+                "医疗股": "震荡"
+            }
+        },
+        "key_events": [
+            "美联储政策会议即将召开",
+            "科技巨头财报季开始",
+            "地缘政治风险有所缓解"
+        ],
+        "ai_analysis": {
+            "market_outlook": "短期内市场可能继续震荡，但长期趋势依然向上",
+            "risk_factors": [
+                "通胀数据超预期",
+                "地缘政治紧张局势",
+                "企业盈利不及预期"
+            ],
+            "opportunities": [
+                "科技股估值合理",
+                "新兴市场复苏",
+                "绿色能源政策利好"
+            ]
+        },
+        "recommendations": {
+            "strategy": "均衡配置",
+            "sector_allocation": {
+                "科技": 30,
+                "金融": 25,
+                "医疗": 20,
+                "消费": 15,
+                "其他": 10
             },
+            "risk_management": "建议保持 20% 现金仓位"
+        },
+        "timestamp": "2024-01-01T00:00:00Z",
+        "status": "success"
+    }
+
+def stream_market_scan(timeframe, fmt):
+    """流式市场扫描：先推送整体概览，再逐只推送观察池中每只股票的分析"""
+    async def records():
+        yield {"type": "overview", **build_market_analysis(timeframe)}
+        async for record in stream_analyses(MARKET_UNIVERSE, PRIORITY_BACKGROUND):
+            yield record
+
+    return stream_response(records(), fmt)
+
+def stream_analysis_report(symbol, fmt):
+    """流式多代理报告：推送各分析分支的进度与总结报告的每段文本，最后推送完整结果"""
+    from agents.orchestrator import stream_stock_analysis
+
+    async def records():
+        async for record in stream_stock_analysis(symbol):
+            if record["type"] == "done":
+                record["timestamp"] = datetime.now().isoformat() + "Z"
+                record["status"] = "success" if not record["errors"] else "partial"
+                persistence.record_analysis({k: v for k, v in record.items() if k != "type"}, "report")
+            yield record
+
+    return stream_response(records(), fmt)
+
+@app.post("/api/analyze/report")
+async def analyze_report(symbol: str, stream: Optional[str] = None):
+    """
+    多代理分析报告：基本面、技术面、估值代理并行执行后由总结代理汇总；
+    stream=ndjson|sse 时推送分支进度事件与报告 token，不必等待整份报告生成
+    """
+    try:
+        invalid = invalid_stream_format(stream)
+        if invalid:
+            return invalid
+        if stream:
+            return stream_analysis_report(symbol, stream)
+        # 代理依赖 LangChain 与 OPENAI_API_KEY，按需导入；分析图由注册表构建一次后复用
+        from agents.orchestrator import run_stock_analysis
+        result = await run_stock_analysis(symbol)
+        report = {
+            **result,
             "timestamp": datetime.now().isoformat() + "Z",
-            "status": "success",
-            "data_source": "模拟数据 (Alpha Vantage API 不可用)"
+            "status": "success" if not result["errors"] else "partial",
         }
-        return analysis_result
+        persistence.record_analysis(report, "report")
+        return report
     except Exception as e:
         return {"error": str(e), "status": "error"}
 
 @app.post("/api/analyze/market")
-async def analyze_market_trend(timeframe: str = "1d"):
-    """分析市场整体趋势"""
+async def analyze_market_trend(timeframe: str = "1d", stream: Optional[str] = None):
+    """分析市场整体趋势；stream=ndjson|sse 时流式推送概览与观察池中每只股票的分析"""
     try:
-        market_analysis = {
-            "timeframe": timeframe,
-            "market_overview": {
-                "overall_trend": "震荡上行",
-                "market_sentiment": "谨慎乐观",
-                "volatility_index": 18.5,
-                "sector_performance": {
-                    "科技股": "领涨",
-                    "金融股": "稳定",
-                    "能源股": "下跌",
-                    "医疗股": "震荡"
-                }
-            },
-            "key_events": [
-                "美联储政策会议即将召开",
-                "科技巨头财报季开始",
-                "地缘政治风险有所缓解"
-            ],
-            "ai_analysis": {
-                "market_outlook": "短期内市场可能继续震荡，但长期趋势依然向上",
-                "risk_factors": [
-                    "通胀数据超预期",
-                    "地缘政治紧张局势",
-                    "企业盈利不及预期"
-                ],
-                "opportunities": [
-                    "科技股估值合理",
-                    "新兴市场复苏",
-                    "绿色能源政策利好"
-                ]
-            },
-            "recommendations": {
-                "strategy": "均衡配置",
-                "sector_allocation": {
-                    "科技": 30,
-                    "金融": 25,
-                    "医疗": 20,
-                    "消费": 15,
-                    "其他": 10
-                },
-                "risk_management": "建议保持 20% 现金仓位"
-            },
-            "timestamp": "2024-01-01T00:00:00Z",
-            "status": "success"
-        }
-        return market_analysis
+        invalid = invalid_stream_format(stream)
+        if invalid:
+            return invalid
+        if stream:
+            return stream_market_scan(timeframe, stream)
+        return build_market_analysis(timeframe)
     except Exception as e:
         return {"error": str(e), "status": "error"}
 
 @app.get("/api/portfolio/status")
-async def get_portfolio_status():
-    """获取投资组合状态"""
+async def get_portfolio_status(portfolio: str = DEFAULT_PORTFOLIO):
+    """投资组合状态：按共享报价缓存盯市后的持仓、盈亏、权重，以及基于历史收益矩阵的风险与绩效指标"""
     try:
-        portfolio = {
-            "total_value": 125000.00,
-            "total_gain": 8500.00,
-            "total_gain_percent": 7.28,
-            "daily_change": 1250.00,
-            "daily_change_percent": 1.01,
-            "positions": [
-                {
-                    "symbol": "AAPL",
-                    "shares": 100,
-                    "current_price": 175.43,
-                    "value": 17543.00,
-                    "gain": 2150.00,
-                    "gain_percent": 13.98,
-                    "weight": 14.03
-                },
-                {
-                    "symbol": "GOOGL",
-                    "shares": 50,
-                    "current_price": 142.56,
-                    "value": 7128.00,
-                    "gain": -123.00,
-                    "gain_percent": -1.69,
-                    "weight": 5.70
-                },
-                {
-                    "symbol": "MSFT",
-                    "shares": 75,
-                    "current_price": 378.85,
-                    "value": 28413.75,
-                    "gain": 3420.00,
-                    "gain_percent": 13.70,
-                    "weight": 22.73
-                },
-                {
-                    "symbol": "TSLA",
-                    "shares": 25,
-                    "current_price": 248.12,
-                    "value": 6203.00,
-                    "gain": -567.00,
-                    "gain_percent": -8.37,
-                    "weight": 4.96
-                },
-                {
-                    "symbol": "AMZN",
-                    "shares": 40,
-                    "current_price": 155.78,
-                    "value": 6231.20,
-                    "gain": 189.00,
-                    "gain_percent": 3.13,
-                    "weight": 4.98
-                }
-            ],
-            "performance_metrics": {
-                "sharpe_ratio": 1.25,
-                "max_drawdown": -8.5,
-                "volatility": 15.2,
-                "beta": 1.08
-            },
-            "timestamp": "2024-01-01T00:00:00Z",
-            "status": "success"
-        }
-        return portfolio
+        with priority_scope(PRIORITY_INTERACTIVE):
+            return await portfolio_manager.status(portfolio)
     except Exception as e:
         return {"error": str(e), "status": "error"}
 
+@app.post("/api/portfolio/transactions")
+async def add_portfolio_transaction(request: PortfolioTransactionRequest):
+    """记录一笔买入或卖出；卖出按先进先出冲销持仓批次"""
+    quantity = request.quantity if request.side == "buy" else -request.quantity
+    try:
+        transaction = await portfolio_manager.record_transaction(
+            request.symbol, quantity, request.price, request.fees, request.timestamp, request.portfolio
+        )
+    except PortfolioError as e:
+        return {"error": str(e), "status": "error"}
+    return {"transaction": transaction, "status": "success"}
+
+@app.get("/api/portfolio/transactions")
+async def list_portfolio_transactions(portfolio: str = DEFAULT_PORTFOLIO):
+    """按成交顺序列出投资组合的全部交易"""
+    try:
+        return {"portfolio": portfolio, "transactions": await portfolio_manager.transactions(portfolio), "status": "success"}
+    except Exception as e:
+        return {"error": str(e), "status": "error"}
+
+@app.get("/api/portfolio/stats")
+async def portfolio_stats():
+    """已加载组合的持仓数、批次数、交易与报价 tick 计数以及风险模型重建次数"""
+    return portfolio_manager.stats()
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
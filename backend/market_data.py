@@ -0,0 +1,183 @@
+"""
+Alpha Vantage 行情数据访问层
+使用共享的 httpx.AsyncClient 连接池进行异步请求，并通过信号量限制并发
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from cache import market_cache, ttl_for
+from rate_limiter import RateLimitExceeded, upstream_scheduler
+
+# Alpha Vantage API 配置
+ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY")
+BASE_URL = "https://www.alphavantage.co/query"
+
+# 单次请求超时（秒）与批量拉取时的最大并发数
+REQUEST_TIMEOUT = float(os.getenv("ALPHA_VANTAGE_TIMEOUT", "10"))
+MAX_CONCURRENCY = int(os.getenv("ALPHA_VANTAGE_MAX_CONCURRENCY", "10"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取进程内共享的 HTTP 客户端（懒加载，复用连接池）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENCY * 2,
+                max_keepalive_connections=MAX_CONCURRENCY,
+            ),
+        )
+    return _client
+
+
+async def close_http_client():
+    """关闭共享的 HTTP 客户端，应在应用退出时调用"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def is_throttled_payload(data: Dict[str, Any]) -> bool:
+    """Alpha Vantage 限流时返回 200，并在 Note/Information 字段中给出提示"""
+    return "Note" in data or "Information" in data
+
+
+def is_cacheable_payload(data: Dict[str, Any]) -> bool:
+    """上游返回限流提示或错误信息时不写入缓存"""
+    return not (is_throttled_payload(data) or "Error Message" in data)
+
+
+def upstream_error_message(data: Dict[str, Any]) -> str:
+    """提取上游返回的错误或限流提示"""
+    return data.get("Note") or data.get("Information") or data.get("Error Message") or "Unknown error"
+
+
+async def _request_alpha_vantage(params: Dict[str, Any]) -> Dict[str, Any]:
+    """经调度器获得配额许可后请求 Alpha Vantage（不经过缓存）"""
+    await upstream_scheduler.acquire()
+    response = await get_http_client().get(BASE_URL, params=params)
+    data = response.json()
+    if is_throttled_payload(data):
+        upstream_scheduler.report_throttled()
+    return data
+
+
+async def query_alpha_vantage(function: str, symbol: str, **extra_params) -> Dict[str, Any]:
+    """调用 Alpha Vantage 接口并返回原始 JSON，所有请求都经过共享缓存"""
+    params = {
+        "function": function,
+        "symbol": symbol.upper(),
+        "apikey": ALPHA_VANTAGE_API_KEY,
+        **extra_params,
+    }
+    key = (function, symbol.upper(), tuple(sorted(extra_params.items())))
+    return await market_cache.get_or_load(
+        key,
+        lambda: _request_alpha_vantage(params),
+        ttl=ttl_for(function),
+        cacheable=is_cacheable_payload,
+    )
+
+
+def parse_quote(symbol: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """将 GLOBAL_QUOTE 原始数据转换为统一的报价结构"""
+    if "Global Quote" in data and data["Global Quote"]:
+        quote = data["Global Quote"]
+        return {
+            "symbol": quote.get("01. symbol", symbol),
+            "price": float(quote.get("05. price", 0)),
+            "change": float(quote.get("09. change", 0)),
+            "change_percent": quote.get("10. change percent", "0%").replace("%", ""),
+            "volume": int(quote.get("06. volume", 0)),
+            "high": float(quote.get("03. high", 0)),
+            "low": float(quote.get("04. low", 0)),
+            "open": float(quote.get("02. open", 0)),
+            "previous_close": float(quote.get("08. previous close", 0)),
+            "latest_trading_day": quote.get("07. latest trading day", "")
+        }
+    return {
+        "error": f"Failed to get data for {symbol}: {upstream_error_message(data)}",
+        "rate_limited": is_throttled_payload(data),
+    }
+
+
+def parse_overview(symbol: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """将 OVERVIEW 原始数据转换为统一的公司信息结构"""
+    if "Symbol" in data:
+        return {
+            "symbol": data.get("Symbol", symbol),
+            "name": data.get("Name", ""),
+            "sector": data.get("Sector", ""),
+            "industry": data.get("Industry", ""),
+            "market_cap": data.get("MarketCapitalization", ""),
+            "pe_ratio": data.get("PERatio", ""),
+            "dividend_yield": data.get("DividendYield", ""),
+            "beta": data.get("Beta", ""),
+            "52_week_high": data.get("52WeekHigh", ""),
+            "52_week_low": data.get("52WeekLow", ""),
+            "description": data.get("Description", "")
+        }
+    return {
+        "error": f"Failed to get overview for {symbol}: {upstream_error_message(data)}",
+        "rate_limited": is_throttled_payload(data),
+    }
+
+
+async def get_stock_quote(symbol: str) -> Dict[str, Any]:
+    """获取股票实时报价"""
+    if not ALPHA_VANTAGE_API_KEY:
+        return {"error": "Alpha Vantage API key not configured"}
+
+    try:
+        data = await query_alpha_vantage("GLOBAL_QUOTE", symbol)
+        return parse_quote(symbol, data)
+    except RateLimitExceeded as e:
+        return {"error": str(e), "rate_limited": True}
+    except Exception as e:
+        return {"error": f"API request failed: {str(e)}"}
+
+
+async def get_company_overview(symbol: str) -> Dict[str, Any]:
+    """获取公司基本面信息"""
+    if not ALPHA_VANTAGE_API_KEY:
+        return {"error": "Alpha Vantage API key not configured"}
+
+    try:
+        data = await query_alpha_vantage("OVERVIEW", symbol)
+        return parse_overview(symbol, data)
+    except RateLimitExceeded as e:
+        return {"error": str(e), "rate_limited": True}
+    except Exception as e:
+        return {"error": f"API request failed: {str(e)}"}
+
+
+async def _fetch_many(fetcher, symbols: List[str], max_concurrency: Optional[int]) -> List[Dict[str, Any]]:
+    """通过信号量限制同时在途的请求数并发拉取，结果顺序与输入一致"""
+    semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY)
+
+    async def fetch(symbol: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await fetcher(symbol)
+
+    return await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+
+
+async def get_stock_quotes(symbols: List[str], max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    并发获取多只股票的报价，结果顺序与输入一致。
+    通过信号量限制同时在途的请求数，避免瞬间打满上游。
+    """
+    return await _fetch_many(get_stock_quote, symbols, max_concurrency)
+
+
+async def get_company_overviews(symbols: List[str], max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+    """并发获取多家公司的基本面信息，结果顺序与输入一致"""
+    return await _fetch_many(get_company_overview, symbols, max_concurrency)
@@ -0,0 +1,91 @@
+"""
+MCP 工具批量调用
+一次请求携带多个工具调用：相同的调用（工具名与参数都相同）只执行一次，
+不同的调用在事件循环上并发执行，结果按请求顺序返回。单个调用失败不影响其他调用。
+两个 MCP 服务的 /call_tool 与 /call_batch 共用 dispatch_registry_tool：成功时返回工具结果本身，
+失败时由 tool_error 返回同一种结构化错误，mcp_client 无需区分连接的是哪个服务。
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+from pydantic import BaseModel, Field
+
+from rate_limiter import RateLimitExceeded
+from tool_registry import ToolArgumentsError, ToolNotFound
+
+logger = logging.getLogger(__name__)
+
+# 单个批量请求最多包含的调用数
+BATCH_MAX_CALLS = int(os.getenv("MCP_BATCH_MAX_CALLS", "100"))
+
+
+class ToolCall(BaseModel):
+    tool_name: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+
+class BatchCallRequest(BaseModel):
+    calls: List[ToolCall]
+
+
+def tool_error(tool_name: str, error: Exception) -> Dict[str, Any]:
+    """把工具调用异常转换为 {"error": 描述, "error_type": 类别, "status": "error"}"""
+    if isinstance(error, ToolNotFound):
+        error_type = "not_found"
+    elif isinstance(error, ToolArgumentsError):
+        error_type = "invalid_arguments"
+    elif isinstance(error, RateLimitExceeded):
+        error_type = "rate_limited"
+    elif isinstance(error, httpx.HTTPError):
+        error_type = "upstream"
+    else:
+        error_type = "internal"
+        logger.exception(f"工具 {tool_name} 执行出错", exc_info=error)
+    if error_type != "internal":
+        logger.warning(f"工具 {tool_name} 调用失败（{error_type}）: {error}")
+    message = str(error) or type(error).__name__
+    return {"error": message, "error_type": error_type, "status": "error"}
+
+
+async def dispatch_registry_tool(registry: Any, tool_name: str, params: Dict[str, Any]) -> Any:
+    """按工具名从注册表分发：成功时返回工具结果本身，失败时返回 tool_error"""
+    try:
+        return await registry.call(tool_name, params)
+    except Exception as e:
+        return tool_error(tool_name, e)
+
+
+def call_key(call: ToolCall) -> Tuple[str, str]:
+    """去重键：工具名 + 规范化后的参数"""
+    return call.tool_name, json.dumps(call.params, sort_keys=True, default=str)
+
+
+async def execute_batch(
+    calls: List[ToolCall],
+    dispatch: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+) -> Dict[str, Any]:
+    """并发执行去重后的调用，返回 {"results": [...], "unique": 实际执行数}"""
+    if len(calls) > BATCH_MAX_CALLS:
+        return {"error": f"单次最多 {BATCH_MAX_CALLS} 个调用", "status": "error"}
+
+    async def run(call: ToolCall):
+        try:
+            return await dispatch(call.tool_name, call.params)
+        except Exception as e:
+            return tool_error(call.tool_name, e)
+
+    tasks: Dict[Tuple[str, str], asyncio.Future] = {}
+    for call in calls:
+        key = call_key(call)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(run(call))
+    await asyncio.gather(*tasks.values())
+    return {
+        "results": [tasks[call_key(call)].result() for call in calls],
+        "unique": len(tasks),
+    }
@@ -1,29 +1,277 @@
 # backend/mcp_client.py
-import requests
+"""
+MCP Server 客户端
+异步调用共享一个 httpx.AsyncClient 连接池，同步调用（供同步代码与后台线程使用）共享一个 httpx.Client；
+每个请求都有超时，连接错误、超时与 5xx 响应按指数退避加随机抖动重试。
+call_mcp_tools 把多次工具调用合并为一次 /call_batch 请求，服务端不支持时回退为在同一连接池上并发的单次调用。
+MCP_TRANSPORT=mcp 时异步调用改走标准 MCP 协议（streamable HTTP），所有调用复用同一个长连接会话。
+"""
+
+import asyncio
 import json
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp_server:8001")
+# 单次请求超时（秒）、最大重试次数与首次重试的基础等待（秒）
+MCP_TIMEOUT = float(os.getenv("MCP_TIMEOUT", "30"))
+MCP_MAX_RETRIES = int(os.getenv("MCP_MAX_RETRIES", "2"))
+MCP_RETRY_BASE_DELAY = float(os.getenv("MCP_RETRY_BASE_DELAY", "0.2"))
+MCP_MAX_CONNECTIONS = int(os.getenv("MCP_MAX_CONNECTIONS", "20"))
+# 异步工具调用的传输方式：rest（REST 接口）或 mcp（MCP 协议会话，地址为 MCP_SERVER_URL + MCP_PROTOCOL_PATH）；
+# backend/mcp_server.py 与 mcp_server/main.py 都同时提供两种接口
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "rest")
+MCP_PROTOCOL_PATH = os.getenv("MCP_PROTOCOL_PATH", "/mcp/")
+
+# 可以安全重试的响应状态码
+RETRY_STATUS = {502, 503, 504}
+
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=MCP_MAX_CONNECTIONS, max_keepalive_connections=MCP_MAX_CONNECTIONS)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """获取进程内共享的异步客户端（懒加载，复用连接池）"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(base_url=MCP_SERVER_URL, timeout=httpx.Timeout(MCP_TIMEOUT), limits=_limits())
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    """获取进程内共享的同步客户端（懒加载，复用连接池）"""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(base_url=MCP_SERVER_URL, timeout=httpx.Timeout(MCP_TIMEOUT), limits=_limits())
+    return _sync_client
+
+
+async def close_mcp_client():
+    """关闭共享的客户端与 MCP 会话，应在应用退出时调用"""
+    global _async_client, _sync_client
+    await mcp_session.close()
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    if _sync_client is not None and not _sync_client.is_closed:
+        _sync_client.close()
+    _async_client = None
+    _sync_client = None
+
+
+def retry_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待：指数退避，乘以 0.5~1.5 的随机抖动，避免多个调用方同时重试"""
+    return MCP_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _should_retry(response: Optional[httpx.Response], attempt: int) -> bool:
+    return attempt < MCP_MAX_RETRIES and (response is None or response.status_code in RETRY_STATUS)
+
+
+async def _arequest(method: str, path: str, **kwargs) -> httpx.Response:
+    attempt = 0
+    while True:
+        try:
+            response = await get_async_client().request(method, path, **kwargs)
+        except httpx.TransportError:
+            if not _should_retry(None, attempt):
+                raise
+        else:
+            if not _should_retry(response, attempt):
+                return response
+        await asyncio.sleep(retry_delay(attempt))
+        attempt += 1
+
+
+def _request(method: str, path: str, **kwargs) -> httpx.Response:
+    attempt = 0
+    while True:
+        try:
+            response = get_sync_client().request(method, path, **kwargs)
+        except httpx.TransportError:
+            if not _should_retry(None, attempt):
+                raise
+        else:
+            if not _should_retry(response, attempt):
+                return response
+        time.sleep(retry_delay(attempt))
+        attempt += 1
+
+
+def parse_tool_result(result) -> Any:
+    """把 MCP 的 CallToolResult 转为与 REST 接口一致的结果：优先结构化内容，其次解析文本"""
+    text = "".join(getattr(block, "text", "") for block in result.content)
+    if result.isError:
+        return {"error": text or "工具调用失败"}
+    if result.structuredContent is not None:
+        return result.structuredContent
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _open_streamable_http():
+    from mcp.client.streamable_http import streamablehttp_client
+    return streamablehttp_client(MCP_SERVER_URL.rstrip("/") + MCP_PROTOCOL_PATH, timeout=MCP_TIMEOUT)
+
+
+class MCPSession:
+    """
+    长连接 MCP 会话：首次调用时建立并初始化，之后所有工具调用复用它。
+    SDK 的会话依赖 anyio 任务组，必须在同一个任务中进入和退出，因此由后台任务持有，
+    其他协程只通过会话对象收发消息。调用失败时关闭当前会话，下次调用时重新建立。
+    """
+
+    def __init__(self, connect: Optional[Callable[[], Any]] = None):
+        self._connect = connect or _open_streamable_http
+        self._session = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._closing: Optional[asyncio.Event] = None
+        # 在首次使用时创建：Python 3.9 中 asyncio.Lock 会绑定创建时的事件循环，而模块导入时还没有运行中的循环
+        self._lock: Optional[asyncio.Lock] = None
+        self.sessions_opened = 0
+        self.sessions_discarded = 0
+
+    async def _run(self):
+        from mcp import ClientSession
+
+        try:
+            async with self._connect() as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    self._session = session
+                    self.sessions_opened += 1
+                    self._ready.set_result(session)
+                    await self._closing.wait()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            else:
+                logger.warning(f"MCP 会话中断: {e}")
+        finally:
+            self._session = None
+
+    async def get(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._task is None or self._task.done():
+                self._ready = asyncio.get_running_loop().create_future()
+                self._closing = asyncio.Event()
+                self._task = asyncio.ensure_future(self._run())
+            ready = self._ready
+        return await ready
+
+    async def _discard(self, task: Optional[asyncio.Task]):
+        """关闭出错的会话；若其他调用已经换上了新会话则不受影响"""
+        if task is None or task is not self._task:
+            return
+        self.sessions_discarded += 1
+        self._closing.set()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        task = None
+        try:
+            session = await self.get()
+            task = self._task
+            return parse_tool_result(await session.call_tool(tool_name, arguments))
+        except Exception as e:
+            # 工具自身的错误以 isError 结果返回，走到这里说明会话或传输已不可用
+            logger.warning(f"通过 MCP 会话调用工具 {tool_name} 失败: {e}")
+            await self._discard(task)
+            return {"error": str(e)}
 
-MCP_SERVER_URL = "http://mcp_server:8001"
+    async def close(self):
+        if self._task is not None:
+            self._closing.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
 
-def get_mcp_tools():
+
+# 进程内共享的 MCP 会话
+mcp_session = MCPSession()
+
+
+def get_mcp_tools() -> List[Dict[str, Any]]:
     """
     从 MCP Server 获取可用工具列表。
     """
     try:
-        response = requests.get(f"{MCP_SERVER_URL}/tools")
+        response = _request("GET", "/tools")
         response.raise_for_status()
         return response.json()["tools"]
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching tools from MCP server: {e}")
+    except httpx.HTTPError as e:
+        logger.warning(f"获取 MCP 工具列表失败: {e}")
         return []
 
-def call_mcp_tool(tool_name: str, **kwargs):
+
+async def aget_mcp_tools() -> List[Dict[str, Any]]:
+    """get_mcp_tools 的异步版本"""
+    try:
+        response = await _arequest("GET", "/tools")
+        response.raise_for_status()
+        return response.json()["tools"]
+    except httpx.HTTPError as e:
+        logger.warning(f"获取 MCP 工具列表失败: {e}")
+        return []
+
+
+def call_mcp_tool(tool_name: str, **kwargs) -> Dict[str, Any]:
     """
     调用 MCP Server 上的指定工具。
     """
     try:
-        response = requests.post(f"{MCP_SERVER_URL}/call_tool", params={"tool_name": tool_name}, json=kwargs)
+        response = _request("POST", "/call_tool", params={"tool_name": tool_name}, json=kwargs)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.warning(f"调用 MCP 工具 {tool_name} 失败: {e}")
+        return {"error": str(e)}
+
+
+async def acall_mcp_tool(tool_name: str, **kwargs) -> Dict[str, Any]:
+    """call_mcp_tool 的异步版本"""
+    if MCP_TRANSPORT == "mcp":
+        return await mcp_session.call_tool(tool_name, kwargs)
+    try:
+        response = await _arequest("POST", "/call_tool", params={"tool_name": tool_name}, json=kwargs)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling tool on MCP server: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+    except httpx.HTTPError as e:
+        logger.warning(f"调用 MCP 工具 {tool_name} 失败: {e}")
+        return {"error": str(e)}
+
+
+async def call_mcp_tools(calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    批量调用工具，calls 形如 [{"tool_name": "get_stock_price", "params": {"symbol": "AAPL"}}, ...]，
+    按顺序返回各调用的结果（失败的调用返回 {"error": ...}）。整批只发一次 /call_batch 请求；
+    服务端未提供该接口（404/405）时回退为并发的单次调用。
+    """
+    if not calls:
+        return []
+    if MCP_TRANSPORT == "mcp":
+        # 同一会话上的请求按 ID 复用，并发发出即可
+        return await asyncio.gather(*(mcp_session.call_tool(call["tool_name"], call.get("params", {})) for call in calls))
+    try:
+        response = await _arequest("POST", "/call_batch", json={"calls": calls})
+        if response.status_code not in (404, 405):
+            response.raise_for_status()
+            return response.json()["results"]
+    except httpx.HTTPError as e:
+        logger.warning(f"批量调用 MCP 工具失败: {e}")
+        return [{"error": str(e)} for _ in calls]
+    return await asyncio.gather(*(acall_mcp_tool(call["tool_name"], **call.get("params", {})) for call in calls))
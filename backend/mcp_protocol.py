@@ -0,0 +1,71 @@
+"""
+MCP 协议传输
+用官方 MCP SDK 的低层 Server 提供工具，工具列表与分发都来自 mcp_tools 注册表，与 REST 接口一致。
+支持 stdio 与 streamable HTTP 两种传输：客户端建立一次会话后复用它完成所有工具调用，
+消息按协议分帧；结果以紧凑 JSON 文本返回，字典结果同时作为结构化内容返回，客户端无需再解析文本。
+"""
+
+import contextlib
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+import mcp.types as types
+from mcp.server.lowlevel import Server
+from mcp.server.stdio import stdio_server
+from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+from mcp_tools import registry as default_registry
+from tool_registry import ToolRegistry
+
+SERVER_NAME = "agentic-stock"
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def create_mcp_server(registry: ToolRegistry = default_registry) -> Server:
+    """创建 MCP Server，工具定义在创建时从注册表生成一次"""
+    server = Server(SERVER_NAME)
+    tools = [
+        types.Tool(name=tool["name"], description=tool["description"], inputSchema=tool["parameters"])
+        for tool in registry.list_tools()
+    ]
+
+    @server.list_tools()
+    async def list_tools() -> List[types.Tool]:
+        return tools
+
+    # 参数已由注册表中预编译的 pydantic 模型校验，跳过 SDK 的 jsonschema 校验
+    @server.call_tool(validate_input=False)
+    async def call_tool(name: str, arguments: Dict[str, Any]):
+        # 未知工具或参数错误时抛出的异常由 SDK 转为 isError 结果
+        result = await registry.call(name, arguments)
+        text = result if isinstance(result, str) else compact_json(result)
+        content = [types.TextContent(type="text", text=text)]
+        if isinstance(result, dict):
+            return content, result
+        return content
+
+    return server
+
+
+class StreamableHTTPTransport:
+    """streamable HTTP 传输：ASGI 入口挂载到 FastAPI 应用，会话管理器需在应用生命周期内运行"""
+
+    def __init__(self, server: Server, stateless: bool = False):
+        self.session_manager = StreamableHTTPSessionManager(app=server, json_response=False, stateless=stateless)
+
+    async def __call__(self, scope, receive, send):
+        await self.session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def run(self) -> AsyncIterator[None]:
+        async with self.session_manager.run():
+            yield
+
+
+async def run_stdio(server: Server):
+    """以 stdio 传输运行（供本地 MCP 客户端以子进程方式启动）"""
+    async with stdio_server() as (read_stream, write_stream):
+        await server.run(read_stream, write_stream, server.create_initialization_options())
@@ -1,25 +1,49 @@
 """
 MCP (Model Context Protocol) 服务器实现
 用于 Agentic Stock System 的上下文协议服务
+/mcp 提供标准 MCP 协议（streamable HTTP 传输），/tools、/call_tool、/call_batch 等 REST 接口与 mcp_server/main.py 相同；
+以 --stdio 参数启动时改用 stdio 传输
 """
 
 import asyncio
-import json
+import contextlib
 import logging
+import sys
 from typing import Any, Dict, List
 from fastapi import FastAPI
 import uvicorn
 
+from mcp_batch import BatchCallRequest, dispatch_registry_tool, execute_batch, tool_error
+from mcp_protocol import StreamableHTTPTransport, create_mcp_server, run_stdio
+from mcp_tools import registry
+from redis_cache import close_redis_tier, configure_redis_tier
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 标准 MCP 协议服务，与 REST 接口共用工具注册表
+protocol_server = create_mcp_server(registry)
+streamable_http = StreamableHTTPTransport(protocol_server)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """在应用生命周期内运行 MCP 会话管理器，并与后端共享 Redis 行情缓存和上游配额"""
+    configure_redis_tier()
+    try:
+        async with streamable_http.run():
+            yield
+    finally:
+        await close_redis_tier()
+
 # 创建 FastAPI 应用作为 MCP 服务器
 mcp_app = FastAPI(
     title="Agentic Stock MCP Server",
     description="Model Context Protocol 服务器",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
+mcp_app.mount("/mcp", streamable_http)
 
 @mcp_app.get("/")
 async def mcp_root():
@@ -34,108 +58,44 @@ async def mcp_root():
 @mcp_app.get("/tools")
 async def list_tools():
     """列出可用的 MCP 工具"""
-    return {
-        "tools": [
-            {
-                "name": "get_stock_info",
-                "description": "获取股票信息",
-                "parameters": {
-                    "symbol": {"type": "string", "description": "股票代码", "required": True}
-                }
-            },
-            {
-                "name": "analyze_market",
-                "description": "分析市场趋势",
-                "parameters": {
-                    "timeframe": {
-                        "type": "string", 
-                        "description": "时间框架",
-                        "enum": ["1d", "1w", "1m", "3m", "1y"],
-                        "required": True
-                    }
-                }
-            },
-            {
-                "name": "get_portfolio_status",
-                "description": "获取投资组合状态",
-                "parameters": {}
-            }
-        ]
-    }
+    return {"tools": registry.list_tools()}
+
+@mcp_app.get("/tools/stats")
+async def tool_stats():
+    """各工具的调用次数与耗时直方图"""
+    return registry.stats()
 
 @mcp_app.post("/call/{tool_name}")
 async def call_tool(tool_name: str, arguments: Dict[str, Any] = None):
-    """调用 MCP 工具"""
-    if arguments is None:
-        arguments = {}
-    
+    """调用 MCP 工具（旧接口，结果包装为 {"result", "status"}）"""
+    return await dispatch_tool(tool_name, arguments or {})
+
+@mcp_app.post("/call_tool")
+async def call_tool_raw(tool_name: str, params: Dict[str, Any] = None):
+    """与 mcp_server/main.py 相同的单次调用接口：成功时直接返回工具结果，供 mcp_client 使用"""
+    return await dispatch_registry_tool(registry, tool_name, params or {})
+
+async def _dispatch_raw(tool_name: str, params: Dict[str, Any]) -> Any:
+    return await dispatch_registry_tool(registry, tool_name, params)
+
+@mcp_app.post("/call_batch")
+async def call_batch(request: BatchCallRequest):
+    """批量调用 MCP 工具：重复的调用只执行一次，其余并发执行，结果按请求顺序返回，每项的形状与 /call_tool 相同"""
+    return await execute_batch(request.calls, _dispatch_raw)
+
+async def dispatch_tool(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """旧接口 /call/{tool_name} 的分发：成功结果包装为 {"result", "status"}，失败时返回 tool_error"""
     try:
-        if tool_name == "get_stock_info":
-            symbol = arguments.get("symbol", "")
-            result = await get_stock_info(symbol)
-            return {"result": result, "status": "success"}
-        
-        elif tool_name == "analyze_market":
-            timeframe = arguments.get("timeframe", "1d")
-            result = await analyze_market(timeframe)
-            return {"result": result, "status": "success"}
-        
-        elif tool_name == "get_portfolio_status":
-            result = await get_portfolio_status()
-            return {"result": result, "status": "success"}
-        
-        else:
-            return {"error": f"未知工具: {tool_name}", "status": "error"}
-    
+        result = await registry.call(tool_name, arguments)
+        return {"result": result, "status": "success"}
     except Exception as e:
-        logger.error(f"工具调用错误: {e}")
-        return {"error": str(e), "status": "error"}
-
-async def get_stock_info(symbol: str) -> str:
-    """获取股票信息"""
-    # 这里是模拟实现，实际应该连接真实的股票 API
-    return json.dumps({
-        "symbol": symbol,
-        "price": 150.25,
-        "change": 2.35,
-        "change_percent": 1.58,
-        "volume": 1000000,
-        "market_cap": "2.5B",
-        "status": "success"
-    }, ensure_ascii=False, indent=2)
-
-async def analyze_market(timeframe: str) -> str:
-    """分析市场趋势"""
-    # 这里是模拟实现
-    return json.dumps({
-        "timeframe": timeframe,
-        "trend": "上涨",
-        "confidence": 0.75,
-        "key_indicators": {
-            "rsi": 65.2,
-            "macd": "positive",
-            "volume_trend": "increasing"
-        },
-        "recommendation": "谨慎乐观",
-        "status": "success"
-    }, ensure_ascii=False, indent=2)
-
-async def get_portfolio_status() -> str:
-    """获取投资组合状态"""
-    # 这里是模拟实现
-    return json.dumps({
-        "total_value": 100000.00,
-        "total_gain": 5000.00,
-        "total_gain_percent": 5.26,
-        "positions": [
-            {"symbol": "AAPL", "shares": 100, "value": 15000.00, "gain": 1000.00},
-            {"symbol": "GOOGL", "shares": 50, "value": 7500.00, "gain": 500.00}
-        ],
-        "status": "success"
-    }, ensure_ascii=False, indent=2)
+        return tool_error(tool_name, e)
 
 async def main():
     """主函数"""
+    if "--stdio" in sys.argv:
+        await run_stdio(protocol_server)
+        return
     logger.info("启动 MCP 服务器在 0.0.0.0:8001")
     config = uvicorn.Config(mcp_app, host="0.0.0.0", port=8001, log_level="info")
     server = uvicorn.Server(config)
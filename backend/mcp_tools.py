@@ -0,0 +1,107 @@
+"""
+MCP 工具定义
+所有 MCP 工具都在这里用 @registry.tool 声明一次，两个 MCP Server 与后端 /api/mcp/tools 共用同一份列表与 Schema
+"""
+
+import json
+from typing import Any, Dict, Literal
+
+import fundamentals
+import market_data
+import portfolio as portfolio_engine
+import price_history
+import valuation
+from tool_registry import ToolRegistry
+
+registry = ToolRegistry()
+
+
+@registry.tool()
+async def get_company_overview(symbol: str) -> Dict[str, Any]:
+    """
+    获取公司基本面信息，包括财务状况、高管信息等。
+    """
+    if not market_data.ALPHA_VANTAGE_API_KEY:
+        return {"error": "ALPHA_VANTAGE_API_KEY is not set."}
+
+    return await market_data.query_alpha_vantage("OVERVIEW", symbol)
+
+
+@registry.tool()
+async def get_stock_price(symbol: str) -> Dict[str, Any]:
+    """
+    获取股票实时价格。
+    """
+    if not market_data.ALPHA_VANTAGE_API_KEY:
+        return {"error": "ALPHA_VANTAGE_API_KEY is not set."}
+
+    return await market_data.query_alpha_vantage("GLOBAL_QUOTE", symbol)
+
+
+@registry.tool()
+async def get_stock_k_data(symbol: str, interval: str = "daily", limit: int = 100) -> Dict[str, Any]:
+    """
+    获取历史 K 线（开高低收量），数据来自本地列式存储，仅增量拉取缺失部分。
+    """
+    if interval not in price_history.SERIES_FUNCTIONS:
+        return {"error": f"Unsupported interval: {interval}"}
+
+    return await price_history.get_price_history(symbol, interval, limit)
+
+
+@registry.tool()
+async def get_stock_financials(symbol: str, period: Literal["quarterly", "annual"] = "quarterly", limit: int = 4) -> Dict[str, Any]:
+    """
+    获取财务报表摘要与预计算的财务比率（盈利、成长、营运、偿债、现金流）及杜邦分解，按报告期倒序。
+    """
+    return await fundamentals.get_financials(symbol, period, limit)
+
+
+@registry.tool()
+async def get_stock_valuation(symbol: str) -> Dict[str, Any]:
+    """
+    获取估值结果：多阶段 DCF（含情景与折现率 × 增长率敏感性矩阵）、P/E、EV/EBITDA、P/B、P/S 及同行业百分位与隐含价格。
+    """
+    return await valuation.get_valuation(symbol)
+
+
+@registry.tool()
+async def get_stock_info(symbol: str) -> str:
+    """获取股票信息（模拟数据）"""
+    # 这里是模拟实现，实际应该连接真实的股票 API
+    return json.dumps({
+        "symbol": symbol,
+        "price": 150.25,
+        "change": 2.35,
+        "change_percent": 1.58,
+        "volume": 1000000,
+        "market_cap": "2.5B",
+        "status": "success"
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+@registry.tool()
+async def analyze_market(timeframe: Literal["1d", "1w", "1m", "3m", "1y"] = "1d") -> str:
+    """分析市场趋势（模拟数据）"""
+    # 这里是模拟实现
+    return json.dumps({
+        "timeframe": timeframe,
+        "trend": "上涨",
+        "confidence": 0.75,
+        "key_indicators": {
+            "rsi": 65.2,
+            "macd": "positive",
+            "volume_trend": "increasing"
+        },
+        "recommendation": "谨慎乐观",
+        "status": "success"
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+@registry.tool()
+async def get_portfolio_status(portfolio: str = portfolio_engine.DEFAULT_PORTFOLIO) -> Dict[str, Any]:
+    """
+    获取投资组合状态：盯市后的持仓、盈亏与权重，以及波动率、夏普比率、最大回撤、beta、VaR/CVaR 等风险指标。
+    """
+    # 交易由后端进程写入：只有数据库中的交易版本变化时才重新回放，否则复用内存持仓与风险模型
+    return await portfolio_engine.portfolio_manager.status(portfolio, sync=True)
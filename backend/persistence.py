@@ -0,0 +1,439 @@
+"""
+持久化层
+把 K 线、报价与分析结果写入 PostgreSQL（未配置 DATABASE_URL 时使用本地 SQLite），三张表都按 (symbol, 时间) 建索引。
+写入不阻塞请求：调用方只把记录放进有界队列，后台写入任务按批次合并，
+PostgreSQL 上追加型数据用 COPY 批量写入，K 线用 executemany 的 INSERT ... ON CONFLICT DO UPDATE；
+队列满时丢弃并计数。投资组合交易记录不能丢失，不经过队列而是直接写入。读取走 SQLAlchemy 异步引擎的连接池。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func,
+    select,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("MARKET_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+# 写入队列容量、单批最多记录数与最长攒批时间（秒）
+WRITE_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "10000"))
+WRITE_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "1.0"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+metadata = MetaData()
+
+price_bars = Table(
+    "price_bars",
+    metadata,
+    Column("symbol", String(16), primary_key=True),
+    Column("interval", String(8), primary_key=True),
+    # K 线时间（Unix 秒），与本地列式存储一致
+    Column("ts", BigInteger, primary_key=True),
+    Column("open", Float),
+    Column("high", Float),
+    Column("low", Float),
+    Column("close", Float),
+    Column("volume", Float),
+)
+
+quotes = Table(
+    "quotes",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("symbol", String(16), nullable=False),
+    # 记录时间（Unix 秒）
+    Column("ts", Float, nullable=False),
+    Column("price", Float),
+    Column("change", Float),
+    Column("change_percent", Float),
+    Column("volume", BigInteger),
+    Column("high", Float),
+    Column("low", Float),
+    Column("open", Float),
+    Column("previous_close", Float),
+    Column("latest_trading_day", String(10)),
+    Index("ix_quotes_symbol_ts", "symbol", "ts"),
+)
+
+analysis_snapshots = Table(
+    "analysis_snapshots",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("symbol", String(16), nullable=False),
+    Column("ts", Float, nullable=False),
+    # 来源：stock（单只分析）/ batch / stream / report（多代理报告）
+    Column("kind", String(16), nullable=False),
+    Column("action", String(16)),
+    Column("payload", JSON, nullable=False),
+    Index("ix_analysis_snapshots_symbol_ts", "symbol", "ts"),
+)
+
+portfolio_transactions = Table(
+    "portfolio_transactions",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("portfolio", String(64), nullable=False),
+    Column("symbol", String(16), nullable=False),
+    Column("ts", Float, nullable=False),
+    # 买入为正、卖出为负
+    Column("quantity", Float, nullable=False),
+    Column("price", Float, nullable=False),
+    Column("fees", Float, nullable=False, default=0.0),
+    Index("ix_portfolio_transactions_portfolio_ts", "portfolio", "ts"),
+)
+
+QUOTE_FIELDS = ("price", "change", "change_percent", "volume", "high", "low", "open", "previous_close")
+
+
+def async_database_url(url: Optional[str]) -> str:
+    """把配置的连接串转换为异步驱动：postgresql -> asyncpg，未配置时使用本地 SQLite"""
+    if not url:
+        return f"sqlite+aiosqlite:///{os.path.join(DATA_DIR, 'agentic_stock.sqlite3')}"
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    return url
+
+
+def dump_json(value: Any) -> str:
+    # 分析结果中可能含有 NumPy 标量，转为对应的 Python 数值；其他无法序列化的值转为字符串
+    return json.dumps(value, ensure_ascii=False, default=lambda v: v.item() if isinstance(v, np.generic) else str(v))
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def quote_row(quote: Dict[str, Any], ts: Optional[float] = None) -> Dict[str, Any]:
+    row = {"symbol": quote["symbol"].upper(), "ts": ts or time.time()}
+    for field in QUOTE_FIELDS:
+        row[field] = _float(quote.get(field))
+    row["volume"] = int(row["volume"]) if row["volume"] is not None else None
+    row["latest_trading_day"] = quote.get("latest_trading_day") or None
+    return row
+
+
+def bar_rows(symbol: str, interval: str, bars: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    columns = {name: np.asarray(bars[name]).tolist() for name in ("timestamp", "open", "high", "low", "close", "volume")}
+    return [
+        {
+            "symbol": symbol.upper(),
+            "interval": interval,
+            "ts": int(columns["timestamp"][i]),
+            "open": columns["open"][i],
+            "high": columns["high"][i],
+            "low": columns["low"][i],
+            "close": columns["close"][i],
+            "volume": columns["volume"][i],
+        }
+        for i in range(len(columns["timestamp"]))
+    ]
+
+
+class PersistenceStore:
+    """持久化存储：record_* 把记录放入写入队列，后台任务批量落库；查询方法直接读库"""
+
+    def __init__(
+        self,
+        url: Optional[str] = DATABASE_URL,
+        queue_size: int = WRITE_QUEUE_SIZE,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+    ):
+        self.url = async_database_url(url)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._engine: Optional[AsyncEngine] = None
+        self._task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+        # 每只股票最近一次写入的报价，报价没有变化时不重复写入
+        self._last_quote: Dict[str, Tuple] = {}
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.skipped_unchanged = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.last_flush_ms: Optional[float] = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            if self.url.startswith("sqlite"):
+                path = self.url.split(":///", 1)[1]
+                if path and path != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._engine = create_async_engine(self.url, json_serializer=dump_json)
+            else:
+                self._engine = create_async_engine(
+                    self.url,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_pre_ping=True,
+                    json_serializer=dump_json,
+                )
+        return self._engine
+
+    @property
+    def is_postgres(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    async def ensure_schema(self):
+        """建表（已存在的表不受影响），同一进程只执行一次"""
+        if not self._schema_ready:
+            async with self.engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+            self._schema_ready = True
+
+    async def start(self):
+        """建表并启动后台写入任务"""
+        await self.ensure_schema()
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        """写完队列中剩余的记录后停止写入任务并释放连接池"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+            self._schema_ready = False
+
+    # ---------- 写入 ----------
+
+    def _enqueue(self, table: Table, rows: List[Dict[str, Any]]):
+        if self._queue is None or not rows:
+            return
+        for row in rows:
+            try:
+                self._queue.put_nowait((table, row))
+                self.enqueued += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def record_quote(self, quote: Dict[str, Any]):
+        """记录一次报价；与该股票上一次写入的报价相同时跳过"""
+        if not quote or "error" in quote or not quote.get("symbol"):
+            return
+        row = quote_row(quote)
+        fingerprint = tuple(row[field] for field in QUOTE_FIELDS) + (row["latest_trading_day"],)
+        if self._last_quote.get(row["symbol"]) == fingerprint:
+            self.skipped_unchanged += 1
+            return
+        self._last_quote[row["symbol"]] = fingerprint
+        self._enqueue(quotes, [row])
+
+    def record_bars(self, symbol: str, interval: str, bars: Dict[str, np.ndarray]):
+        """记录新追加的 K 线（可作为 PriceHistoryStore 的追加监听器）"""
+        self._enqueue(price_bars, bar_rows(symbol, interval, bars))
+
+    def record_analysis(self, result: Dict[str, Any], kind: str):
+        """记录一次分析结果快照"""
+        if not result or "error" in result or not result.get("symbol"):
+            return
+        recommendation = (result.get("analysis") or {}).get("recommendation") or {}
+        self._enqueue(analysis_snapshots, [{
+            "symbol": result["symbol"].upper(),
+            "ts": time.time(),
+            "kind": kind,
+            "action": recommendation.get("action"),
+            "payload": result,
+        }])
+
+    async def add_transaction(self, row: Dict[str, Any]) -> int:
+        """直接写入一笔投资组合交易并返回其 id"""
+        async with self.engine.begin() as conn:
+            result = await conn.execute(portfolio_transactions.insert(), row)
+        return int(result.inserted_primary_key[0])
+
+    def _drain(self) -> List[Tuple[Table, Dict[str, Any]]]:
+        items = []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return items
+
+    async def _run(self):
+        items: List[Tuple[Table, Dict[str, Any]]] = []
+        try:
+            while True:
+                items = [await self._queue.get()]
+                # 攒批：等待 flush_interval 或凑满一批
+                deadline = time.monotonic() + self.flush_interval
+                while len(items) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                await self._write(items)
+                items = []
+        except asyncio.CancelledError:
+            # 停止时已取出但尚未写入的记录放回队列，由 close 中的 flush 写入
+            for item in items:
+                try:
+                    self._queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+            raise
+
+    async def flush(self):
+        """立即写入队列中的所有记录"""
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            await self._write(self._drain())
+
+    async def _write(self, items: List[Tuple[Table, Dict[str, Any]]]):
+        grouped: Dict[Table, List[Dict[str, Any]]] = defaultdict(list)
+        for table, row in items:
+            grouped[table].append(row)
+        started = time.perf_counter()
+        try:
+            async with self.engine.begin() as conn:
+                for table, rows in grouped.items():
+                    if table is price_bars:
+                        await self._upsert_bars(conn, rows)
+                    elif self.is_postgres:
+                        await self._copy(conn, table, rows)
+                    else:
+                        await conn.execute(table.insert(), rows)
+            self.written += len(items)
+            self.batches += 1
+        except Exception as e:
+            self.failed_batches += 1
+            logger.warning(f"持久化写入失败（{len(items)} 条）: {e}")
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    async def _upsert_bars(self, conn, rows: List[Dict[str, Any]]):
+        """K 线可能与已有数据重叠：按主键覆盖 OHLCV，使被修订的最后一根（盘中未收盘的日线）落库为最终值"""
+        # 同一批次中同一根 K 线只保留最后写入的版本
+        rows = list({(row["symbol"], row["interval"], row["ts"]): row for row in rows}.values())
+        insert = (pg_insert if self.is_postgres else sqlite_insert)(price_bars)
+        statement = insert.on_conflict_do_update(
+            index_elements=[price_bars.c.symbol, price_bars.c.interval, price_bars.c.ts],
+            set_={column: insert.excluded[column] for column in ("open", "high", "low", "close", "volume")},
+        )
+        await conn.execute(statement, rows)
+
+    async def _copy(self, conn, table: Table, rows: List[Dict[str, Any]]):
+        """PostgreSQL 上用 asyncpg 的 COPY 协议批量追加"""
+        columns = [c.name for c in table.columns if c.name != "id"]
+        records = [
+            tuple(dump_json(row[c]) if isinstance(table.c[c].type, JSON) else row.get(c) for c in columns)
+            for row in rows
+        ]
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=records, columns=columns)
+
+    # ---------- 查询 ----------
+
+    async def quote_history(self, symbol: str, since: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按时间倒序返回最近的报价记录"""
+        query = select(quotes).where(quotes.c.symbol == symbol.upper())
+        if since is not None:
+            query = query.where(quotes.c.ts >= since)
+        query = query.order_by(quotes.c.ts.desc()).limit(limit)
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(query)).mappings().all()
+        return [{**row, "time": datetime.fromtimestamp(row["ts"]).isoformat()} for row in rows]
+
+    async def analysis_history(self, symbol: str, limit: int = 20, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按时间倒序返回最近的分析快照"""
+        query = select(analysis_snapshots).where(analysis_snapshots.c.symbol == symbol.upper())
+        if kind:
+            query = query.where(analysis_snapshots.c.kind == kind)
+        query = query.order_by(analysis_snapshots.c.ts.desc()).limit(limit)
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(query)).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def bars(self, symbol: str, interval: str = "daily", start: Optional[int] = None, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按时间升序返回区间内的 K 线"""
+        query = select(price_bars).where(price_bars.c.symbol == symbol.upper(), price_bars.c.interval == interval)
+        if start is not None:
+            query = query.where(price_bars.c.ts >= start)
+        if end is not None:
+            query = query.where(price_bars.c.ts <= end)
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(query.order_by(price_bars.c.ts))).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def transactions(self, portfolio: str) -> List[Dict[str, Any]]:
+        """按成交顺序返回投资组合的全部交易"""
+        query = (
+            select(portfolio_transactions)
+            .where(portfolio_transactions.c.portfolio == portfolio)
+            .order_by(portfolio_transactions.c.ts, portfolio_transactions.c.id)
+        )
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(query)).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def transaction_version(self, portfolio: str) -> Tuple[int, Optional[int]]:
+        """投资组合的交易笔数与最大 id，用于廉价地判断其他进程是否写入了新交易"""
+        query = select(func.count(), func.max(portfolio_transactions.c.id)).where(
+            portfolio_transactions.c.portfolio == portfolio
+        )
+        async with self.engine.connect() as conn:
+            count, last_id = (await conn.execute(query)).one()
+        return int(count), last_id
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.url.split(":", 1)[0],
+            "running": self._task is not None and not self._task.done(),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "skipped_unchanged_quotes": self.skipped_unchanged,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+# 进程内共享的持久化存储
+persistence = PersistenceStore()
@@ -0,0 +1,465 @@
+"""
+投资组合
+交易记录持久化在 portfolio_transactions 表，加载时按成交顺序回放成按批次（lot）存储的持仓数组，卖出按先进先出向量化冲销。
+持仓通过共享报价缓存盯市，每个报价 tick 只更新对应股票的市值。
+风险与绩效指标（波动率、夏普比率、beta、最大回撤、VaR/CVaR）以当前持仓股票的历史日收益矩阵 R (T, n) 计算：
+维护与市值向量 v 相关的中间量 R·v、Σ·v、v'Σv、μ·v，一个 tick 只需 O(T + n) 的增量更新，读取时按总市值归一化。
+"""
+
+import asyncio
+import os
+import time
+from functools import reduce
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import market_data
+from persistence import PersistenceStore, persistence
+from price_history import PriceHistoryStore, history_store
+
+DEFAULT_PORTFOLIO = "default"
+# beta 的比较基准
+PORTFOLIO_BENCHMARK = os.getenv("PORTFOLIO_BENCHMARK", "SPY").upper()
+# 计算风险指标使用的历史交易日数
+PORTFOLIO_LOOKBACK_DAYS = int(os.getenv("PORTFOLIO_LOOKBACK_DAYS", "252"))
+PORTFOLIO_RISK_FREE_RATE = float(os.getenv("PORTFOLIO_RISK_FREE_RATE", "0.04"))
+PORTFOLIO_VAR_CONFIDENCE = float(os.getenv("PORTFOLIO_VAR_CONFIDENCE", "0.95"))
+TRADING_DAYS = 252
+# 对齐后的收益率少于该天数时不计算风险指标
+MIN_RETURN_DAYS = 20
+# 增量更新会累积浮点误差，每隔这么多次 tick 完整重算一次中间量
+REBASE_EVERY = 10_000
+# 浮点数量小于该值视为已清仓
+QUANTITY_EPSILON = 1e-9
+
+
+class PortfolioError(ValueError):
+    """交易不合法：数量或价格无效、卖出超过持仓、早于最后一笔交易"""
+
+
+def _round(value: float, digits: int = 2) -> Optional[float]:
+    value = float(value)
+    return None if not np.isfinite(value) else round(value, digits)
+
+
+def aligned_returns(bars_list: List[Dict[str, np.ndarray]], lookback: int = PORTFOLIO_LOOKBACK_DAYS) -> Optional[np.ndarray]:
+    """按共同的交易日对齐收盘价，返回最近 lookback 天的简单收益矩阵 (T, n)；共同交易日不足时返回 None"""
+    stamps = reduce(np.intersect1d, [bars["timestamp"] for bars in bars_list])[-(lookback + 1):]
+    if len(stamps) <= MIN_RETURN_DAYS:
+        return None
+    closes = np.column_stack([
+        np.asarray(bars["close"], dtype=np.float64)[np.searchsorted(bars["timestamp"], stamps)]
+        for bars in bars_list
+    ])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = closes[1:] / closes[:-1] - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class RiskModel:
+    """
+    持仓股票的收益矩阵及其统计量。values 为各股票市值（美元），
+    组合每日盈亏序列 pnl = R·v，方差 v'Σv，与基准的协方差 c·v 都随 values 增量维护
+    """
+
+    def __init__(self, returns: np.ndarray, benchmark: Optional[np.ndarray], covered: np.ndarray):
+        self.returns = returns
+        self.covered = covered
+        days = len(returns)
+        self.mean = returns.mean(axis=0)
+        centered = returns - self.mean
+        self.cov = centered.T @ centered / (days - 1)
+        self.market_cov: Optional[np.ndarray] = None
+        self.market_var: Optional[float] = None
+        if benchmark is not None:
+            market = benchmark - benchmark.mean()
+            self.market_cov = centered.T @ market / (days - 1)
+            self.market_var = float(market @ market / (days - 1))
+        self.shifts = 0
+
+    @property
+    def days(self) -> int:
+        return len(self.returns)
+
+    def rebase(self, values: np.ndarray):
+        """按市值向量完整计算一次中间量"""
+        self.values = np.array(values, dtype=np.float64)
+        self.pnl = self.returns @ self.values
+        self.cov_values = self.cov @ self.values
+        self.variance = float(self.values @ self.cov_values)
+        self.mean_pnl = float(self.mean @ self.values)
+        self.market_pnl = float(self.market_cov @ self.values) if self.market_cov is not None else None
+        self.shifts = 0
+
+    def shift(self, column: int, delta: float):
+        """第 column 只股票市值变化 delta 时的增量更新"""
+        self.values[column] += delta
+        if self.shifts >= REBASE_EVERY:
+            self.rebase(self.values)
+            return
+        self.pnl += self.returns[:, column] * delta
+        self.variance += 2 * delta * self.cov_values[column] + delta * delta * self.cov[column, column]
+        self.cov_values += self.cov[:, column] * delta
+        self.mean_pnl += self.mean[column] * delta
+        if self.market_cov is not None:
+            self.market_pnl += self.market_cov[column] * delta
+        self.shifts += 1
+
+    def metrics(self, total: float) -> Dict[str, Any]:
+        """按总市值归一化得到组合收益序列及各项指标；收益、波动率、回撤与 VaR 以百分比表示"""
+        if total <= 0:
+            return {}
+        returns = self.pnl / total
+        volatility = np.sqrt(max(self.variance, 0.0)) / total * np.sqrt(TRADING_DAYS)
+        annual_return = self.mean_pnl / total * TRADING_DAYS
+        wealth = np.cumprod(1 + returns)
+        drawdown = wealth / np.maximum.accumulate(wealth) - 1
+        threshold = np.quantile(returns, 1 - PORTFOLIO_VAR_CONFIDENCE)
+        tail = returns[returns <= threshold]
+        var = -threshold
+        cvar = -tail.mean() if len(tail) else var
+        beta = self.market_pnl / total / self.market_var if self.market_var else None
+        covered_value = float(self.values[self.covered].sum())
+        return {
+            "annual_return": _round(annual_return * 100),
+            "volatility": _round(volatility * 100),
+            "sharpe_ratio": _round((annual_return - PORTFOLIO_RISK_FREE_RATE) / volatility) if volatility > 0 else None,
+            "max_drawdown": _round(drawdown.min() * 100),
+            "beta": _round(beta) if beta is not None else None,
+            "var": _round(var * 100),
+            "cvar": _round(cvar * 100),
+            "var_amount": _round(var * total),
+            "cvar_amount": _round(cvar * total),
+            "var_confidence": PORTFOLIO_VAR_CONFIDENCE,
+            "observation_days": self.days,
+            # 有历史 K 线的持仓占总市值的比例；缺少历史的股票按零收益处理
+            "history_coverage": _round(covered_value / total * 100),
+        }
+
+
+class Portfolio:
+    """单个投资组合：按股票聚合的持仓数组与按批次存储的 lot 数组"""
+
+    def __init__(self, name: str, lot_capacity: int = 64):
+        self.name = name
+        self.symbols: List[str] = []
+        self._index: Dict[str, int] = {}
+        # 按股票：持有数量、剩余成本（含手续费）、已实现盈亏、最新价、昨收、最新价更新时间（0 表示来自成交价）
+        self.quantity = np.zeros(0)
+        self.cost = np.zeros(0)
+        self.realized = np.zeros(0)
+        self.price = np.zeros(0)
+        self.previous_close = np.zeros(0)
+        self.priced_at = np.zeros(0)
+        # 按批次：所属股票、剩余数量、每股成本（含手续费）；每只股票的批次行号按成交顺序排列
+        self.lot_count = 0
+        self.lot_symbol = np.zeros(lot_capacity, dtype=np.int64)
+        self.lot_quantity = np.zeros(lot_capacity)
+        self.lot_cost = np.zeros(lot_capacity)
+        self._lots: List[List[int]] = []
+        # 每只股票第一个可能未平仓批次在 _lots 中的位置
+        self._head: List[int] = []
+        self.total_value = 0.0
+        self.last_ts = 0.0
+        self.transactions = 0
+        self.ticks = 0
+        self.risk: Optional[RiskModel] = None
+        self.risk_stale = True
+        self.risk_builds = 0
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.upper() in self._index
+
+    def _column(self, symbol: str) -> int:
+        column = self._index.get(symbol)
+        if column is None:
+            column = len(self.symbols)
+            self.symbols.append(symbol)
+            self._index[symbol] = column
+            self._lots.append([])
+            self._head.append(0)
+            for name, fill in (("quantity", 0.0), ("cost", 0.0), ("realized", 0.0), ("price", 0.0), ("previous_close", np.nan), ("priced_at", 0.0)):
+                setattr(self, name, np.append(getattr(self, name), fill))
+        return column
+
+    def _add_lot(self, column: int, quantity: float, unit_cost: float):
+        if self.lot_count == len(self.lot_quantity):
+            # 容量翻倍，均摊 O(1)
+            for name in ("lot_symbol", "lot_quantity", "lot_cost"):
+                values = getattr(self, name)
+                grown = np.zeros(len(values) * 2, dtype=values.dtype)
+                grown[:self.lot_count] = values[:self.lot_count]
+                setattr(self, name, grown)
+        row = self.lot_count
+        self.lot_symbol[row] = column
+        self.lot_quantity[row] = quantity
+        self.lot_cost[row] = unit_cost
+        self._lots[column].append(row)
+        self.lot_count += 1
+
+    def validate(self, symbol: str, quantity: float, price: float, fees: float = 0.0, ts: Optional[float] = None):
+        if not symbol:
+            raise PortfolioError("symbol 不能为空")
+        if not np.isfinite(quantity) or abs(quantity) < QUANTITY_EPSILON:
+            raise PortfolioError("数量必须是非零数字")
+        if not np.isfinite(price) or price <= 0:
+            raise PortfolioError("价格必须大于 0")
+        if not np.isfinite(fees) or fees < 0:
+            raise PortfolioError("手续费不能为负")
+        if ts is not None and ts < self.last_ts:
+            raise PortfolioError("交易时间不能早于该组合最后一笔交易")
+        if quantity < 0:
+            column = self._index.get(symbol.upper())
+            held = self.quantity[column] if column is not None else 0.0
+            if -quantity > held + QUANTITY_EPSILON:
+                raise PortfolioError(f"卖出数量 {-quantity:g} 超过持仓 {held:g}")
+
+    def apply(self, symbol: str, quantity: float, price: float, fees: float = 0.0, ts: Optional[float] = None):
+        """记入一笔交易：买入新增批次，卖出按先进先出冲销批次并结转已实现盈亏"""
+        symbol = symbol.upper()
+        self.validate(symbol, quantity, price, fees, ts)
+        column = self._column(symbol)
+        if quantity > 0:
+            self._add_lot(column, quantity, price + fees / quantity)
+            self.cost[column] += quantity * price + fees
+        else:
+            sell = -quantity
+            rows = np.asarray(self._lots[column][self._head[column]:], dtype=np.int64)
+            open_quantity = self.lot_quantity[rows]
+            filled_before = np.cumsum(open_quantity) - open_quantity
+            taken = np.clip(sell - filled_before, 0.0, open_quantity)
+            removed_cost = float(taken @ self.lot_cost[rows])
+            self.lot_quantity[rows] = open_quantity - taken
+            self.realized[column] += sell * price - fees - removed_cost
+            self.cost[column] -= removed_cost
+            # 跳过已全部平仓的批次
+            closed = int(np.count_nonzero(self.lot_quantity[rows] <= QUANTITY_EPSILON))
+            self._head[column] += closed
+        self.quantity[column] += quantity
+        if self.quantity[column] <= QUANTITY_EPSILON:
+            self.quantity[column] = 0.0
+            self.cost[column] = 0.0
+        if not self.priced_at[column]:
+            self.price[column] = price
+        self.last_ts = max(self.last_ts, ts or 0.0)
+        self.transactions += 1
+        self.total_value = float(self.quantity @ self.price)
+        # 持仓结构变化，下次读取时重建风险模型
+        self.risk_stale = True
+
+    def on_quote(self, symbol: str, price: float, previous_close: Optional[float] = None, ts: Optional[float] = None) -> bool:
+        """一个报价 tick：只更新该股票的市值与风险模型中间量"""
+        column = self._index.get(symbol.upper())
+        if column is None or not np.isfinite(price) or price <= 0:
+            return False
+        delta = (price - self.price[column]) * self.quantity[column]
+        self.price[column] = price
+        if previous_close is not None and np.isfinite(previous_close):
+            self.previous_close[column] = previous_close
+        self.priced_at[column] = ts or time.time()
+        self.total_value += delta
+        if delta and self.risk is not None and not self.risk_stale:
+            self.risk.shift(column, delta)
+        self.ticks += 1
+        return True
+
+    def held_symbols(self) -> List[str]:
+        return [self.symbols[i] for i in np.flatnonzero(self.quantity > 0)]
+
+    def build_risk(self, history: PriceHistoryStore, benchmark: str = PORTFOLIO_BENCHMARK):
+        """读取本地日 K 线构建收益矩阵；缺少足够历史的股票按零收益列处理"""
+        self.risk_stale = False
+        self.risk = None
+        if not self.symbols:
+            return
+        bars = [history.load(symbol, "daily") for symbol in self.symbols]
+        covered = np.array([len(b["close"]) > MIN_RETURN_DAYS for b in bars])
+        if not covered.any():
+            return
+        usable = [b for b, ok in zip(bars, covered) if ok]
+        benchmark_bars = history.load(benchmark, "daily") if benchmark else None
+        matrix = None
+        if benchmark_bars is not None and len(benchmark_bars["close"]) > MIN_RETURN_DAYS:
+            matrix = aligned_returns(usable + [benchmark_bars])
+        benchmark_returns = None
+        if matrix is not None:
+            matrix, benchmark_returns = matrix[:, :-1], matrix[:, -1]
+        else:
+            matrix = aligned_returns(usable)
+        if matrix is None:
+            return
+        returns = np.zeros((len(matrix), len(self.symbols)))
+        returns[:, covered] = matrix
+        self.risk = RiskModel(returns, benchmark_returns, covered)
+        self.risk.rebase(self.quantity * self.price)
+        self.risk_builds += 1
+
+    def status(self) -> Dict[str, Any]:
+        held = self.quantity > 0
+        values = self.quantity * self.price
+        total = float(values[held].sum())
+        cost = float(self.cost[held].sum())
+        gains = values - self.cost
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain_percent = np.where(self.cost > 0, gains / self.cost * 100, np.nan)
+            weights = values / total * 100 if total > 0 else np.zeros_like(values)
+        known = held & np.isfinite(self.previous_close)
+        daily_change = float((self.quantity[known] * (self.price[known] - self.previous_close[known])).sum())
+        open_lots = np.bincount(
+            self.lot_symbol[:self.lot_count][self.lot_quantity[:self.lot_count] > QUANTITY_EPSILON],
+            minlength=len(self.symbols),
+        )
+
+        positions = []
+        for i in sorted(np.flatnonzero(held), key=lambda i: -values[i]):
+            positions.append({
+                "symbol": self.symbols[i],
+                "shares": _round(self.quantity[i], 6),
+                "average_cost": _round(self.cost[i] / self.quantity[i], 4),
+                "current_price": _round(self.price[i], 4),
+                "value": _round(values[i]),
+                "cost_basis": _round(self.cost[i]),
+                "gain": _round(gains[i]),
+                "gain_percent": _round(gain_percent[i]),
+                "weight": _round(weights[i]),
+                "lots": int(open_lots[i]),
+                "price_source": "quote" if self.priced_at[i] else "last_trade",
+            })
+
+        performance: Dict[str, Any] = {}
+        if self.risk is not None and total > 0:
+            performance = self.risk.metrics(total)
+        return {
+            "portfolio": self.name,
+            "total_value": _round(total),
+            "total_cost": _round(cost),
+            "total_gain": _round(total - cost),
+            "total_gain_percent": _round((total - cost) / cost * 100) if cost > 0 else 0.0,
+            "realized_gain": _round(self.realized.sum()),
+            "daily_change": _round(daily_change),
+            "daily_change_percent": _round(daily_change / (total - daily_change) * 100) if total - daily_change > 0 else 0.0,
+            "positions": positions,
+            "performance_metrics": performance,
+        }
+
+
+class PortfolioManager:
+    """按名称管理投资组合：首次访问时从数据库回放交易，之后在内存中增量维护"""
+
+    def __init__(self, store: PersistenceStore = persistence, history: PriceHistoryStore = history_store):
+        self.store = store
+        self.history = history
+        self.portfolios: Dict[str, Portfolio] = {}
+        # 内存状态对应的数据库交易版本（笔数, 最大 id）
+        self._versions: Dict[str, Tuple[int, Optional[int]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._reloads: Dict[str, int] = {}
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        return self._locks.setdefault(name, asyncio.Lock())
+
+    async def get(self, name: str = DEFAULT_PORTFOLIO, reload: bool = False, sync: bool = False) -> Portfolio:
+        """
+        reload=True 时忽略内存状态重新回放；sync=True 时先比较数据库中的交易版本，
+        只有其他进程写入了新交易时才重新回放，否则沿用内存状态与已缓存的风险模型
+        """
+        portfolio = self.portfolios.get(name)
+        if portfolio is not None and not reload:
+            if not sync:
+                return portfolio
+            await self.store.ensure_schema()
+            if await self.store.transaction_version(name) == self._versions.get(name):
+                return portfolio
+            reload = True
+        async with self._lock(name):
+            if reload or name not in self.portfolios:
+                await self.store.ensure_schema()
+                portfolio = Portfolio(name)
+                rows = await self.store.transactions(name)
+                for row in rows:
+                    portfolio.apply(row["symbol"], row["quantity"], row["price"], row["fees"] or 0.0, row["ts"])
+                self.portfolios[name] = portfolio
+                self._versions[name] = (len(rows), max((row["id"] for row in rows), default=None))
+                if reload:
+                    self._reloads[name] = self._reloads.get(name, 0) + 1
+        return self.portfolios[name]
+
+    async def record_transaction(
+        self,
+        symbol: str,
+        quantity: float,
+        price: float,
+        fees: float = 0.0,
+        ts: Optional[float] = None,
+        name: str = DEFAULT_PORTFOLIO,
+    ) -> Dict[str, Any]:
+        """校验并写入一笔交易（卖出数量为负），落库成功后再记入内存持仓"""
+        portfolio = await self.get(name)
+        symbol = (symbol or "").strip().upper()
+        ts = ts or time.time()
+        async with self._lock(name):
+            portfolio.validate(symbol, quantity, price, fees, ts)
+            row = {"portfolio": name, "symbol": symbol, "ts": ts, "quantity": quantity, "price": price, "fees": fees}
+            row["id"] = await self.store.add_transaction(row)
+            portfolio.apply(symbol, quantity, price, fees, ts)
+            count, _ = self._versions.get(name, (0, None))
+            self._versions[name] = (count + 1, row["id"])
+        return row
+
+    async def transactions(self, name: str = DEFAULT_PORTFOLIO) -> List[Dict[str, Any]]:
+        return await self.store.transactions(name)
+
+    async def status(
+        self, name: str = DEFAULT_PORTFOLIO, refresh: bool = True, reload: bool = False, sync: bool = False
+    ) -> Dict[str, Any]:
+        """盯市后返回持仓、盈亏与风险指标；报价经共享缓存获取，拉取失败的股票沿用最近一次价格"""
+        portfolio = await self.get(name, reload, sync)
+        symbols = portfolio.held_symbols()
+        if refresh and symbols:
+            for quote in await market_data.get_stock_quotes(symbols):
+                self.on_quote(quote, portfolios=[portfolio])
+        if portfolio.risk_stale:
+            portfolio.build_risk(self.history)
+        return {
+            **portfolio.status(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "status": "success",
+        }
+
+    def on_quote(self, quote: Dict[str, Any], portfolios: Optional[List[Portfolio]] = None):
+        """报价 tick 入口：更新所有持有该股票的组合"""
+        if not quote or "error" in quote or not quote.get("symbol"):
+            return
+        try:
+            price = float(quote["price"])
+            previous_close = float(quote["previous_close"]) if quote.get("previous_close") else None
+        except (KeyError, TypeError, ValueError):
+            return
+        for portfolio in portfolios or self.portfolios.values():
+            portfolio.on_quote(quote["symbol"], price, previous_close)
+
+    def on_bars(self, symbol: str, interval: str, bars: Dict[str, np.ndarray]):
+        """新的日 K 线到达后，持有该股票（或其为基准）的组合在下次读取时重建收益矩阵"""
+        if interval != "daily":
+            return
+        for portfolio in self.portfolios.values():
+            if symbol.upper() in portfolio or symbol.upper() == PORTFOLIO_BENCHMARK:
+                portfolio.risk_stale = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "reloads": self._reloads.get(name, 0),
+                "positions": len(portfolio.held_symbols()),
+                "lots": portfolio.lot_count,
+                "transactions": portfolio.transactions,
+                "ticks": portfolio.ticks,
+                "risk_builds": portfolio.risk_builds,
+            }
+            for name, portfolio in self.portfolios.items()
+        }
+
+
+# 进程内共享的投资组合管理器
+portfolio_manager = PortfolioManager()
@@ -0,0 +1,282 @@
+"""
+历史 K 线数据的采集与本地列式存储
+每只股票、每个周期按列保存为 NumPy .npy 文件，读取时以内存映射方式打开，无需访问网络；
+增量更新时只写入不早于本地最后一根 K 线的数据，最后一根（可能是盘中未收盘的 K 线）有变化时覆盖
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+import market_data
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("MARKET_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+# 距离上次成功拉取不足该秒数时不再访问网络
+HISTORY_REFRESH_SECONDS = {
+    "daily": float(os.getenv("HISTORY_REFRESH_DAILY", "3600")),
+    "weekly": 6 * 3600.0,
+    "monthly": 24 * 3600.0,
+}
+INTRADAY_REFRESH_SECONDS = float(os.getenv("HISTORY_REFRESH_INTRADAY", "60"))
+
+# 时间戳为 int64（秒），其余列为 float64
+COLUMNS = ("timestamp", "open", "high", "low", "close", "volume")
+PRICE_COLUMNS = COLUMNS[1:]
+
+INTRADAY_INTERVALS = ("1min", "5min", "15min", "30min", "60min")
+
+# 周期 -> (Alpha Vantage function, 返回数据中的时间序列字段)
+SERIES_FUNCTIONS = {
+    "daily": ("TIME_SERIES_DAILY", "Time Series (Daily)"),
+    "weekly": ("TIME_SERIES_WEEKLY", "Weekly Time Series"),
+    "monthly": ("TIME_SERIES_MONTHLY", "Monthly Time Series"),
+}
+for _interval in INTRADAY_INTERVALS:
+    SERIES_FUNCTIONS[_interval] = ("TIME_SERIES_INTRADAY", f"Time Series ({_interval})")
+
+# compact 模式只返回最近 100 根 K 线
+COMPACT_BARS = 100
+_BAR_SECONDS = {"daily": 86400, "weekly": 7 * 86400, "monthly": 31 * 86400}
+_BAR_SECONDS.update({interval: int(interval[:-3]) * 60 for interval in INTRADAY_INTERVALS})
+
+
+def empty_bars() -> Dict[str, np.ndarray]:
+    """返回空的 K 线列集合"""
+    bars = {"timestamp": np.empty(0, dtype=np.int64)}
+    bars.update({column: np.empty(0, dtype=np.float64) for column in PRICE_COLUMNS})
+    return bars
+
+
+def parse_time_series(data: Dict[str, Any], interval: str) -> Dict[str, np.ndarray]:
+    """
+    将 Alpha Vantage TIME_SERIES_* 返回的数据转换为按时间升序排列的列数组。
+    时间戳按交易所当地时间解释（与接口返回一致），以秒为单位。
+    """
+    _, series_key = SERIES_FUNCTIONS[interval]
+    series = data.get(series_key)
+    if not series:
+        return empty_bars()
+
+    stamps = np.array(list(series.keys()), dtype="datetime64[s]").astype(np.int64)
+    values = np.array(
+        [
+            (row["1. open"], row["2. high"], row["3. low"], row["4. close"], row["5. volume"])
+            for row in series.values()
+        ],
+        dtype=np.float64,
+    )
+    order = np.argsort(stamps, kind="stable")
+    bars = {"timestamp": np.ascontiguousarray(stamps[order])}
+    for i, column in enumerate(PRICE_COLUMNS):
+        bars[column] = np.ascontiguousarray(values[order, i])
+    return bars
+
+
+class PriceHistoryStore:
+    """按 <root>/<interval>/<SYMBOL>/<column>.npy 组织的列式 K 线存储"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(DATA_DIR, "history")
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # 追加监听器：listener(symbol, interval, new_bars)，在新 K 线落盘后调用（如写入数据库）
+        self.listeners: List[Callable[[str, str, Dict[str, np.ndarray]], None]] = []
+
+    def _dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, interval, symbol.upper())
+
+    def _lock(self, symbol: str, interval: str) -> threading.Lock:
+        key = f"{interval}/{symbol.upper()}"
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, symbol: str, interval: str = "daily", mmap: bool = True) -> Dict[str, np.ndarray]:
+        """读取全部 K 线；默认以只读内存映射方式打开，几乎不产生拷贝"""
+        directory = self._dir(symbol, interval)
+        if not os.path.exists(os.path.join(directory, "timestamp.npy")):
+            return empty_bars()
+        mode = "r" if mmap else None
+        bars = {column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode=mode) for column in COLUMNS}
+        # 写入过程中各列长度可能短暂不一致，以最短列为准
+        length = min(len(values) for values in bars.values())
+        return {column: values[:length] for column, values in bars.items()}
+
+    def last_timestamp(self, symbol: str, interval: str = "daily") -> Optional[int]:
+        """本地最后一根 K 线的时间戳，没有数据时返回 None"""
+        stamps = self.load(symbol, interval)["timestamp"]
+        return int(stamps[-1]) if len(stamps) else None
+
+    def _write(self, symbol: str, interval: str, bars: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        写入不早于本地最后一根的 K 线，返回实际写入的部分。
+        与本地最后一根时间相同的 K 线（如盘中尚未收盘的日线）若数值有变化则覆盖，完全相同时跳过
+        """
+        with self._lock(symbol, interval):
+            existing = self.load(symbol, interval, mmap=False)
+            stamps = existing["timestamp"]
+            start = keep = 0
+            if len(stamps):
+                # bars 按时间升序排列，二分定位第一根不早于本地最后一根的 K 线
+                start = int(np.searchsorted(bars["timestamp"], stamps[-1], side="left"))
+                keep = len(stamps)
+                if start < len(bars["timestamp"]) and bars["timestamp"][start] == stamps[-1]:
+                    if all(bars[column][start] == existing[column][-1] for column in PRICE_COLUMNS):
+                        start += 1
+                    else:
+                        keep -= 1
+            written = {column: bars[column][start:] for column in COLUMNS}
+            if not len(written["timestamp"]):
+                return written
+
+            directory = self._dir(symbol, interval)
+            os.makedirs(directory, exist_ok=True)
+            for column in COLUMNS:
+                merged = np.concatenate([existing[column][:keep], written[column]])
+                path = os.path.join(directory, f"{column}.npy")
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, merged)
+                os.replace(tmp_path, path)
+        return written
+
+    def _notify(self, symbol: str, interval: str, written: Dict[str, np.ndarray]) -> int:
+        if len(written["timestamp"]):
+            for listener in self.listeners:
+                try:
+                    listener(symbol, interval, written)
+                except Exception as e:
+                    logger.warning(f"K 线追加监听器失败: {e}")
+        return len(written["timestamp"])
+
+    def append(self, symbol: str, interval: str, bars: Dict[str, np.ndarray]) -> int:
+        """追加新的 K 线并覆盖有变化的最后一根，返回写入的数量"""
+        return self._notify(symbol, interval, self._write(symbol, interval, bars))
+
+    async def append_async(self, symbol: str, interval: str, bars: Dict[str, np.ndarray]) -> int:
+        """与 append 相同，但整列重写文件放到线程中执行，不阻塞事件循环；监听器仍在事件循环中调用"""
+        written = await asyncio.to_thread(self._write, symbol, interval, bars)
+        return self._notify(symbol, interval, written)
+
+    def tail(self, symbol: str, interval: str = "daily", limit: int = 100) -> List[Dict[str, Any]]:
+        """以行的形式返回最近 limit 根 K 线，供接口与 Agent 工具直接序列化"""
+        bars = self.load(symbol, interval)
+        stamps = bars["timestamp"][-limit:] if limit > 0 else bars["timestamp"][:0]
+        count = len(stamps)
+        dates = np.asarray(stamps, dtype="datetime64[s]")
+        unit = "D" if interval not in INTRADAY_INTERVALS else "s"
+        labels = np.datetime_as_string(dates, unit=unit).tolist()
+        columns = {column: np.asarray(bars[column][len(bars[column]) - count:]).tolist() for column in PRICE_COLUMNS}
+        return [
+            {"time": labels[i], **{column: columns[column][i] for column in PRICE_COLUMNS}}
+            for i in range(count)
+        ]
+
+    def read_meta(self, symbol: str, interval: str) -> Dict[str, Any]:
+        path = os.path.join(self._dir(symbol, interval), "meta.json")
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_meta(self, symbol: str, interval: str, meta: Dict[str, Any]):
+        directory = self._dir(symbol, interval)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+
+# 进程内共享的 K 线存储
+history_store = PriceHistoryStore()
+
+
+def _refresh_seconds(interval: str) -> float:
+    if interval in INTRADAY_INTERVALS:
+        return INTRADAY_REFRESH_SECONDS
+    return HISTORY_REFRESH_SECONDS[interval]
+
+
+async def ingest_history(
+    symbol: str,
+    interval: str = "daily",
+    store: Optional[PriceHistoryStore] = None,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """
+    拉取并增量写入历史 K 线。
+    本地没有数据或缺口超过 compact 覆盖范围时请求 full，否则只请求最近 100 根；
+    刚刚更新过的数据直接跳过网络请求。
+    """
+    if interval not in SERIES_FUNCTIONS:
+        raise ValueError(f"不支持的周期: {interval}")
+    store = store or history_store
+    symbol = symbol.upper()
+
+    meta = store.read_meta(symbol, interval)
+    last = store.last_timestamp(symbol, interval)
+    if not force and last is not None and time.time() - meta.get("fetched_at", 0) < _refresh_seconds(interval):
+        return {"symbol": symbol, "interval": interval, "appended": 0, "last_timestamp": last, "fetched": False}
+
+    if not market_data.ALPHA_VANTAGE_API_KEY:
+        return {"symbol": symbol, "interval": interval, "error": "Alpha Vantage API key not configured"}
+
+    function, _ = SERIES_FUNCTIONS[interval]
+    params = {}
+    if interval in INTRADAY_INTERVALS:
+        params["interval"] = interval
+    gap_bars = None if last is None else (time.time() - last) / _BAR_SECONDS[interval]
+    params["outputsize"] = "compact" if gap_bars is not None and gap_bars < COMPACT_BARS * 0.7 else "full"
+
+    try:
+        data = await market_data.query_alpha_vantage(function, symbol, **params)
+    except RateLimitExceeded as e:
+        return {"symbol": symbol, "interval": interval, "error": str(e), "rate_limited": True}
+    except Exception as e:
+        return {"symbol": symbol, "interval": interval, "error": f"API request failed: {str(e)}"}
+    bars = parse_time_series(data, interval)
+    if len(bars["timestamp"]) == 0:
+        return {
+            "symbol": symbol,
+            "interval": interval,
+            "error": market_data.upstream_error_message(data),
+            "rate_limited": market_data.is_throttled_payload(data),
+        }
+
+    appended = await store.append_async(symbol, interval, bars)
+    store.write_meta(symbol, interval, {"fetched_at": time.time(), "outputsize": params["outputsize"]})
+    logger.info(f"{symbol} {interval} K 线追加 {appended} 根")
+    return {
+        "symbol": symbol,
+        "interval": interval,
+        "appended": appended,
+        "last_timestamp": int(bars["timestamp"][-1]),
+        "fetched": True,
+    }
+
+
+async def get_price_history(
+    symbol: str,
+    interval: str = "daily",
+    limit: int = 100,
+    store: Optional[PriceHistoryStore] = None,
+) -> Dict[str, Any]:
+    """先增量更新再从本地读取最近 limit 根 K 线；上游不可用时仍返回已有的本地数据"""
+    store = store or history_store
+    result = await ingest_history(symbol, interval, store=store)
+    bars = store.tail(symbol, interval, limit)
+    if not bars and "error" in result:
+        return result
+    response = {"symbol": symbol.upper(), "interval": interval, "bars": bars}
+    if "error" in result:
+        response["stale"] = True
+        response["refresh_error"] = result["error"]
+    return response
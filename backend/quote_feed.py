@@ -0,0 +1,185 @@
+"""
+实时报价推送
+每个被订阅的股票只有一个后台轮询任务，结果扇出给所有订阅者；只推送发生变化的字段。
+上游调用量只与去重后的股票数相关，与连接的客户端数量无关。
+慢客户端的待发送更新按股票合并，不会无限堆积；
+上游限流时按指数退避放慢轮询，错误只在状态变化时推送一次
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from cache import FUNCTION_TTLS
+from rate_limiter import PRIORITY_BACKGROUND, priority_scope
+
+logger = logging.getLogger(__name__)
+
+# 每只股票的轮询间隔（秒），默认等于报价缓存 TTL：更频繁的轮询只会重复读到同一份缓存
+QUOTE_POLL_INTERVAL = float(os.getenv("QUOTE_POLL_INTERVAL", str(FUNCTION_TTLS["GLOBAL_QUOTE"])))
+# 上游限流时轮询间隔逐次翻倍，最长不超过该值（秒）
+QUOTE_MAX_BACKOFF = float(os.getenv("QUOTE_MAX_BACKOFF", "300"))
+# 单个连接最多订阅的股票数
+MAX_SUBSCRIPTIONS = int(os.getenv("QUOTE_FEED_MAX_SUBSCRIPTIONS", "50"))
+
+# 报价中需要推送的字段
+QUOTE_FIELDS = ("price", "change", "change_percent", "volume", "high", "low", "open", "previous_close")
+
+
+def diff_fields(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Dict[str, Any]:
+    """返回 current 中与 previous 不同的字段"""
+    if previous is None:
+        return dict(current)
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+class FeedSubscriber:
+    """一个客户端连接：按股票合并待发送的更新，由发送循环取走"""
+
+    def __init__(self):
+        self.symbols: Set[str] = set()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._ready = asyncio.Event()
+
+    def publish(self, symbol: str, message: Dict[str, Any]):
+        """合并同一股票尚未发出的更新：快照直接覆盖，增量字段叠加；同一条消息会发给多个订阅者，这里只修改自己的副本"""
+        pending = self._pending.get(symbol)
+        if pending is not None and message["type"] == "update" and pending["type"] in ("update", "snapshot"):
+            key = "changes" if pending["type"] == "update" else "quote"
+            pending[key] = {**pending[key], **message["changes"]}
+        else:
+            self._pending[symbol] = dict(message)
+        self._ready.set()
+
+    async def next_batch(self) -> Dict[str, Dict[str, Any]]:
+        """等待并取走所有待发送的消息"""
+        await self._ready.wait()
+        self._ready.clear()
+        batch, self._pending = self._pending, {}
+        return batch
+
+
+class QuoteFeed:
+    """按股票去重的报价轮询与扇出"""
+
+    def __init__(
+        self,
+        fetch_quote: Callable[[str], Awaitable[Dict[str, Any]]],
+        interval: float = QUOTE_POLL_INTERVAL,
+        max_backoff: float = QUOTE_MAX_BACKOFF,
+    ):
+        self._fetch_quote = fetch_quote
+        self.interval = interval
+        self.max_backoff = max(interval, max_backoff)
+        self._subscribers: Dict[str, Set[FeedSubscriber]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        # 每只股票当前的错误消息，恢复正常后移除
+        self._errors: Dict[str, Dict[str, Any]] = {}
+        self.polls = 0
+        self.errors_sent = 0
+
+    def subscribe(self, subscriber: FeedSubscriber, symbol: str):
+        symbol = symbol.upper()
+        subscriber.symbols.add(symbol)
+        self._subscribers.setdefault(symbol, set()).add(subscriber)
+        # 已有最新报价时立即给新订阅者发送完整快照
+        if symbol in self._errors:
+            subscriber.publish(symbol, self._errors[symbol])
+        elif symbol in self._latest:
+            subscriber.publish(symbol, {"type": "snapshot", "symbol": symbol, "quote": dict(self._latest[symbol])})
+        if symbol not in self._pollers:
+            self._pollers[symbol] = asyncio.ensure_future(self._poll(symbol))
+
+    def unsubscribe(self, subscriber: FeedSubscriber, symbol: str):
+        symbol = symbol.upper()
+        subscriber.symbols.discard(symbol)
+        subscribers = self._subscribers.get(symbol)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            # 最后一个订阅者离开时停止轮询
+            del self._subscribers[symbol]
+            self._latest.pop(symbol, None)
+            self._errors.pop(symbol, None)
+            poller = self._pollers.pop(symbol, None)
+            if poller is not None:
+                poller.cancel()
+
+    def disconnect(self, subscriber: FeedSubscriber):
+        for symbol in list(subscriber.symbols):
+            self.unsubscribe(subscriber, symbol)
+
+    def _broadcast(self, symbol: str, message: Dict[str, Any]):
+        for subscriber in self._subscribers.get(symbol, ()):
+            subscriber.publish(symbol, message)
+
+    async def poll_once(self, symbol: str) -> bool:
+        """拉取一次报价，把变化推送给订阅者；返回本次是否被上游限流"""
+        self.polls += 1
+        quote = await self._fetch_quote(symbol)
+        if "error" in quote:
+            error = {
+                "type": "error",
+                "symbol": symbol,
+                "error": quote["error"],
+                "rate_limited": bool(quote.get("rate_limited")),
+            }
+            # 持续处于同一错误状态时不重复推送
+            if self._errors.get(symbol) != error:
+                self._errors[symbol] = error
+                self.errors_sent += 1
+                self._broadcast(symbol, error)
+            return error["rate_limited"]
+        recovered = self._errors.pop(symbol, None) is not None
+        current = {field: quote.get(field) for field in QUOTE_FIELDS}
+        previous = self._latest.get(symbol)
+        changes = diff_fields(previous, current)
+        self._latest[symbol] = current
+        if previous is None or recovered:
+            # 从错误中恢复时发送完整快照，客户端据此清除错误状态
+            self._broadcast(symbol, {"type": "snapshot", "symbol": symbol, "quote": current})
+        elif changes:
+            self._broadcast(symbol, {"type": "update", "symbol": symbol, "changes": changes})
+        return False
+
+    async def _poll(self, symbol: str):
+        delay = self.interval
+        with priority_scope(PRIORITY_BACKGROUND):
+            while True:
+                try:
+                    rate_limited = await self.poll_once(symbol)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"{symbol} 报价轮询失败: {e}")
+                    rate_limited = False
+                # 被限流时逐次加倍等待，恢复后回到正常间隔
+                delay = min(delay * 2, self.max_backoff) if rate_limited else self.interval
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        pollers = list(self._pollers.values())
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._pollers.clear()
+        self._subscribers.clear()
+        self._latest.clear()
+        self._errors.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        clients = set()
+        for subscribers in self._subscribers.values():
+            clients.update(subscribers)
+        return {
+            "symbols": len(self._pollers),
+            "clients": len(clients),
+            "subscriptions": sum(len(s) for s in self._subscribers.values()),
+            "polls": self.polls,
+            "interval": self.interval,
+            "errors_sent": self.errors_sent,
+            "backing_off": sum(1 for error in self._errors.values() if error["rate_limited"]),
+        }
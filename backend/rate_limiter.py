@@ -0,0 +1,312 @@
+"""
+Alpha Vantage 上游调用调度器
+令牌桶控制每分钟调用数，并按自然日统计每日配额；
+等待中的请求按优先级排队（交互式分析优先于后台刷新），低优先级请求在配额紧张时被延后或拒绝。
+令牌桶与每日计数只在本进程内有效；配置 REDIS_URL 后另由 Redis 计数器（见 redis_cache.RedisQuota）
+在后端与 MCP 服务等多个进程之间共享同一份配额
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 请求优先级，数值越小越优先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_DEFAULT: "default",
+    PRIORITY_BACKGROUND: "background",
+}
+
+CALLS_PER_MINUTE = float(os.getenv("ALPHA_VANTAGE_CALLS_PER_MINUTE", "5"))
+CALLS_PER_DAY = int(os.getenv("ALPHA_VANTAGE_CALLS_PER_DAY", "25"))
+# 为交互式请求预留的每日配额比例，后台请求不能占用这部分
+INTERACTIVE_RESERVE = float(os.getenv("ALPHA_VANTAGE_INTERACTIVE_RESERVE", "0.2"))
+# 各优先级最长排队时间（秒），超时视为被延后
+MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("ALPHA_VANTAGE_MAX_WAIT_INTERACTIVE", "30")),
+    PRIORITY_DEFAULT: float(os.getenv("ALPHA_VANTAGE_MAX_WAIT_DEFAULT", "60")),
+    PRIORITY_BACKGROUND: float(os.getenv("ALPHA_VANTAGE_MAX_WAIT_BACKGROUND", "120")),
+}
+
+_request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_DEFAULT)
+
+
+class RateLimitExceeded(Exception):
+    """配额耗尽或排队超时"""
+
+
+def current_priority() -> int:
+    """当前上下文中的请求优先级"""
+    return _request_priority.get()
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """在 with 块内发起的上游调用使用指定优先级"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+class TokenBucket:
+    """令牌桶：容量即突发上限，按固定速率补充"""
+
+    def __init__(self, rate_per_second: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def try_consume(self, amount: float = 1.0) -> bool:
+        """令牌足够时扣减并返回 True"""
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return True
+        return False
+
+    def time_until(self, amount: float = 1.0) -> float:
+        """距离可获得指定数量令牌还需等待的秒数"""
+        self._refill()
+        missing = amount - self._tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def refund(self, amount: float = 1.0):
+        """归还已扣减但未使用的令牌"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+    def drain(self):
+        """清空令牌（上游返回限流提示时调用）"""
+        self._refill()
+        self._tokens = 0.0
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future", "enqueued_at", "shared_keys")
+
+    def __init__(self, priority: int, seq: int, future: asyncio.Future, enqueued_at: float):
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.enqueued_at = enqueued_at
+        # 从共享配额中预留的计数器，归还许可时使用
+        self.shared_keys: Optional[Tuple[str, ...]] = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class UpstreamScheduler:
+    """按优先级发放上游调用许可的调度器"""
+
+    def __init__(
+        self,
+        calls_per_minute: float = CALLS_PER_MINUTE,
+        calls_per_day: int = CALLS_PER_DAY,
+        interactive_reserve: float = INTERACTIVE_RESERVE,
+        max_wait: Optional[Dict[int, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.bucket = TokenBucket(calls_per_minute / 60.0, max(1.0, calls_per_minute), clock)
+        self.calls_per_day = calls_per_day
+        self.interactive_reserve = interactive_reserve
+        self.max_wait = dict(MAX_WAIT if max_wait is None else max_wait)
+        self._clock = clock
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._day = self._today()
+        self._used_today = 0
+        self.granted = 0
+        self.rejected = 0
+        self.deferred = 0
+        self.throttled = 0
+        self._wait_times: Dict[int, Deque[float]] = {p: deque(maxlen=1000) for p in PRIORITY_NAMES}
+        # 跨进程共享的配额计数器（redis_cache.RedisQuota），未配置时只按本进程计数
+        self.shared = None
+
+    @staticmethod
+    def _today():
+        # Alpha Vantage 每日配额按 UTC 自然日重置
+        return datetime.now(timezone.utc).date()
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._used_today = 0
+
+    def _daily_limit_for(self, priority: int) -> int:
+        if priority == PRIORITY_INTERACTIVE:
+            return self.calls_per_day
+        return int(self.calls_per_day * (1 - self.interactive_reserve))
+
+    async def acquire(self, priority: Optional[int] = None):
+        """等待直到获得一次上游调用许可"""
+        priority = current_priority() if priority is None else priority
+        self._roll_day()
+        if self._used_today >= self._daily_limit_for(priority):
+            self.rejected += 1
+            raise RateLimitExceeded(
+                f"Alpha Vantage 每日配额不足（已用 {self._used_today}/{self.calls_per_day}，优先级 {PRIORITY_NAMES[priority]}）"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(priority, next(self._seq), future, self._clock())
+        heapq.heappush(self._queue, waiter)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait.get(priority))
+        except asyncio.TimeoutError:
+            await self._abandon(waiter)
+            self.deferred += 1
+            raise RateLimitExceeded(f"等待 Alpha Vantage 调用配额超时（优先级 {PRIORITY_NAMES[priority]}）")
+        except asyncio.CancelledError:
+            await self._abandon(waiter)
+            raise
+
+    async def _abandon(self, waiter: _Waiter):
+        """放弃排队；若许可恰好已经发放（超时与发放同时发生），归还令牌与配额计数"""
+        future = waiter.future
+        granted = future.done() and not future.cancelled() and future.exception() is None
+        future.cancel()
+        self._wakeup.set()
+        if not granted:
+            return
+        self.bucket.refund(1)
+        self._used_today = max(0, self._used_today - 1)
+        self.granted -= 1
+        if self.shared is not None and waiter.shared_keys:
+            await self.shared.release(waiter.shared_keys)
+
+    async def _dispatch(self):
+        """按优先级依次发放许可，令牌不足时休眠到下一个令牌可用"""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            self._roll_day()
+            if self._used_today >= self._daily_limit_for(head.priority):
+                heapq.heappop(self._queue)
+                self.rejected += 1
+                head.future.set_exception(RateLimitExceeded("Alpha Vantage 每日配额已用尽"))
+                head.future.exception()
+                continue
+
+            wait = self.bucket.time_until(1)
+            if wait > 0:
+                # 等待下一个令牌，期间若有新请求入队或请求取消则提前醒来重新检查队首
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self.shared is not None:
+                try:
+                    wait, keys = await self.shared.reserve(self._daily_limit_for(head.priority))
+                except RateLimitExceeded as e:
+                    if self._queue and self._queue[0] is head:
+                        heapq.heappop(self._queue)
+                    if not head.future.done():
+                        self.rejected += 1
+                        head.future.set_exception(e)
+                        head.future.exception()
+                    continue
+                if wait > 0:
+                    # 其他进程已用完本分钟的共享配额，等到下一个窗口
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if head.future.done() or not self._queue or self._queue[0] is not head:
+                    # 预留期间队首已取消或被更高优先级请求取代，归还预留重新调度
+                    await self.shared.release(keys)
+                    continue
+                head.shared_keys = keys
+
+            # 等待期间可能有更高优先级的请求入队，这里取的始终是当前队首
+            heapq.heappop(self._queue)
+            self.bucket.try_consume(1)
+            self._used_today += 1
+            self.granted += 1
+            self._wait_times[head.priority].append(self._clock() - head.enqueued_at)
+            head.future.set_result(None)
+
+    def report_throttled(self):
+        """上游返回限流提示时清空令牌，后续请求自动退避"""
+        self.throttled += 1
+        self.bucket.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列深度、等待时间与配额使用情况"""
+        self._roll_day()
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._queue:
+            if not waiter.future.done():
+                depth[PRIORITY_NAMES[waiter.priority]] += 1
+
+        wait_stats = {}
+        for priority, samples in self._wait_times.items():
+            ordered = sorted(samples)
+            wait_stats[PRIORITY_NAMES[priority]] = {
+                "count": len(ordered),
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2) if ordered else 0.0,
+                "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            }
+
+        return {
+            "queue_depth": depth,
+            "wait_time": wait_stats,
+            "tokens_available": round(self.bucket.tokens, 3),
+            "calls_per_minute": self.bucket.rate * 60,
+            "calls_today": self._used_today,
+            "calls_per_day": self.calls_per_day,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "deferred": self.deferred,
+            "throttled": self.throttled,
+            "shared": self.shared.stats() if self.shared is not None else None,
+        }
+
+
+# backend 与 mcp_server 共享的调度器实例
+upstream_scheduler = UpstreamScheduler()
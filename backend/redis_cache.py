@@ -0,0 +1,324 @@
+"""
+Redis 分布式缓存层（L2）
+多个后端副本共享同一份行情数据，并通过分布式锁避免缓存击穿时的重复上游请求；
+同时以 INCR/PEXPIRE 计数器在各进程之间共享 Alpha Vantage 的每分钟与每日配额
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # msgpack 不可用时退化为紧凑 JSON
+    msgpack = None
+
+from cache import market_cache
+from rate_limiter import RateLimitExceeded, upstream_scheduler
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+KEY_PREFIX = os.getenv("REDIS_CACHE_PREFIX", "agentic:md:")
+# 锁的过期时间（秒）；回源期间持锁副本每隔 1/3 过期时间续期一次，进程崩溃时锁在该时间后自动释放
+LOCK_TIMEOUT = float(os.getenv("REDIS_LOCK_TIMEOUT", "15"))
+LOCK_WAIT = float(os.getenv("REDIS_LOCK_WAIT", "10"))
+LOCK_POLL_INTERVAL = 0.05
+
+# 仅当锁仍归自己所有时才删除，避免误删其他副本重新获取的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# 仅当锁仍归自己所有时才续期
+_EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_MISSING = object()
+
+
+def encode(expires_at: float, value: Any) -> bytes:
+    """序列化缓存值，首字节标记编码格式以便不同部署之间互读"""
+    if msgpack is not None:
+        return b"m" + msgpack.packb([expires_at, value], use_bin_type=True)
+    return b"j" + json.dumps([expires_at, value], separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def decode(raw: bytes) -> Tuple[float, Any]:
+    """反序列化缓存值，返回 (过期时间戳, 值)"""
+    fmt, body = raw[:1], raw[1:]
+    if fmt == b"m":
+        expires_at, value = msgpack.unpackb(body, raw=False)
+    else:
+        expires_at, value = json.loads(body)
+    return expires_at, value
+
+
+def redis_key(key: Hashable) -> str:
+    """将缓存 key（通常是元组）转换为 Redis key"""
+    if isinstance(key, tuple):
+        parts = []
+        for part in key:
+            if isinstance(part, tuple):
+                parts.extend(f"{k}={v}" for k, v in part)
+            else:
+                parts.append(str(part))
+        return KEY_PREFIX + ":".join(parts)
+    return KEY_PREFIX + str(key)
+
+
+class RedisCacheTier:
+    """基于 Redis 的二级缓存，配合 TTLCache 使用"""
+
+    def __init__(
+        self,
+        client,
+        lock_timeout: float = LOCK_TIMEOUT,
+        lock_wait: float = LOCK_WAIT,
+        poll_interval: float = LOCK_POLL_INTERVAL,
+    ):
+        self.client = client
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self.lock_waits = 0
+        self.lock_extensions = 0
+        self.locks_lost = 0
+        self.errors = 0
+
+    async def _get(self, name: str) -> Any:
+        """读取 L2，返回 (值, 剩余秒数)；未命中返回 _MISSING"""
+        try:
+            raw = await self.client.get(name)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis 读取失败: {e}")
+            return _MISSING
+        if raw is None:
+            return _MISSING
+        expires_at, value = decode(raw)
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return _MISSING
+        return value, remaining
+
+    async def _set(self, name: str, value: Any, ttl: float):
+        try:
+            await self.client.set(name, encode(time.time() + ttl, value), px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis 写入失败: {e}")
+
+    async def _acquire(self, lock_name: str, token: str) -> Optional[bool]:
+        """尝试获取分布式锁；Redis 不可用时返回 None"""
+        try:
+            return bool(await self.client.set(lock_name, token, nx=True, px=int(self.lock_timeout * 1000)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis 加锁失败: {e}")
+            return None
+
+    async def _release(self, lock_name: str, token: str):
+        try:
+            await self.client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_name, token)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis 释放锁失败: {e}")
+
+    async def _keep_lock(self, lock_name: str, token: str):
+        """
+        回源期间定期续期分布式锁：loader 可能在上游调度队列中等待远超锁过期时间，
+        锁提前过期会让其他副本也去回源
+        """
+        interval = self.lock_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                extended = await self.client.eval(_EXTEND_LOCK_SCRIPT, 1, lock_name, token, int(self.lock_timeout * 1000))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Redis 续期锁失败: {e}")
+                continue
+            if not extended:
+                self.locks_lost += 1
+                logger.warning(f"Redis 锁已被其他副本持有: {lock_name}")
+                return
+            self.lock_extensions += 1
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Tuple[Any, float]:
+        """
+        先查 Redis，未命中时由持有分布式锁的副本负责回源，其余副本轮询等待结果。
+        返回 (值, 剩余有效秒数)，供 L1 设置一致的过期时间。
+        """
+        name = redis_key(key)
+        lock_name = name + ":lock"
+        deadline = time.monotonic() + self.lock_wait
+
+        while True:
+            found = await self._get(name)
+            if found is not _MISSING:
+                self.hits += 1
+                return found
+
+            token = uuid.uuid4().hex
+            acquired = await self._acquire(lock_name, token)
+            if acquired is None:
+                # Redis 故障时直接回源，不影响服务可用性
+                self.misses += 1
+                return await loader(), ttl
+            if acquired:
+                self.misses += 1
+                keeper = asyncio.ensure_future(self._keep_lock(lock_name, token))
+                try:
+                    # 获取锁后再检查一次，防止在两次查询之间已被其他副本写入
+                    found = await self._get(name)
+                    if found is not _MISSING:
+                        return found
+                    value = await loader()
+                    if cacheable is None or cacheable(value):
+                        await self._set(name, value, ttl)
+                    return value, ttl
+                finally:
+                    keeper.cancel()
+                    await asyncio.gather(keeper, return_exceptions=True)
+                    # 释放时校验 token，锁已过期并被其他副本获取时不会误删
+                    await self._release(lock_name, token)
+
+            # 其他副本正在回源，等待其写入结果
+            self.lock_waits += 1
+            if time.monotonic() >= deadline:
+                self.misses += 1
+                return await loader(), ttl
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回 L2 命中与锁等待统计"""
+        return {
+            "backend": "redis",
+            "serializer": "msgpack" if msgpack is not None else "json",
+            "hits": self.hits,
+            "misses": self.misses,
+            "lock_waits": self.lock_waits,
+            "lock_extensions": self.lock_extensions,
+            "locks_lost": self.locks_lost,
+            "errors": self.errors,
+        }
+
+
+class RedisQuota:
+    """
+    跨进程共享的上游配额计数：每分钟一个固定窗口计数器、每个 UTC 自然日一个计数器。
+    UpstreamScheduler 在发放本地许可前先在这里预留，Redis 不可用时退化为只按本进程限流
+    """
+
+    def __init__(self, client, calls_per_minute: float, clock: Callable[[], float] = time.time):
+        self.client = client
+        self.calls_per_minute = calls_per_minute
+        self._clock = clock
+        self.used_today = 0
+        self.waits = 0
+        self.rejected = 0
+        self.errors = 0
+
+    async def _incr(self, name: str, ttl_ms: int) -> int:
+        count = await self.client.incr(name)
+        if count == 1:
+            await self.client.pexpire(name, ttl_ms)
+        return count
+
+    async def reserve(self, daily_limit: int) -> Tuple[float, Tuple[str, ...]]:
+        """
+        预留一次调用，返回 (需等待秒数, 计数器 key)。
+        本分钟的共享配额已用完时返回距下一个窗口的秒数；每日配额用完时抛出 RateLimitExceeded
+        """
+        now = self._clock()
+        window = int(now // 60)
+        day = datetime.fromtimestamp(now, timezone.utc).date().isoformat()
+        minute_key = f"{KEY_PREFIX}quota:minute:{window}"
+        day_key = f"{KEY_PREFIX}quota:day:{day}"
+        try:
+            if await self._incr(minute_key, 120_000) > self.calls_per_minute:
+                await self.client.decr(minute_key)
+                self.waits += 1
+                return (window + 1) * 60 - now, ()
+            used = await self._incr(day_key, 2 * 86400 * 1000)
+            if used > daily_limit:
+                await self.client.decr(day_key)
+                await self.client.decr(minute_key)
+                self.used_today = used - 1
+                self.rejected += 1
+                raise RateLimitExceeded(f"Alpha Vantage 共享每日配额不足（各进程已用 {used - 1}）")
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis 配额计数失败，退化为进程内限流: {e}")
+            return 0.0, ()
+        self.used_today = used
+        return 0.0, (minute_key, day_key)
+
+    async def release(self, keys: Tuple[str, ...]):
+        """归还已预留但未使用的配额"""
+        for name in keys:
+            try:
+                await self.client.decr(name)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Redis 归还配额失败: {e}")
+                return
+        self.used_today = max(0, self.used_today - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回共享配额的使用情况"""
+        return {
+            "backend": "redis",
+            "calls_today": self.used_today,
+            "minute_waits": self.waits,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+def configure_redis_tier(url: Optional[str] = None) -> Optional[RedisCacheTier]:
+    """根据 REDIS_URL 为共享行情缓存挂载 Redis 二级缓存，未配置时保持纯进程内缓存"""
+    url = url or REDIS_URL
+    if not url:
+        return None
+    import redis.asyncio as redis
+
+    client = redis.from_url(url)
+    tier = RedisCacheTier(client)
+    market_cache.l2 = tier
+    # 同一个 Redis 上共享上游调用配额，后端与 MCP 服务进程不再各自用满一份
+    upstream_scheduler.shared = RedisQuota(client, upstream_scheduler.bucket.rate * 60)
+    logger.info(f"行情缓存与上游配额已启用 Redis 共享: {url}")
+    return tier
+
+
+async def close_redis_tier():
+    """关闭 Redis 连接"""
+    tier = market_cache.l2
+    upstream_scheduler.shared = None
+    if isinstance(tier, RedisCacheTier):
+        await tier.client.aclose()
+        market_cache.l2 = None
@@ -0,0 +1,331 @@
+"""
+声明式规则引擎
+规则写在 JSON 配置文件中：每个输出字段是一组按顺序匹配的 (条件, 取值) 或一个算术表达式，洞察是若干规则组。
+配置加载时编译成以列数组为输入的函数，一次调用即对整批股票求值（np.select / 布尔掩码），
+不对单只股票做 Python 分支判断；配置文件修改后按 mtime 自动重新编译，无需重新部署。
+"""
+
+import ast
+import json
+import logging
+import os
+import re
+import string
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)([KMBT])\b")
+_MULTIPLIERS = {"K": 1e3, "M": 1e6, "B": 1e9, "T": 1e12}
+
+
+class RuleConfigError(ValueError):
+    """规则配置或规则表达式不合法"""
+
+
+def normalize_expression(expression: str) -> str:
+    """展开数量后缀（1M -> 1000000.0），并兼容 SQL 风格的 AND/OR/NOT"""
+    source = _SUFFIX.sub(lambda m: repr(float(m.group(1)) * _MULTIPLIERS[m.group(2)]), expression.strip())
+    return re.sub(r"\b(AND|OR|NOT)\b", lambda m: m.group(1).lower(), source)
+
+
+# ---------- 表达式编译 ----------
+
+Columns = Dict[str, np.ndarray]
+Column = Callable[[Columns], Any]
+
+_COMPARE = {ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+            ast.Eq: np.equal, ast.NotEq: np.not_equal}
+_ARITHMETIC = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+
+def _missing(values):
+    return np.isnan(values)
+
+
+def _fill(values, default):
+    return np.where(np.isnan(values), default, values)
+
+
+def _round(values, digits=0):
+    return np.round(values, int(digits))
+
+
+# 表达式中可调用的函数
+FUNCTIONS = {"missing": _missing, "fill": _fill, "abs": np.abs, "round": _round, "min": np.fmin, "max": np.fmax}
+
+
+def _truthy(values):
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return (values != 0) & ~np.isnan(values)
+
+
+class _Compiler:
+    """把表达式 AST 编译成闭包；数值字段为 float64 数组（缺失为 NaN），文本字段为 object 数组"""
+
+    def __init__(self, numeric: Iterable[str], text: Iterable[str]):
+        self.numeric = set(numeric)
+        self.text = set(text)
+
+    def compile(self, expression: str) -> Column:
+        try:
+            tree = ast.parse(normalize_expression(expression), mode="eval")
+        except SyntaxError as e:
+            raise RuleConfigError(f"规则表达式语法错误 {expression!r}: {e.msg}") from None
+        return self._node(tree.body)
+
+    def _text_literal(self, node: ast.AST) -> List[str]:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return [node.value]
+        if isinstance(node, (ast.List, ast.Tuple)) and all(isinstance(item, ast.Constant) and isinstance(item.value, str) for item in node.elts):
+            return [item.value for item in node.elts]
+        raise RuleConfigError(f"文本字段只能与字符串比较: {ast.unparse(node)}")
+
+    def _text_compare(self, field: str, op: ast.cmpop, other: ast.AST) -> Column:
+        values = self._text_literal(other)
+        if isinstance(op, (ast.Eq, ast.In)):
+            return lambda columns: np.isin(columns[field], values)
+        if isinstance(op, (ast.NotEq, ast.NotIn)):
+            return lambda columns: ~np.isin(columns[field], values)
+        raise RuleConfigError(f"文本字段 {field} 不支持 {type(op).__name__}")
+
+    def _compare(self, left: ast.AST, op: ast.cmpop, right: ast.AST) -> Column:
+        if isinstance(left, ast.Name) and left.id in self.text:
+            return self._text_compare(left.id, op, right)
+        if isinstance(right, ast.Name) and right.id in self.text and isinstance(op, (ast.Eq, ast.NotEq)):
+            return self._text_compare(right.id, op, left)
+        compare = _COMPARE.get(type(op))
+        if compare is None:
+            raise RuleConfigError(f"数值比较不支持 {type(op).__name__}")
+        lhs, rhs = self._node(left), self._node(right)
+        if compare is np.not_equal:
+            # 与筛选一致：缺失值不满足任何比较
+            def not_equal(columns):
+                a, b = lhs(columns), rhs(columns)
+                return np.not_equal(a, b) & ~np.isnan(a) & ~np.isnan(b)
+            return not_equal
+        return lambda columns: compare(lhs(columns), rhs(columns))
+
+    def _node(self, node: ast.AST) -> Column:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            value = float(node.value)
+            return lambda columns: value
+        if isinstance(node, ast.Name):
+            if node.id in self.numeric:
+                return lambda columns, field=node.id: columns[field]
+            if node.id in self.text:
+                raise RuleConfigError(f"文本字段 {node.id} 只能用于 ==、!=、in 比较")
+            raise RuleConfigError(f"未知字段: {node.id}")
+        if isinstance(node, ast.BoolOp):
+            parts = [self._node(value) for value in node.values]
+            reduce = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+            return lambda columns: reduce([_truthy(part(columns)) for part in parts])
+        if isinstance(node, ast.UnaryOp):
+            operand = self._node(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda columns: ~_truthy(operand(columns))
+            if isinstance(node.op, ast.USub):
+                return lambda columns: np.negative(operand(columns))
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            function = _ARITHMETIC[type(node.op)]
+            lhs, rhs = self._node(node.left), self._node(node.right)
+
+            def arithmetic(columns):
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    return function(lhs(columns), rhs(columns))
+            return arithmetic
+        if isinstance(node, ast.Compare):
+            # 支持链式比较：30 <= rsi <= 70
+            parts = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                parts.append(self._compare(left, op, right))
+                left = right
+            if len(parts) == 1:
+                return parts[0]
+            return lambda columns: np.logical_and.reduce([part(columns) for part in parts])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+            function = FUNCTIONS[node.func.id]
+            args = [self._node(arg) for arg in node.args]
+            return lambda columns: function(*(arg(columns) for arg in args))
+        raise RuleConfigError(f"不支持的规则表达式: {ast.unparse(node)}")
+
+
+class _Template:
+    """洞察文案模板，{field} 引用文本字段，{field:.1f} 按 printf 格式引用数值字段；整批拼接"""
+
+    def __init__(self, text: str, numeric: Iterable[str], text_fields: Iterable[str]):
+        self.parts: List[Tuple[str, Optional[str], str]] = []
+        numeric, text_fields = set(numeric), set(text_fields)
+        for literal, field, spec, _ in string.Formatter().parse(text):
+            if field is not None and field not in numeric and field not in text_fields:
+                raise RuleConfigError(f"模板引用了未知字段: {field}")
+            if field in text_fields and spec:
+                raise RuleConfigError(f"文本字段 {field} 不支持格式说明")
+            self.parts.append((literal, field, spec or "g"))
+        self.static = all(field is None for _, field, _ in self.parts)
+        self.text = "".join(literal for literal, _, _ in self.parts)
+
+    def render(self, columns: Columns, size: int) -> Any:
+        if self.static:
+            return self.text
+        rendered = np.full(size, "", dtype=object)
+        for literal, field, spec in self.parts:
+            rendered = rendered + literal
+            if field is None:
+                continue
+            values = columns[field]
+            if values.dtype == object:
+                rendered = rendered + values.astype(str).astype(object)
+            else:
+                rendered = rendered + np.char.mod(f"%{spec}", values).astype(object)
+        return rendered
+
+
+# ---------- 规则集 ----------
+
+class _Cases:
+    """按顺序匹配的条件分支，先命中者生效；全部未命中时取 default（为 null 时无输出）"""
+
+    def __init__(self, spec: Dict[str, Any], compiler: _Compiler, templates: bool):
+        cases = spec.get("cases")
+        if not isinstance(cases, list):
+            raise RuleConfigError("cases 必须是列表")
+        self.conditions = [compiler.compile(str(case["when"])) for case in cases]
+        values = [case["then"] for case in cases] + [spec.get("default")]
+        self.when = compiler.compile(str(spec["when"])) if spec.get("when") else None
+        if templates:
+            values = [None if value is None else _Template(str(value), compiler.numeric, compiler.text) for value in values]
+        self.values = values
+        self.templates = templates
+
+    def evaluate(self, columns: Columns, size: int) -> np.ndarray:
+        """与 np.select 相同的语义，取值统一为 object 数组以便混合 None、文本与整批渲染的模板"""
+        choices = [value.render(columns, size) if self.templates and value is not None else value for value in self.values]
+        result = np.empty(size, dtype=object)
+        result[:] = choices[-1]
+        # 倒序覆盖，使先出现的分支优先
+        for condition, choice in zip(self.conditions[::-1], choices[-2::-1]):
+            mask = np.broadcast_to(_truthy(condition(columns)), (size,))
+            result[mask] = choice[mask] if isinstance(choice, np.ndarray) else choice
+        if self.when is not None:
+            result[~np.broadcast_to(_truthy(self.when(columns)), (size,))] = None
+        return result
+
+
+class RuleSet:
+    """一份编译好的规则配置"""
+
+    def __init__(self, config: Dict[str, Any], numeric: Iterable[str], text: Iterable[str]):
+        if not isinstance(config, dict):
+            raise RuleConfigError("规则配置必须是 JSON 对象")
+        self.config = config
+        self.version = config.get("version")
+        numeric, text = tuple(numeric), tuple(text)
+        compiler = _Compiler(numeric, text)
+        self.defaults = {field: float(value) for field, value in config.get("defaults", {}).items()}
+        unknown = set(self.defaults) - set(numeric)
+        if unknown:
+            raise RuleConfigError(f"defaults 中有未知字段: {sorted(unknown)}")
+        try:
+            self.outputs: Dict[str, Tuple[str, Any]] = {}
+            for name, spec in config.get("outputs", {}).items():
+                if "value" in spec:
+                    self.outputs[name] = ("value", compiler.compile(str(spec["value"])))
+                else:
+                    self.outputs[name] = ("cases", _Cases(spec, compiler, templates=False))
+            insights = config.get("insights", {})
+            self.insight_limit = int(insights.get("limit", 4))
+            self.insight_groups = [(group.get("name"), _Cases(group, compiler, templates=True)) for group in insights.get("groups", [])]
+        except (KeyError, TypeError, AttributeError) as e:
+            raise RuleConfigError(f"规则配置结构错误: {e!r}") from None
+
+    def evaluate(self, columns: Columns) -> Dict[str, List[Any]]:
+        """对整批股票求值；columns 中每个字段是长度相同的数组，返回每个输出字段的列表"""
+        size = len(next(iter(columns.values()))) if columns else 0
+        columns = dict(columns)
+        for field, default in self.defaults.items():
+            if field in columns:
+                columns[field] = _fill(columns[field], default)
+
+        results: Dict[str, List[Any]] = {}
+        for name, (kind, rule) in self.outputs.items():
+            if kind == "value":
+                values = np.broadcast_to(np.asarray(rule(columns), dtype=np.float64), (size,))
+            else:
+                values = rule.evaluate(columns, size)
+            results[name] = values.tolist()
+
+        if self.insight_groups:
+            # (规则组, 股票) 矩阵，未命中的位置为 None；每只股票按规则组顺序取前 limit 条
+            matrix = np.stack([group.evaluate(columns, size) for _, group in self.insight_groups]) if size else np.empty((0, 0))
+            present = matrix != None  # noqa: E711  逐元素比较
+            rank = np.cumsum(present, axis=0)
+            keep = present & (rank <= self.insight_limit)
+            results["insights"] = [matrix[keep[:, i], i].tolist() for i in range(size)]
+        return results
+
+
+class RuleEngine:
+    """从文件加载规则集，文件修改时间变化后自动重新编译；新配置无效时记录错误并继续使用旧规则"""
+
+    def __init__(self, path: str, numeric: Iterable[str], text: Iterable[str] = ()):
+        self.path = path
+        self.numeric = tuple(numeric)
+        self.text = tuple(text)
+        self.rules: Optional[RuleSet] = None
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._mtime: Optional[float] = None
+
+    def _load(self, mtime: float):
+        with open(self.path, encoding="utf-8") as f:
+            try:
+                config = json.load(f)
+            except json.JSONDecodeError as e:
+                raise RuleConfigError(f"规则文件不是合法的 JSON: {e}") from None
+        self.rules = RuleSet(config, self.numeric, self.text)
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        self.reloads += 1
+        self.last_error = None
+
+    def reload(self, force: bool = False) -> RuleSet:
+        """mtime 未变时直接返回已编译的规则；首次加载失败时抛出异常"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self.rules is None:
+                raise RuleConfigError(f"无法读取规则文件 {self.path}: {e}") from None
+            return self.rules
+        if force or mtime != self._mtime:
+            try:
+                self._load(mtime)
+            except (OSError, ValueError) as e:
+                if self.rules is None:
+                    raise
+                # 保留旧规则，避免一次错误的编辑影响线上分析
+                self._mtime = mtime
+                self.last_error = str(e)
+                logger.error("规则文件 %s 无效，继续使用上一版本: %s", self.path, e)
+        return self.rules
+
+    def evaluate(self, columns: Columns) -> Dict[str, List[Any]]:
+        return self.reload().evaluate(columns)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "version": self.rules.version if self.rules else None,
+            "outputs": list(self.rules.outputs) if self.rules else [],
+            "insight_groups": [name for name, _ in self.rules.insight_groups] if self.rules else [],
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,388 @@
+"""
+横截面选股
+把观察池中每只股票最新的报价、基本面与技术指标字段保存在内存列式表中，数值列按需建立排序索引。
+筛选表达式（如 sector == "TECHNOLOGY" and pe < 15 and rsi < 30 and volume > 1M）只编译一次，
+执行时每个条件在排序索引上二分得到布尔掩码，再按位组合，扫描数千只股票只需几毫秒。
+"""
+
+import ast
+import asyncio
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import fundamentals
+import market_data
+import valuation
+from analysis import batch_latest_indicators
+from price_history import history_store
+from rate_limiter import PRIORITY_BACKGROUND, priority_scope
+from rules import normalize_expression
+
+logger = logging.getLogger(__name__)
+
+# 后台定期刷新的股票池，默认与估值的同行观察池一致
+SCREENER_UNIVERSE = [s.strip().upper() for s in os.getenv("SCREENER_UNIVERSE", "").split(",") if s.strip()] or valuation.PEER_UNIVERSE
+SCREENER_REFRESH_SECONDS = float(os.getenv("SCREENER_REFRESH_SECONDS", "300"))
+# 单次筛选最多返回的行数
+SCREEN_MAX_LIMIT = int(os.getenv("SCREEN_MAX_LIMIT", "500"))
+
+TEXT_COLUMNS = ("symbol", "name", "sector", "industry")
+NUMERIC_COLUMNS = (
+    # 报价
+    "price", "change", "change_percent", "volume",
+    # 基本面
+    "market_cap", "pe", "forward_pe", "peg", "pb", "ps", "ev_ebitda", "eps", "dividend_yield", "beta",
+    "profit_margin", "roe", "revenue_growth", "earnings_growth",
+    # 技术指标
+    "rsi", "macd_histogram", "sma_20", "sma_50", "ema_20", "bollinger_upper", "bollinger_lower", "atr", "vwap_20",
+    "updated_at",
+)
+
+# OVERVIEW 原始字段 -> 列
+OVERVIEW_COLUMNS = {
+    "Name": "name", "Sector": "sector", "Industry": "industry", "MarketCapitalization": "market_cap",
+    "PERatio": "pe", "ForwardPE": "forward_pe", "PEGRatio": "peg", "PriceToBookRatio": "pb",
+    "PriceToSalesRatioTTM": "ps", "EVToEBITDA": "ev_ebitda", "EPS": "eps", "DividendYield": "dividend_yield",
+    "Beta": "beta", "ProfitMargin": "profit_margin", "ReturnOnEquityTTM": "roe",
+    "QuarterlyRevenueGrowthYOY": "revenue_growth", "QuarterlyEarningsGrowthYOY": "earnings_growth",
+}
+# market_data.parse_overview 输出的字段 -> 列
+PARSED_OVERVIEW_COLUMNS = {
+    "name": "name", "sector": "sector", "industry": "industry", "market_cap": "market_cap",
+    "pe_ratio": "pe", "dividend_yield": "dividend_yield", "beta": "beta",
+}
+# 指标字段（接口输出与 indicators.latest_values 两种命名）-> 列
+INDICATOR_COLUMNS = {
+    "rsi": "rsi", "macd_histogram": "macd_histogram", "moving_average_20": "sma_20", "sma_20": "sma_20",
+    "moving_average_50": "sma_50", "sma_50": "sma_50", "ema_20": "ema_20", "bollinger_upper": "bollinger_upper",
+    "bollinger_lower": "bollinger_lower", "atr": "atr", "vwap_20": "vwap_20", "vwap": "vwap_20",
+}
+QUOTE_COLUMNS = ("price", "change", "change_percent", "volume")
+# 未指定返回字段时附带的列
+DEFAULT_FIELDS = ("symbol", "name", "sector", "price", "change_percent")
+
+
+class ScreenExpressionError(ValueError):
+    """筛选表达式不合法"""
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(str(value).replace("%", "")) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ColumnarTable:
+    """
+    按列存储的股票表：每个数值列是一个 float64 数组（缺失为 NaN），文本列是 object 数组，
+    symbol -> 行号的字典用于原地更新。数值列的排序索引在该列被写入后失效，下次查询时重建
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self._rows: Dict[str, int] = {}
+        self._numeric = {column: np.full(capacity, np.nan) for column in NUMERIC_COLUMNS}
+        self._text = {column: np.full(capacity, "", dtype=object) for column in TEXT_COLUMNS}
+        # 列 -> (按值排序的行号, 排序后的值, 有效值个数)
+        self._indexes: Dict[str, Tuple[np.ndarray, np.ndarray, int]] = {}
+        self.index_builds = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.upper() in self._rows
+
+    def _row(self, symbol: str) -> int:
+        symbol = symbol.upper()
+        row = self._rows.get(symbol)
+        if row is None:
+            row = self.size
+            if row == len(self._text["symbol"]):
+                # 容量翻倍，均摊 O(1)
+                for columns, fill in ((self._numeric, np.nan), (self._text, "")):
+                    for name, values in columns.items():
+                        grown = np.full(len(values) * 2, fill, dtype=values.dtype)
+                        grown[:row] = values
+                        columns[name] = grown
+            self._text["symbol"][row] = symbol
+            self._rows[symbol] = row
+            self.size += 1
+        return row
+
+    def upsert(self, symbol: str, values: Dict[str, Any]):
+        """写入一只股票的若干列，未给出的列保持不变"""
+        row = self._row(symbol)
+        for column, value in values.items():
+            if column in self._numeric:
+                self._numeric[column][row] = _number(value)
+                self._indexes.pop(column, None)
+            elif column in self._text:
+                self._text[column][row] = str(value or "").upper() if column == "sector" else str(value or "")
+        self._numeric["updated_at"][row] = time.time()
+        self._indexes.pop("updated_at", None)
+
+    def column(self, name: str) -> np.ndarray:
+        if name in self._numeric:
+            return self._numeric[name][:self.size]
+        return self._text[name][:self.size]
+
+    def sorted_index(self, column: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        index = self._indexes.get(column)
+        if index is None:
+            values = self.column(column)
+            # NaN 排在最后，不参与范围查询
+            order = np.argsort(values, kind="stable")
+            index = (order, values[order], int(np.count_nonzero(~np.isnan(values))))
+            self._indexes[column] = index
+            self.index_builds += 1
+        return index
+
+    def range_mask(self, column: str, op: str, value: float) -> np.ndarray:
+        """在排序索引上二分查找满足比较条件的行，返回布尔掩码；NaN 不满足任何条件"""
+        order, values, valid = self.sorted_index(column)
+        if op == "<":
+            lo, hi = 0, np.searchsorted(values[:valid], value, "left")
+        elif op == "<=":
+            lo, hi = 0, np.searchsorted(values[:valid], value, "right")
+        elif op == ">":
+            lo, hi = np.searchsorted(values[:valid], value, "right"), valid
+        elif op == ">=":
+            lo, hi = np.searchsorted(values[:valid], value, "left"), valid
+        else:  # ==
+            lo, hi = np.searchsorted(values[:valid], value, "left"), np.searchsorted(values[:valid], value, "right")
+        mask = np.zeros(self.size, dtype=bool)
+        mask[order[lo:hi]] = True
+        return mask
+
+    def row(self, index: int, fields: List[str]) -> Dict[str, Any]:
+        record = {}
+        for field in fields:
+            value = self.column(field)[index]
+            if field in self._numeric:
+                value = None if np.isnan(value) else round(float(value), 4)
+            record[field] = value
+        return record
+
+
+# ---------- 筛选表达式 ----------
+
+_FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "==", "!=": "!="}
+_OPS = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=", ast.Eq: "==", ast.NotEq: "!=", ast.In: "in", ast.NotIn: "not in"}
+
+Mask = Callable[[ColumnarTable], np.ndarray]
+
+
+def _constant(node: ast.AST) -> Any:
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _constant(node.operand)
+        if isinstance(value, (int, float)):
+            return -value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_constant(item) for item in node.elts]
+    raise ScreenExpressionError(f"不支持的取值: {ast.unparse(node)}")
+
+
+def _predicate(column: str, op: str, value: Any) -> Mask:
+    if column in TEXT_COLUMNS:
+        values = value if isinstance(value, list) else [value]
+        if not all(isinstance(item, str) for item in values):
+            raise ScreenExpressionError(f"{column} 只能与字符串比较")
+        if column == "sector":
+            values = [item.upper() for item in values]
+        if op in ("==", "in"):
+            return lambda table: np.isin(table.column(column), values)
+        if op in ("!=", "not in"):
+            return lambda table: ~np.isin(table.column(column), values)
+        raise ScreenExpressionError(f"{column} 不支持 {op}")
+
+    if op in ("in", "not in"):
+        raise ScreenExpressionError(f"数值列 {column} 不支持 {op}")
+    if not isinstance(value, (int, float)):
+        raise ScreenExpressionError(f"{column} 只能与数字比较")
+    value = float(value)
+    if op == "!=":
+        return lambda table: ~table.range_mask(column, "==", value) & ~np.isnan(table.column(column))
+    return lambda table: table.range_mask(column, op, value)
+
+
+def _compile(node: ast.AST) -> Mask:
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda table: np.logical_and.reduce([part(table) for part in parts])
+        return lambda table: np.logical_or.reduce([part(table) for part in parts])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        inner = _compile(node.operand)
+        return lambda table: ~inner(table)
+    if isinstance(node, ast.Compare):
+        # 支持链式比较：10 < pe < 20
+        parts = []
+        left = node.left
+        for op_node, right in zip(node.ops, node.comparators):
+            op = _OPS.get(type(op_node))
+            if op is None:
+                raise ScreenExpressionError(f"不支持的运算符: {type(op_node).__name__}")
+            if isinstance(left, ast.Name):
+                column, value = left.id, _constant(right)
+            elif isinstance(right, ast.Name) and op in _FLIPPED:
+                column, value, op = right.id, _constant(left), _FLIPPED[op]
+            else:
+                raise ScreenExpressionError(f"比较的一侧必须是字段名: {ast.unparse(node)}")
+            if column not in NUMERIC_COLUMNS and column not in TEXT_COLUMNS:
+                raise ScreenExpressionError(f"未知字段: {column}")
+            parts.append(_predicate(column, op, value))
+            left = right
+        if len(parts) == 1:
+            return parts[0]
+        return lambda table: np.logical_and.reduce([part(table) for part in parts])
+    raise ScreenExpressionError(f"不支持的表达式: {ast.unparse(node)}")
+
+
+@lru_cache(maxsize=256)
+def compile_filter(expression: str) -> Tuple[Mask, Tuple[str, ...]]:
+    """把筛选表达式编译为掩码函数（按表达式字符串缓存），同时返回表达式引用的字段"""
+    source = normalize_expression(expression)
+    if not source:
+        return (lambda table: np.ones(table.size, dtype=bool)), ()
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise ScreenExpressionError(f"表达式语法错误: {e.msg}") from None
+    fields = tuple(dict.fromkeys(node.id for node in ast.walk(tree) if isinstance(node, ast.Name)))
+    return _compile(tree.body), fields
+
+
+class Screener:
+    """维护全市场列式表：报价、基本面与指标随应用中的数据流增量写入，后台定期刷新观察池"""
+
+    def __init__(self, table: Optional[ColumnarTable] = None, universe: Optional[List[str]] = None, interval: float = SCREENER_REFRESH_SECONDS):
+        self.table = table or ColumnarTable()
+        self.universe = universe or SCREENER_UNIVERSE
+        self.interval = interval
+        self.refreshes = 0
+        self.refreshed_at: Optional[float] = None
+        self.screens = 0
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- 写入 ----------
+
+    def update_quote(self, quote: Dict[str, Any]):
+        if not quote or "error" in quote or not quote.get("symbol"):
+            return
+        self.table.upsert(quote["symbol"], {column: quote[column] for column in QUOTE_COLUMNS if column in quote})
+
+    def update_overview(self, overview: Dict[str, Any]):
+        """接受 OVERVIEW 原始数据或 parse_overview 的输出"""
+        if not overview or "error" in overview:
+            return
+        symbol = overview.get("Symbol") or overview.get("symbol")
+        if not symbol:
+            return
+        mapping = OVERVIEW_COLUMNS if "Symbol" in overview else PARSED_OVERVIEW_COLUMNS
+        self.table.upsert(symbol, {column: overview.get(field) for field, column in mapping.items() if field in overview})
+
+    def update_indicators(self, symbol: str, indicators: Dict[str, Any]):
+        """写入基于历史 K 线计算的指标；仅凭单次报价估算的指标不写入"""
+        if not indicators or indicators.get("source", "history") != "history":
+            return
+        self.table.upsert(symbol, {column: indicators[field] for field, column in INDICATOR_COLUMNS.items() if field in indicators})
+
+    async def refresh(self, symbols: Optional[List[str]] = None):
+        """刷新观察池：基本面与报价经共享缓存拉取，指标由本地 K 线整批计算"""
+        symbols = symbols or self.universe
+        with priority_scope(PRIORITY_BACKGROUND):
+            overviews, quotes = await asyncio.gather(
+                asyncio.gather(*(fundamentals.query_fundamental(symbol, "OVERVIEW") for symbol in symbols)),
+                market_data.get_stock_quotes(symbols),
+            )
+        for overview in overviews:
+            self.update_overview(overview)
+        for quote in quotes:
+            self.update_quote(quote)
+        bars_list = [history_store.load(symbol, "daily") for symbol in symbols]
+        latest_list = batch_latest_indicators([bars if len(bars["close"]) >= 50 else None for bars in bars_list])
+        for symbol, latest in zip(symbols, latest_list):
+            if latest:
+                self.update_indicators(symbol, latest)
+        self.refreshes += 1
+        self.refreshed_at = time.time()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"刷新选股数据失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # ---------- 查询 ----------
+
+    def screen(
+        self,
+        expression: str = "",
+        sort: Optional[str] = None,
+        descending: bool = False,
+        limit: int = 50,
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """按表达式筛选并排序，表达式不合法时抛出 ScreenExpressionError"""
+        started = time.perf_counter()
+        predicate, referenced = compile_filter(expression or "")
+        if sort is not None and sort not in NUMERIC_COLUMNS:
+            raise ScreenExpressionError(f"只能按数值字段排序: {sort}")
+        unknown = [field for field in fields or [] if field not in NUMERIC_COLUMNS and field not in TEXT_COLUMNS]
+        if unknown:
+            raise ScreenExpressionError(f"未知字段: {', '.join(unknown)}")
+
+        table = self.table
+        matches = np.flatnonzero(predicate(table)) if table.size else np.empty(0, dtype=np.int64)
+        if sort is not None and len(matches):
+            values = table.column(sort)[matches]
+            # NaN 总是排在最后
+            keys = np.where(np.isnan(values), np.inf, -values if descending else values)
+            matches = matches[np.argsort(keys, kind="stable")]
+        limit = max(0, min(limit, SCREEN_MAX_LIMIT))
+        columns = list(dict.fromkeys([*DEFAULT_FIELDS, *referenced, *([sort] if sort else []), *(fields or [])]))
+        results = [table.row(int(i), columns) for i in matches[:limit]]
+        self.screens += 1
+        return {
+            "filter": expression,
+            "total": table.size,
+            "count": int(len(matches)),
+            "results": results,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "symbols": self.table.size,
+            "universe": len(self.universe),
+            "refreshes": self.refreshes,
+            "refreshed_at": self.refreshed_at,
+            "screens": self.screens,
+            "index_builds": self.table.index_builds,
+            "compiled_filters": compile_filter.cache_info().currsize,
+        }
+
+
+# 进程内共享的选股表
+screener = Screener()
@@ -0,0 +1,81 @@
+"""
+流式响应
+以 NDJSON 或 Server-Sent Events 逐条推送结果。生成器只有在客户端读走上一条后才会继续，
+在途任务数固定，首条结果的延迟与内存占用都不随股票数量增长
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, TypeVar
+
+from fastapi.responses import StreamingResponse
+
+T = TypeVar("T")
+
+_EXHAUSTED = object()
+
+STREAM_FORMATS = ("ndjson", "sse")
+
+_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+async def bounded_map(
+    func: Callable[[T], Awaitable[Dict[str, Any]]],
+    items: Iterable[T],
+    limit: int,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    并发执行 func(item)，按完成顺序产出结果，同时在途的任务不超过 limit。
+    只有在消费者取走结果后才补充新任务，慢客户端会自然地让上游拉取放缓；
+    生成器被关闭（如客户端断开）时取消所有未完成的任务。
+    """
+    iterator = iter(items)
+    pending = set()
+    try:
+        while True:
+            while len(pending) < limit:
+                item = next(iterator, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    break
+                pending.add(asyncio.ensure_future(func(item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def encode_record(record: Dict[str, Any], fmt: str) -> str:
+    """按流格式编码一条记录；SSE 以 type 字段作为事件名"""
+    payload = json.dumps(record, ensure_ascii=False, default=str)
+    if fmt == "sse":
+        return f"event: {record.get('type', 'message')}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def stream_response(records: AsyncIterator[Dict[str, Any]], fmt: str) -> StreamingResponse:
+    """把记录生成器包装为流式响应"""
+
+    async def body():
+        async for record in records:
+            yield encode_record(record, fmt)
+
+    return StreamingResponse(
+        body(),
+        media_type=_MEDIA_TYPES[fmt],
+        # 禁止反向代理缓冲，保证每条结果及时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def invalid_stream_format(fmt: Optional[str]) -> Optional[Dict[str, Any]]:
+    """stream 参数不合法时返回错误结构"""
+    if fmt is None or fmt in STREAM_FORMATS:
+        return None
+    return {"error": f"不支持的流格式: {fmt}，可选 {', '.join(STREAM_FORMATS)}", "status": "error"}
@@ -0,0 +1,574 @@
+"""
+增量（流式）技术指标
+每个指标一个带 __slots__ 的紧凑状态对象，保存滚动和、EMA 当前值与 Wilder 均值，
+每来一根 K 线或一次报价只做 O(1) 计算，不重算整段历史。
+状态可从历史 K 线一次性向量化初始化，也可 snapshot() / restore_state() 持久化与恢复。
+计算口径与 indicators.py 完全一致。
+"""
+
+import math
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+import indicators
+
+NAN = float("nan")
+
+# 滚动平方和在长时间运行后会累积浮点误差，每更新这么多个窗口长度就从缓冲区重新求和一次
+_RESYNC_WINDOWS = 64
+
+_STATE_TYPES: Dict[str, type] = {}
+
+
+def _register(cls):
+    _STATE_TYPES[cls.__name__] = cls
+    return cls
+
+
+class IndicatorState:
+    """状态对象基类：按 __slots__ 生成快照，嵌套状态递归处理"""
+
+    __slots__ = ()
+
+    def _all_slots(self):
+        for klass in type(self).__mro__:
+            yield from getattr(klass, "__slots__", ())
+
+    def snapshot(self) -> Dict[str, Any]:
+        fields = {}
+        for name in self._all_slots():
+            value = getattr(self, name)
+            if isinstance(value, IndicatorState):
+                value = value.snapshot()
+            elif isinstance(value, list):
+                value = list(value)
+            elif isinstance(value, dict):
+                value = {k: v.snapshot() for k, v in value.items()}
+            fields[name] = value
+        return {"type": type(self).__name__, "fields": fields}
+
+
+def restore_state(snapshot: Dict[str, Any]) -> IndicatorState:
+    """从 snapshot() 的结果恢复状态对象"""
+    state = _STATE_TYPES[snapshot["type"]].__new__(_STATE_TYPES[snapshot["type"]])
+    for name, value in snapshot["fields"].items():
+        if isinstance(value, dict) and "type" in value and "fields" in value:
+            value = restore_state(value)
+        elif isinstance(value, dict):
+            value = {k: restore_state(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            value = list(value)
+        setattr(state, name, value)
+    return state
+
+
+@_register
+class RollingWindow(IndicatorState):
+    """固定长度环形缓冲区，维护滚动和与平方和"""
+
+    __slots__ = ("window", "values", "pos", "count", "total", "total_sq", "updates")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.updates = 0
+
+    @classmethod
+    def from_series(cls, x: np.ndarray, window: int) -> "RollingWindow":
+        state = cls(window)
+        tail = np.asarray(x[-window:], dtype=np.float64)
+        state.count = len(tail)
+        state.values[:state.count] = tail.tolist()
+        state.pos = state.count % window
+        state._resync()
+        return state
+
+    def _resync(self):
+        live = self.values[:self.count]
+        self.total = math.fsum(live)
+        self.total_sq = math.fsum(v * v for v in live)
+        self.updates = 0
+
+    def _oldest(self) -> float:
+        return self.values[self.pos] if self.count == self.window else 0.0
+
+    def update(self, x: float):
+        oldest = self._oldest()
+        self.values[self.pos] = x
+        self.pos = (self.pos + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.total += x - oldest
+        self.total_sq += x * x - oldest * oldest
+        self.updates += 1
+        if self.updates >= self.window * _RESYNC_WINDOWS:
+            self._resync()
+
+    def mean(self) -> float:
+        return self.total / self.window if self.count == self.window else NAN
+
+    def std(self) -> float:
+        if self.count < self.window:
+            return NAN
+        mean = self.total / self.window
+        return math.sqrt(max(self.total_sq / self.window - mean * mean, 0.0))
+
+    def preview(self, x: float) -> Tuple[float, float]:
+        """假设追加 x 后的 (均值, 标准差)，不修改状态"""
+        if self.count + 1 < self.window:
+            return NAN, NAN
+        oldest = self._oldest()
+        mean = (self.total + x - oldest) / self.window
+        var = (self.total_sq + x * x - oldest * oldest) / self.window - mean * mean
+        return mean, math.sqrt(max(var, 0.0))
+
+
+@_register
+class SmoothedAverage(IndicatorState):
+    """以前 window 个值的均值为起点的指数平滑（EMA: alpha=2/(n+1)，Wilder: alpha=1/n）"""
+
+    __slots__ = ("window", "alpha", "value", "count", "seed_sum")
+
+    def __init__(self, window: int, alpha: float):
+        self.window = window
+        self.alpha = alpha
+        self.value = NAN
+        self.count = 0
+        self.seed_sum = 0.0
+
+    @classmethod
+    def ema(cls, span: int) -> "SmoothedAverage":
+        return cls(span, 2.0 / (span + 1))
+
+    @classmethod
+    def wilder(cls, period: int) -> "SmoothedAverage":
+        return cls(period, 1.0 / period)
+
+    @classmethod
+    def from_series(cls, x: np.ndarray, window: int, alpha: float, start: int = 0) -> "SmoothedAverage":
+        """用向量化结果初始化：x[start:] 为已经喂入的值"""
+        state = cls(window, alpha)
+        seen = max(len(x) - start, 0)
+        state.count = min(seen, window)
+        if seen >= window:
+            state.value = float(indicators._seeded_ewm(np.asarray(x, dtype=np.float64), window, alpha, start)[-1])
+        else:
+            state.seed_sum = float(np.sum(x[start:]))
+        return state
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.window
+
+    def update(self, x: float) -> float:
+        if self.count < self.window:
+            self.seed_sum += x
+            self.count += 1
+            if self.count == self.window:
+                self.value = self.seed_sum / self.window
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def preview(self, x: float) -> float:
+        if self.count < self.window - 1:
+            return NAN
+        if self.count == self.window - 1:
+            return (self.seed_sum + x) / self.window
+        return self.value + self.alpha * (x - self.value)
+
+
+@_register
+class RSIState(IndicatorState):
+    __slots__ = ("prev_close", "gain", "loss")
+
+    def __init__(self, period: int = 14):
+        self.prev_close = NAN
+        self.gain = SmoothedAverage.wilder(period)
+        self.loss = SmoothedAverage.wilder(period)
+
+    @classmethod
+    def from_series(cls, close: np.ndarray, period: int = 14) -> "RSIState":
+        state = cls(period)
+        if len(close):
+            delta = np.diff(close)
+            state.prev_close = float(close[-1])
+            state.gain = SmoothedAverage.from_series(np.maximum(delta, 0.0), period, 1.0 / period)
+            state.loss = SmoothedAverage.from_series(np.maximum(-delta, 0.0), period, 1.0 / period)
+        return state
+
+    @staticmethod
+    def _rsi(gain: float, loss: float) -> float:
+        if math.isnan(gain):
+            return NAN
+        if loss == 0.0:
+            return 50.0 if gain == 0.0 else 100.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+    def update(self, close: float) -> float:
+        if math.isnan(self.prev_close):
+            self.prev_close = close
+            return NAN
+        delta = close - self.prev_close
+        self.prev_close = close
+        return self._rsi(self.gain.update(max(delta, 0.0)), self.loss.update(max(-delta, 0.0)))
+
+    def preview(self, close: float) -> float:
+        if math.isnan(self.prev_close):
+            return NAN
+        delta = close - self.prev_close
+        return self._rsi(self.gain.preview(max(delta, 0.0)), self.loss.preview(max(-delta, 0.0)))
+
+
+@_register
+class MACDState(IndicatorState):
+    __slots__ = ("fast", "slow", "signal")
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = SmoothedAverage.ema(fast)
+        self.slow = SmoothedAverage.ema(slow)
+        self.signal = SmoothedAverage.ema(signal)
+
+    @classmethod
+    def from_series(cls, close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> "MACDState":
+        state = cls(fast, slow, signal)
+        state.fast = SmoothedAverage.from_series(close, fast, 2.0 / (fast + 1))
+        state.slow = SmoothedAverage.from_series(close, slow, 2.0 / (slow + 1))
+        line = indicators.ema(close, fast) - indicators.ema(close, slow)
+        state.signal = SmoothedAverage.from_series(line, signal, 2.0 / (signal + 1), start=slow - 1)
+        return state
+
+    @staticmethod
+    def _result(line: float, signal: float) -> Tuple[float, float, float]:
+        return line, signal, line - signal
+
+    def update(self, close: float) -> Tuple[float, float, float]:
+        fast, slow = self.fast.update(close), self.slow.update(close)
+        if not self.slow.ready:
+            return NAN, NAN, NAN
+        line = fast - slow
+        return self._result(line, self.signal.update(line))
+
+    def preview(self, close: float) -> Tuple[float, float, float]:
+        line = self.fast.preview(close) - self.slow.preview(close)
+        if math.isnan(line):
+            return NAN, NAN, NAN
+        return self._result(line, self.signal.preview(line))
+
+
+@_register
+class ATRState(IndicatorState):
+    __slots__ = ("prev_close", "average")
+
+    def __init__(self, period: int = 14):
+        self.prev_close = NAN
+        self.average = SmoothedAverage.wilder(period)
+
+    @classmethod
+    def from_series(cls, high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> "ATRState":
+        state = cls(period)
+        if len(close):
+            state.prev_close = float(close[-1])
+            tr = indicators.true_range(high, low, close)
+            state.average = SmoothedAverage.from_series(tr, period, 1.0 / period, start=1)
+        return state
+
+    def _true_range(self, high: float, low: float) -> float:
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def update(self, high: float, low: float, close: float) -> float:
+        # 与向量化口径一致：第一根 K 线没有前收盘价，不计入均值
+        if math.isnan(self.prev_close):
+            self.prev_close = close
+            return NAN
+        value = self.average.update(self._true_range(high, low))
+        self.prev_close = close
+        return value if self.average.ready else NAN
+
+    def preview(self, high: float, low: float, close: float) -> float:
+        if math.isnan(self.prev_close):
+            return NAN
+        return self.average.preview(self._true_range(high, low))
+
+
+@_register
+class OBVState(IndicatorState):
+    __slots__ = ("prev_close", "value")
+
+    def __init__(self):
+        self.prev_close = NAN
+        self.value = 0.0
+
+    @classmethod
+    def from_series(cls, close: np.ndarray, volume: np.ndarray) -> "OBVState":
+        state = cls()
+        if len(close):
+            state.prev_close = float(close[-1])
+            state.value = float(indicators.obv(close, volume)[-1])
+        return state
+
+    def _step(self, close: float, volume: float) -> float:
+        if math.isnan(self.prev_close) or close == self.prev_close:
+            return 0.0
+        return volume if close > self.prev_close else -volume
+
+    def update(self, close: float, volume: float) -> float:
+        self.value += self._step(close, volume)
+        self.prev_close = close
+        return self.value
+
+    def preview(self, close: float, volume: float) -> float:
+        return self.value + self._step(close, volume)
+
+
+@_register
+class VWAPState(IndicatorState):
+    """滚动窗口 VWAP（典型价加权）"""
+
+    __slots__ = ("price_volume", "volume")
+
+    def __init__(self, window: int = 20):
+        self.price_volume = RollingWindow(window)
+        self.volume = RollingWindow(window)
+
+    @classmethod
+    def from_series(cls, high, low, close, volume, window: int = 20) -> "VWAPState":
+        state = cls(window)
+        typical = (np.asarray(high) + np.asarray(low) + np.asarray(close)) / 3.0
+        state.price_volume = RollingWindow.from_series(typical * volume, window)
+        state.volume = RollingWindow.from_series(np.asarray(volume, dtype=np.float64), window)
+        return state
+
+    @staticmethod
+    def _ratio(pv: float, vol: float) -> float:
+        return pv / vol if vol > 0 else NAN
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        self.price_volume.update((high + low + close) / 3.0 * volume)
+        self.volume.update(volume)
+        return self._ratio(self.price_volume.mean(), self.volume.mean())
+
+    def preview(self, high: float, low: float, close: float, volume: float) -> float:
+        pv, _ = self.price_volume.preview((high + low + close) / 3.0 * volume)
+        vol, _ = self.volume.preview(volume)
+        return self._ratio(pv, vol)
+
+
+@_register
+class SymbolIndicators(IndicatorState):
+    """
+    单只股票的全部增量指标，输出字段与 indicators.compute_indicators 的最新值一致。
+    last_timestamp 为最后一根已计入的 K 线时间戳，last_bar 为它的 [high, low, close, volume]，
+    用于发现这根 K 线随后被修订（如尚未收盘的日 K 线）。
+    """
+
+    __slots__ = ("sma", "ema", "rsi", "macd", "bollinger", "num_std", "atr", "obv", "vwap", "last_timestamp", "last_bar")
+
+    def __init__(self, ma_windows: Tuple[int, ...] = (20, 50), rsi_period: int = 14, vwap_window: int = 20):
+        self.sma = {str(w): RollingWindow(w) for w in ma_windows}
+        self.ema = {str(w): SmoothedAverage.ema(w) for w in ma_windows}
+        self.rsi = RSIState(rsi_period)
+        self.macd = MACDState()
+        self.bollinger = RollingWindow(20)
+        self.num_std = 2.0
+        self.atr = ATRState()
+        self.obv = OBVState()
+        self.vwap = VWAPState(vwap_window)
+        self.last_timestamp = None
+        self.last_bar = None
+
+    @classmethod
+    def from_bars(
+        cls,
+        bars: Dict[str, np.ndarray],
+        ma_windows: Tuple[int, ...] = (20, 50),
+        rsi_period: int = 14,
+        vwap_window: int = 20,
+    ) -> "SymbolIndicators":
+        """用整段历史向量化初始化状态，之后只需增量更新"""
+        high, low, close, volume = (indicators.as_float_array(bars[c]) for c in ("high", "low", "close", "volume"))
+        state = cls(ma_windows, rsi_period, vwap_window)
+        state.sma = {str(w): RollingWindow.from_series(close, w) for w in ma_windows}
+        state.ema = {str(w): SmoothedAverage.from_series(close, w, 2.0 / (w + 1)) for w in ma_windows}
+        state.rsi = RSIState.from_series(close, rsi_period)
+        state.macd = MACDState.from_series(close)
+        state.bollinger = RollingWindow.from_series(close, 20)
+        state.atr = ATRState.from_series(high, low, close)
+        state.obv = OBVState.from_series(close, volume)
+        state.vwap = VWAPState.from_series(high, low, close, volume, vwap_window)
+        if "timestamp" in bars and len(bars["timestamp"]):
+            state.last_timestamp = int(bars["timestamp"][-1])
+            state.last_bar = [float(high[-1]), float(low[-1]), float(close[-1]), float(volume[-1])]
+        return state
+
+    def matches_last_bar(self, high: float, low: float, close: float, volume: float) -> bool:
+        """本地数据中 last_timestamp 那根 K 线是否仍与计入时相同（NaN 视为相等）"""
+        last_bar = getattr(self, "last_bar", None)
+        if last_bar is None:
+            return False
+        return all(a == b or (a != a and b != b) for a, b in zip(last_bar, (high, low, close, volume)))
+
+    def _values(self, sma, ema, rsi, macd, bollinger, atr, obv, vwap) -> Dict[str, float]:
+        mean, std = bollinger
+        values = {f"sma_{w}": v for w, v in sma.items()}
+        values.update({f"ema_{w}": v for w, v in ema.items()})
+        values["rsi"] = rsi
+        values["macd"], values["macd_signal"], values["macd_histogram"] = macd
+        values["bollinger_upper"] = mean + self.num_std * std
+        values["bollinger_middle"] = mean
+        values["bollinger_lower"] = mean - self.num_std * std
+        values["atr"] = atr
+        values["obv"] = obv
+        values["vwap"] = vwap
+        return values
+
+    def update(self, high: float, low: float, close: float, volume: float, timestamp: Optional[int] = None) -> Dict[str, float]:
+        """计入一根已完成的 K 线并返回最新指标"""
+        for window in self.sma.values():
+            window.update(close)
+        self.bollinger.update(close)
+        values = self._values(
+            {w: s.mean() for w, s in self.sma.items()},
+            {w: e.update(close) for w, e in self.ema.items()},
+            self.rsi.update(close),
+            self.macd.update(close),
+            (self.bollinger.mean(), self.bollinger.std()),
+            self.atr.update(high, low, close),
+            self.obv.update(close, volume),
+            self.vwap.update(high, low, close, volume),
+        )
+        if timestamp is not None:
+            self.last_timestamp = timestamp
+        self.last_bar = [high, low, close, volume]
+        return values
+
+    def preview(self, high: float, low: float, close: float, volume: float) -> Dict[str, float]:
+        """把一根未完成的 K 线（如盘中报价）当作最新一根计算指标，不修改状态"""
+        return self._values(
+            {w: s.preview(close)[0] for w, s in self.sma.items()},
+            {w: e.preview(close) for w, e in self.ema.items()},
+            self.rsi.preview(close),
+            self.macd.preview(close),
+            self.bollinger.preview(close),
+            self.atr.preview(high, low, close),
+            self.obv.preview(close, volume),
+            self.vwap.preview(high, low, close, volume),
+        )
+
+
+class LiveIndicatorBook:
+    """
+    进程内按股票保存的增量指标。
+    evaluate() 只把比状态更新的 K 线逐根计入，历史不连续时才从整段历史重新初始化。
+    最后一根已计入的 K 线被修订时，回滚到计入它之前的快照再重新计入；没有快照时从整段历史重建。
+    """
+
+    def __init__(self):
+        self._states: Dict[str, SymbolIndicators] = {}
+        # 每只股票计入最后一根 K 线之前的状态快照：(该 K 线时间戳, 快照)
+        self._previous: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.rollbacks = 0
+        self.rebuilds = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, symbol: str) -> Optional[SymbolIndicators]:
+        return self._states.get(symbol.upper())
+
+    def evaluate(
+        self,
+        symbol: str,
+        bars: Dict[str, np.ndarray],
+        live_bar: Optional[Dict[str, float]] = None,
+        live_timestamp: Optional[int] = None,
+    ) -> Dict[str, float]:
+        """
+        计入 bars 中尚未计入的已完成 K 线；给出 live_bar 时再以它作为未完成的最新一根预览指标。
+        时间戳不早于 live_timestamp 的 K 线视为未完成，不写入状态。
+        """
+        symbol = symbol.upper()
+        stamps = bars["timestamp"]
+        end = len(stamps) if live_timestamp is None else int(np.searchsorted(stamps, live_timestamp, side="left"))
+
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None or state.last_timestamp is None:
+                start = None
+            else:
+                start = int(np.searchsorted(stamps[:end], state.last_timestamp, side="right"))
+                # 状态时间戳不在本地数据中（数据被重建）时无法续算
+                if start == 0 or stamps[start - 1] != state.last_timestamp:
+                    start = None
+                else:
+                    last = start - 1
+                    revised = (float(bars[c][last]) for c in ("high", "low", "close", "volume"))
+                    if not state.matches_last_bar(*revised):
+                        previous = self._previous.get(symbol)
+                        if previous is not None and previous[0] == state.last_timestamp:
+                            # 回滚到计入旧版本之前的状态，重新计入修订后的 K 线
+                            state = restore_state(previous[1])
+                            self._states[symbol] = state
+                            start = last
+                            self.rollbacks += 1
+                        else:
+                            start = None
+            if start is None:
+                if state is not None:
+                    self.rebuilds += 1
+                state = SymbolIndicators.from_bars({column: values[:end] for column, values in bars.items()})
+                self._states[symbol] = state
+                self._previous.pop(symbol, None)
+                start = end
+
+            latest = None
+            for i in range(start, end):
+                if i == end - 1:
+                    self._previous[symbol] = (int(stamps[i]), state.snapshot())
+                latest = state.update(
+                    float(bars["high"][i]), float(bars["low"][i]), float(bars["close"][i]),
+                    float(bars["volume"][i]), int(stamps[i]),
+                )
+
+            if live_bar is not None:
+                return state.preview(live_bar["high"], live_bar["low"], live_bar["close"], live_bar["volume"])
+            if latest is None:
+                # 没有新 K 线：重新预览会改变状态语义，这里直接从最后一根已计入的值恢复
+                latest = _current_values(state)
+            return latest
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {symbol: state.snapshot() for symbol, state in self._states.items()}
+
+    def restore(self, snapshot: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            self._states = {symbol: restore_state(data) for symbol, data in snapshot.items()}
+            self._previous = {}
+
+
+def _current_values(state: SymbolIndicators) -> Dict[str, float]:
+    """读取状态中最后一根已计入 K 线对应的指标值"""
+    macd_line = state.macd.fast.value - state.macd.slow.value
+    signal = state.macd.signal.value if state.macd.signal.ready else NAN
+    gain, loss = state.rsi.gain, state.rsi.loss
+    return state._values(
+        {w: s.mean() for w, s in state.sma.items()},
+        {w: e.value for w, e in state.ema.items()},
+        RSIState._rsi(gain.value, loss.value),
+        (macd_line, signal, macd_line - signal),
+        (state.bollinger.mean(), state.bollinger.std()),
+        state.atr.average.value,
+        state.obv.value,
+        VWAPState._ratio(state.vwap.price_volume.mean(), state.vwap.volume.mean()),
+    )
+
+
+# 进程内共享的增量指标
+live_indicators = LiveIndicatorBook()
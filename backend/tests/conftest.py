@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接以扁平模块方式导入后端代码（与容器内 PYTHONPATH=/app 一致）
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,46 @@
+"""测试用的假对象"""
+
+import asyncio
+from typing import Dict
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """确定性的假模型：回复最后一条消息的内容，按关键字模拟延迟或报错"""
+
+    delays: Dict[str, float] = {}
+    failures: Dict[str, str] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = messages[-1].content
+        for keyword, error in self.failures.items():
+            if keyword in text:
+                raise RuntimeError(error)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"结论: {text}"))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = messages[-1].content
+        await asyncio.sleep(max((d for k, d in self.delays.items() if k in text), default=0))
+        return self._generate(messages, stop, **kwargs)
+
+
+class FakeStreamingChatModel(FakeChatModel):
+    """支持流式输出的假模型：把回复按字符逐段产出，每段间隔 chunk_delay 秒"""
+
+    chunk_delay: float = 0.01
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._generate(messages, stop, **kwargs).generations[0].message.content
+        for char in text:
+            await asyncio.sleep(self.chunk_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=char))
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from agents.orchestrator import run_stock_analysis
+from agents.registry import AgentRegistry, ToolCatalog
+from fakes import FakeChatModel
+
+
+@pytest.fixture
+def tool_fetches():
+    return []
+
+
+@pytest.fixture
+def registry(tool_fetches):
+    def fetch():
+        tool_fetches.append(1)
+        return [{"name": "get_company_overview"}]
+
+    return AgentRegistry(model=FakeChatModel(), tool_catalog=ToolCatalog(fetch=fetch), branch_timeout=5)
+
+
+def test_agents_are_built_once_and_reused(registry, tool_fetches):
+    graph = registry.get("analysis")
+    assert registry.get("analysis") is graph
+    assert registry.get("fundamental") is registry.get("fundamental")
+
+    # 工具列表只在首次构建时同步拉取一次
+    assert len(tool_fetches) == 1
+    stats = registry.stats()["agents"]
+    assert stats["analysis"]["cold_build_ms"] > 0
+    assert stats["analysis"]["warm_hits"] == 1
+    assert stats["fundamental"]["warm_hits"] == 2
+    assert stats["fundamental"]["warm_avg_us"] < stats["fundamental"]["cold_build_ms"] * 1000
+
+
+def test_tool_catalog_keeps_last_good_list():
+    responses = [[{"name": "a"}], []]
+    catalog = ToolCatalog(fetch=lambda: responses.pop(0))
+
+    catalog.refresh()
+    catalog.refresh()
+
+    assert catalog.get() == [{"name": "a"}]
+    assert catalog.refreshes == 2
+
+
+def _bound_tools(agent):
+    return sorted(agent.nodes["tools"].bound.tools_by_name)
+
+
+def test_agents_rebuilt_when_tool_list_changes():
+    responses = [
+        [{"name": "get_company_overview"}],
+        [{"name": "get_company_overview"}],
+        [{"name": "get_company_overview"}, {"name": "get_stock_financials"}],
+    ]
+    catalog = ToolCatalog(fetch=lambda: responses.pop(0))
+    registry = AgentRegistry(model=FakeChatModel(), tool_catalog=catalog)
+
+    fundamental = registry.get("fundamental")
+    analysis = registry.get("analysis")
+    assert _bound_tools(fundamental) == ["get_companies_snapshot_tool", "get_company_overview_tool"]
+
+    # 内容未变的刷新不触发重建
+    catalog.refresh()
+    assert registry.get("fundamental") is fundamental
+    assert registry.get("analysis") is analysis
+
+    catalog.refresh()
+    rebuilt = registry.get("fundamental")
+    assert rebuilt is not fundamental
+    assert "get_stock_financials_tool" in _bound_tools(rebuilt)
+    assert registry.get("analysis") is not analysis
+    # 基本面代理与分析图一起丢弃，只计一次重建
+    assert registry.stats()["tools"]["agent_rebuilds"] == 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_reports_reuse_compiled_graph(registry):
+    graph = registry.get("analysis")
+
+    first = await run_stock_analysis("AAPL", graph)
+    second = await run_stock_analysis("MSFT", registry.get("analysis"))
+
+    assert first["report"] and second["report"]
+    assert registry.stats()["agents"]["analysis"]["warm_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cold_build_does_not_block_event_loop(monkeypatch):
+    fetched_on_loop = []
+
+    def fetch():
+        try:
+            asyncio.get_running_loop()
+            fetched_on_loop.append(True)
+        except RuntimeError:
+            fetched_on_loop.append(False)
+        return [{"name": "get_company_overview"}]
+
+    registry = AgentRegistry(model=FakeChatModel(), tool_catalog=ToolCatalog(fetch=fetch), branch_timeout=5)
+    monkeypatch.setattr("agents.registry.agent_registry", registry)
+
+    first = await run_stock_analysis("AAPL")
+    second = await run_stock_analysis("MSFT")
+
+    assert first["report"] and second["report"]
+    # 冷构建在线程中拉取工具列表，之后直接复用已编译的分析图
+    assert fetched_on_loop == [False]
+    assert registry.stats()["agents"]["analysis"]["warm_hits"] == 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import analysis
+import indicators
+
+
+def test_score_batch_thresholds_and_risk_buckets():
+    quotes = [{"price": p, "change_percent": str(c)} for p, c in ((100, 4.0), (100, -4.0), (100, 0.5), (50, 2.0), (10, -1.5))]
+    overviews = [{"beta": v} for v in ("2.0", "1.2", "0.8", "None", "-")]
+    scores = analysis.score_batch(quotes, overviews, [None] * 5)
+
+    assert scores["action"] == ["考虑减仓", "考虑加仓", "持有观望", "持有观望", "持有观望"]
+    assert scores["confidence"] == [0.8, 0.7, 0.6, 0.6, 0.6]
+    assert scores["short_term"] == ["上涨趋势", "下跌趋势", "横盘整理", "上涨趋势", "下跌趋势"]
+    assert scores["risk_level"] == ["高", "中高", "中低", "中低", "中等"]
+    assert scores["beta"] == [2.0, 1.2, 0.8, 1.0, 1.0]
+    assert scores["target_price"][3] == 55.0
+    assert scores["stop_loss"][3] == 47.5
+
+
+def test_score_batch_insights():
+    quotes = [
+        {"symbol": "A", "price": 100, "change_percent": "3.5", "volume": 2_000_000},
+        {"symbol": "B", "price": 100, "change_percent": "-2.5", "volume": 10},
+        {"error": "rate limited"},
+    ]
+    overviews = [{"sector": "Technology", "pe_ratio": "12.5"}, {"sector": "Energy", "pe_ratio": "20"}, {"error": "x"}]
+    technical = [{"rsi": 75.0}, {"rsi": None}, {"rsi": 20.0}]
+    insights = analysis.score_batch(quotes, overviews, technical)["insights"]
+
+    assert insights[0] == [
+        "股价大幅上涨，成交量活跃，市场情绪积极",
+        "成交量放大，表明市场关注度较高",
+        "RSI 指标显示超买，短期可能存在回调风险",
+        "Technology 行业估值偏低，具有投资价值",
+    ]
+    # RSI 缺失按 50 处理；P/E 处于中间区间时没有估值洞察
+    assert insights[1] == ["股价出现回调，建议关注支撑位", "成交量相对较低，市场参与度一般", "RSI 指标处于正常区间，技术面相对健康"]
+    # 报价与基本面失败时只剩技术面洞察
+    assert insights[2] == ["RSI 指标显示超卖，可能存在反弹机会"]
+
+
+def test_batch_latest_indicators_groups_by_length():
+    rng = np.random.default_rng(3)
+
+    def bars(n):
+        close = 100 + np.cumsum(rng.normal(size=n))
+        return {"high": close + 1, "low": close - 1, "close": close, "volume": np.full(n, 1000.0)}
+
+    bars_list = [bars(120), None, bars(80), bars(120)]
+    results = analysis.batch_latest_indicators(bars_list)
+
+    assert results[1] is None
+    for i in (0, 2, 3):
+        expected = indicators.latest_values(indicators.compute_indicators(bars_list[i]))
+        assert results[i]["rsi"] == pytest.approx(float(expected["rsi"]))
+        assert results[i]["sma_50"] == pytest.approx(float(expected["sma_50"]))
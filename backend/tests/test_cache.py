@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(clock=clock)
+    cache.set("AAPL", 1, ttl=10)
+
+    clock.now = 9.9
+    assert cache.get("AAPL") == 1
+    clock.now = 10.0
+    assert cache.get("AAPL") is None
+    assert cache.expirations == 1
+
+
+def test_lru_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_are_coalesced():
+    cache = TTLCache()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"symbol": "AAPL"}
+
+    results = await asyncio.gather(*(cache.get_or_load("AAPL", loader, ttl=60) for _ in range(100)))
+
+    assert calls == 1
+    assert all(r == {"symbol": "AAPL"} for r in results)
+    assert cache.coalesced == 99
+
+
+@pytest.mark.asyncio
+async def test_failed_loads_are_not_cached():
+    cache = TTLCache()
+
+    async def failing():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("AAPL", failing, ttl=60)
+
+    async def throttled():
+        return {"Note": "rate limited"}
+
+    await cache.get_or_load("AAPL", throttled, ttl=60, cacheable=lambda v: "Note" not in v)
+    assert len(cache) == 0
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from agents.compaction import (
+    compact_analysis_results,
+    compact_number,
+    compact_tool_result,
+    compaction_stats,
+    count_tokens,
+)
+
+OVERVIEW = {
+    "Symbol": "AAPL",
+    "Name": "Apple Inc",
+    "Description": "Apple Inc. is an American multinational technology company ... " * 40,
+    "Sector": "TECHNOLOGY",
+    "MarketCapitalization": "3400000000000",
+    "PERatio": "34.12",
+    "ProfitMargin": "0.2397",
+    "ReturnOnEquityTTM": "1.6",
+    "DividendYield": "None",
+    "Address": "ONE APPLE PARK WAY, CUPERTINO, CA, US",
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    compaction_stats.reset()
+
+
+def test_compact_number():
+    assert compact_number("3400000000000") == "3.4T"
+    assert compact_number("152345678") == "152.3M"
+    assert compact_number(12345.67) == "12.35K"
+    assert compact_number(250000) == "250K"
+    assert compact_number(9999) == 9999
+    assert compact_number(650123.45, suffix=False) == 650123.45
+    assert compact_number("0.239712") == 0.2397
+    assert compact_number("42") == 42
+    assert compact_number("None") is None
+    assert compact_number("TECHNOLOGY") == "TECHNOLOGY"
+
+
+def test_overview_is_projected_to_needed_fields():
+    text = compact_tool_result("fundamental", "get_company_overview", OVERVIEW)
+
+    payload = json.loads(text)
+    assert payload == {
+        "Symbol": "AAPL",
+        "Name": "Apple Inc",
+        "Sector": "TECHNOLOGY",
+        "MarketCapitalization": "3.4T",
+        "ProfitMargin": 0.2397,
+        "ReturnOnEquityTTM": 1.6,
+    }
+    stats = compaction_stats.stats()["agents"]["fundamental"]
+    assert stats["tokens_after"] < stats["tokens_before"] / 5
+
+
+def test_k_data_drops_oldest_rows_to_fit_budget():
+    bars = [
+        {"time": f"2024-01-{i % 28 + 1:02d}", "open": 100.123 + i, "high": 101.5, "low": 99.25, "close": 100.75, "volume": 12345678}
+        for i in range(300)
+    ]
+    text = compact_tool_result("technical", "get_stock_k_data", {"symbol": "AAPL", "interval": "daily", "bars": bars}, budget=200)
+
+    payload = json.loads(text)
+    assert count_tokens(text) <= 200
+    assert payload["columns"][0] == "time"
+    assert payload["rows"][-1] == ["2024-01-20", 399.12, 101.5, 99.25, 100.75, "12.35M"]
+
+
+def test_k_data_prices_stay_exact():
+    bars = [{"time": "2024-01-02", "open": 650123.45, "high": 651000.0, "low": 649876.5, "close": 650500.25, "volume": 250000}]
+    payload = json.loads(compact_tool_result("technical", "get_stock_k_data", {"symbol": "BRK.A", "interval": "daily", "bars": bars}))
+    assert payload["rows"] == [["2024-01-02", 650123.45, 651000, 649876.5, 650500.25, "250K"]]
+
+
+def test_errors_are_passed_through_within_budget():
+    text = compact_tool_result("valuation", "get_stock_valuation", {"error": "x" * 10000}, budget=50)
+
+    assert text.endswith("…[截断]")
+    assert count_tokens(text) <= 60
+    assert compaction_stats.stats()["agents"]["valuation"]["truncated"] == 1
+
+
+def test_analysis_results_share_summary_budget():
+    results = {
+        "symbol": "AAPL",
+        "fundamental": "基本面很好。\n\n\n" + "营收增长稳健。" * 500,
+        "technical": "短期趋势向上。",
+        "missing": {"valuation": "超时（60 秒）"},
+    }
+
+    text = compact_analysis_results(results, budget=300)
+
+    assert text.startswith("股票: AAPL\n## fundamental\n基本面很好。\n营收增长稳健。")
+    assert "## technical\n短期趋势向上。" in text
+    assert '## missing\n{"valuation":"超时（60 秒）"}' in text
+    assert count_tokens(text) < 400
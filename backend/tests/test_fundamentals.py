@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+import fundamentals
+import market_data
+import mcp_tools
+from agents.compaction import compact_tool_result
+from fundamentals import FundamentalsStore, compute_ratios, get_financials, ingest_fundamentals, parse_statements
+
+
+def _payloads(quarters):
+    """quarters 按时间升序：(日期, 收入, 净利润, 总资产, 股东权益)"""
+    income = [{"fiscalDateEnding": d, "totalRevenue": str(r), "grossProfit": str(r * 0.4), "costOfRevenue": str(r * 0.6),
+               "operatingIncome": str(r * 0.3), "netIncome": str(n)} for d, r, n, _, _ in quarters]
+    balance = [{"fiscalDateEnding": d, "totalAssets": str(a), "totalShareholderEquity": str(e), "totalLiabilities": str(a - e),
+                "totalCurrentAssets": "None", "totalCurrentLiabilities": "0"} for d, _, _, a, e in quarters]
+    cash = [{"fiscalDateEnding": d, "operatingCashflow": str(n * 1.2), "capitalExpenditures": str(r * 0.05)}
+            for d, r, n, _, _ in quarters]
+    return {
+        "INCOME_STATEMENT": {"quarterlyReports": income[::-1]},
+        "BALANCE_SHEET": {"quarterlyReports": balance[::-1]},
+        "CASH_FLOW": {"quarterlyReports": cash[::-1]},
+    }
+
+
+QUARTERS = [
+    ("2023-03-31", 100, 10, 1000, 400),
+    ("2023-06-30", 110, 12, 1000, 400),
+    ("2023-09-30", 120, 15, 1100, 420),
+    ("2023-12-31", 130, 18, 1200, 440),
+    ("2024-03-31", 150, -5, 1200, 440),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FundamentalsStore(root=str(tmp_path))
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", None)
+
+
+def test_statements_are_aligned_ascending_with_missing_as_nan():
+    payloads = _payloads(QUARTERS)
+    # 现金流量表缺少最新一期
+    payloads["CASH_FLOW"]["quarterlyReports"] = payloads["CASH_FLOW"]["quarterlyReports"][1:]
+    table = parse_statements(payloads)
+    assert table["fiscal_date"][0] == np.datetime64("2023-03-31")
+    assert table["totalRevenue"].tolist() == [100, 110, 120, 130, 150]
+    assert np.isnan(table["operatingCashflow"][-1])
+    assert np.isnan(table["totalCurrentAssets"]).all()
+
+
+def test_ratios_use_ttm_flows_and_average_balances():
+    ratios = compute_ratios(parse_statements(_payloads(QUARTERS)))
+    # 前三期不足四个季度，TTM 比率为 NaN
+    assert np.isnan(ratios["roe"][:3]).all()
+    ttm_income = 10 + 12 + 15 + 18
+    assert ratios["roe"][3] == pytest.approx(ttm_income / 430)
+    assert ratios["roa"][3] == pytest.approx(ttm_income / 1150)
+    assert ratios["net_margin"][4] == pytest.approx((12 + 15 + 18 - 5) / (110 + 120 + 130 + 150))
+    # 同比：2024Q1 对 2023Q1，亏损时增长率为负
+    assert ratios["revenue_growth_yoy"][4] == pytest.approx(0.5)
+    assert ratios["net_income_growth_yoy"][4] == pytest.approx(-1.5)
+    # 分母为 0 或缺失时为 NaN
+    assert np.isnan(ratios["current_ratio"]).all()
+
+
+def test_dupont_product_equals_roe():
+    ratios = compute_ratios(parse_statements(_payloads(QUARTERS)))
+    product = ratios["net_margin"] * ratios["asset_turnover"] * ratios["equity_multiplier"]
+    np.testing.assert_allclose(product[3:], ratios["roe"][3:])
+
+
+def test_annual_ratios_compare_with_previous_year():
+    payloads = {function: {"annualReports": payload["quarterlyReports"]} for function, payload in _payloads(QUARTERS).items()}
+    ratios = compute_ratios(parse_statements(payloads, "annual"), "annual")
+    assert ratios["net_margin"][0] == pytest.approx(0.1)
+    assert ratios["revenue_growth_yoy"][1] == pytest.approx(0.1)
+
+
+@pytest.mark.asyncio
+async def test_ingest_from_fixtures_offline_and_skip_when_fresh(store, offline):
+    result = await ingest_fundamentals("aapl", store=store)
+    assert result["fetched"] and result["source"] == "fixture"
+    assert result["periods"]["quarterly"] == 8
+    again = await ingest_fundamentals("AAPL", store=store)
+    assert again["fetched"] is False
+
+
+@pytest.mark.asyncio
+async def test_missing_fixture_reports_error(store, offline):
+    result = await get_financials("ZZZZ", store=store)
+    assert "error" in result
+
+
+@pytest.mark.asyncio
+async def test_financials_newest_first_and_limited(store, offline):
+    result = await get_financials("MSFT", "quarterly", limit=3, store=store)
+    assert result["fiscal_dates"] == ["2024-09-30", "2024-06-30", "2024-03-31"]
+    assert len(result["ratios"]["roe"]) == 3
+    assert set(result["dupont"]) == {"net_margin", "asset_turnover", "equity_multiplier", "roe"}
+    assert result["ratios"]["gross_margin"][0] == pytest.approx(0.69, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_upstream_statements_are_fetched_once_each(store, monkeypatch):
+    calls = []
+
+    async def fake_query(function, symbol, **params):
+        calls.append(function)
+        return fundamentals.load_fixture("AAPL", function)
+
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", "demo")
+    monkeypatch.setattr(market_data, "query_alpha_vantage", fake_query)
+    result = await get_financials("AAPL", store=store)
+    assert sorted(calls) == ["BALANCE_SHEET", "CASH_FLOW", "INCOME_STATEMENT"]
+    assert "stale" not in result
+
+
+@pytest.mark.asyncio
+async def test_stale_local_data_served_when_upstream_throttled(store, monkeypatch, offline):
+    await ingest_fundamentals("AAPL", store=store)
+
+    async def throttled(function, symbol, **params):
+        return {"Note": "rate limit"}
+
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", "demo")
+    monkeypatch.setattr(market_data, "query_alpha_vantage", throttled)
+    monkeypatch.setattr(fundamentals, "FUNDAMENTALS_REFRESH_SECONDS", 0)
+    result = await get_financials("AAPL", store=store)
+    assert result["stale"] is True
+    assert result["fiscal_dates"]
+
+
+@pytest.mark.asyncio
+async def test_tool_result_compacts_for_agent(tmp_path, monkeypatch, offline):
+    monkeypatch.setattr(fundamentals, "fundamentals_store", FundamentalsStore(root=str(tmp_path)))
+    result = await mcp_tools.registry.call("get_stock_financials", {"symbol": "AAPL", "period": "annual"})
+    text = compact_tool_result("fundamental", "get_stock_financials", result, budget=10_000)
+    assert '"period":"annual"' in text
+    assert '"totalRevenue":["391B"' in text
+    assert "dupont" in text
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import indicators
+
+
+@pytest.fixture
+def close():
+    rng = np.random.default_rng(42)
+    return 100.0 + np.cumsum(rng.normal(size=3000))
+
+
+def _loop_ema(x, span):
+    alpha = 2.0 / (span + 1)
+    out = np.full(len(x), np.nan)
+    out[span - 1] = x[:span].mean()
+    for i in range(span, len(x)):
+        out[i] = (1 - alpha) * out[i - 1] + alpha * x[i]
+    return out
+
+
+def _loop_rsi(close, period):
+    delta = np.diff(close)
+    gains, losses = np.maximum(delta, 0), np.maximum(-delta, 0)
+    avg_gain, avg_loss = gains[:period].mean(), losses[:period].mean()
+    out = np.full(len(close), np.nan)
+    out[period] = 100 - 100 / (1 + avg_gain / avg_loss)
+    for i in range(period, len(delta)):
+        avg_gain = (avg_gain * (period - 1) + gains[i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[i]) / period
+        out[i + 1] = 100 - 100 / (1 + avg_gain / avg_loss)
+    return out
+
+
+@pytest.mark.parametrize("span", [3, 26, 200])
+def test_ema_matches_recursive_definition(close, span):
+    np.testing.assert_allclose(indicators.ema(close, span), _loop_ema(close, span), rtol=1e-10, equal_nan=True)
+
+
+def test_rsi_matches_wilder_definition(close):
+    np.testing.assert_allclose(indicators.rsi(close, 14), _loop_rsi(close, 14), rtol=1e-10, equal_nan=True)
+
+
+def test_sma_and_bollinger_match_rolling_window(close):
+    windows = np.lib.stride_tricks.sliding_window_view(close, 20)
+    upper, middle, lower = indicators.bollinger(close, 20, 2.0)
+
+    assert np.isnan(middle[:19]).all()
+    np.testing.assert_allclose(indicators.sma(close, 20)[19:], windows.mean(axis=1), rtol=1e-10)
+    np.testing.assert_allclose((upper - lower)[19:] / 4, windows.std(axis=1), rtol=1e-6)
+
+
+def test_obv_and_vwap():
+    close = np.array([10.0, 11.0, 10.5, 10.5, 12.0])
+    volume = np.array([100.0, 200.0, 300.0, 400.0, 500.0])
+
+    assert indicators.obv(close, volume).tolist() == [0.0, 200.0, -100.0, -100.0, 400.0]
+    vwap = indicators.vwap(close, close, close, volume)
+    assert vwap[-1] == pytest.approx(np.sum(close * volume) / np.sum(volume))
+
+
+def test_batch_matches_per_symbol(close):
+    matrix = np.stack([close, close * 1.5, close[::-1].copy()])
+    bars = {"open": matrix, "high": matrix + 1, "low": matrix - 1, "close": matrix, "volume": np.ones_like(matrix)}
+
+    batch = indicators.latest_values(indicators.compute_indicators(bars))
+    for i in range(len(matrix)):
+        single = indicators.latest_values(indicators.compute_indicators({k: v[i] for k, v in bars.items()}))
+        for name, value in single.items():
+            assert batch[name][i] == pytest.approx(value, rel=1e-9)
+
+
+def test_short_history_is_nan():
+    result = indicators.compute_indicators({c: np.arange(10.0) + 1 for c in ("open", "high", "low", "close", "volume")})
+
+    assert np.isnan(result["sma_20"]).all()
+    assert np.isnan(result["rsi"]).all()
+    assert np.isnan(result["macd_signal"]).all()
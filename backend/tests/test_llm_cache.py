@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+
+import agents.fundamental_agent
+from agents.llm_cache import MARKET_TZ, SQLiteLLMCache, is_deterministic, next_session_boundary
+from agents.orchestrator import create_analysis_graph, run_stock_analysis
+from fakes import FakeChatModel
+
+
+# 实际发往模型的调用；不放在模型字段里，以免改变缓存键
+calls = []
+
+
+class CountingChatModel(FakeChatModel):
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        calls.append(messages[-1].content)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def _ts(*args) -> float:
+    return datetime(*args, tzinfo=MARKET_TZ).timestamp()
+
+
+@pytest.fixture(autouse=True)
+def reset_calls(monkeypatch):
+    monkeypatch.setattr(agents.fundamental_agent, "get_mcp_tools", lambda: [])
+    calls.clear()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLiteLLMCache(path=str(tmp_path / "llm_cache.sqlite3"), max_entries=100)
+
+
+def test_entries_expire_at_next_session_boundary():
+    # 周三盘中 -> 当天收盘；周三盘后 -> 周四开盘；周五盘后 -> 下周一开盘
+    assert next_session_boundary(_ts(2024, 5, 15, 11, 0)) == _ts(2024, 5, 15, 16, 0)
+    assert next_session_boundary(_ts(2024, 5, 15, 17, 0)) == _ts(2024, 5, 16, 9, 30)
+    assert next_session_boundary(_ts(2024, 5, 17, 20, 0)) == _ts(2024, 5, 20, 9, 30)
+
+
+def test_only_zero_temperature_calls_are_cacheable():
+    assert is_deterministic('{"kwargs": {"model_name": "gpt-4o", "temperature": 0.0}}')
+    assert not is_deterministic('{"kwargs": {"model_name": "gpt-4o", "temperature": 0.7}}')
+
+
+def test_repeat_calls_are_served_from_cache(cache):
+    model = CountingChatModel(cache=cache)
+
+    first = model.invoke("分析 AAPL")
+    second = model.invoke("分析   AAPL ")
+
+    assert second.content == first.content == "结论: 分析 AAPL"
+    assert calls == ["分析 AAPL"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["tokens_saved"] > 0
+
+
+def test_expired_and_overflowing_entries_are_evicted(tmp_path):
+    now = [1000.0]
+    cache = SQLiteLLMCache(
+        path=str(tmp_path / "llm_cache.sqlite3"),
+        max_entries=2,
+        expires_at=lambda t: t + 60,
+        clock=lambda: now[0],
+    )
+    model = CountingChatModel(cache=cache)
+
+    for prompt in ("a", "b", "c"):
+        now[0] += 1
+        model.invoke(prompt)
+    assert cache.size() == 2
+
+    now[0] += 1
+    model.invoke("a")  # 最久未访问的 a 已被淘汰
+    assert calls == ["a", "b", "c", "a"]
+
+    now[0] += 120
+    model.invoke("a")  # 已过期
+    assert calls[-1] == "a" and len(calls) == 5
+
+
+@pytest.mark.asyncio
+async def test_repeat_report_for_same_symbol_hits_cache(cache):
+    model = CountingChatModel(cache=cache)
+    graph = create_analysis_graph(model, branch_timeout=5)
+
+    first = await run_stock_analysis("AAPL", graph)
+    sent = len(calls)
+    second = await run_stock_analysis("AAPL", graph)
+
+    assert second["report"] == first["report"]
+    assert len(calls) == sent
+    assert cache.stats()["hits"] == sent
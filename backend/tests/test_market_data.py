@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import market_data
+from cache import TTLCache
+from rate_limiter import UpstreamScheduler
+
+
+def _quote_payload(symbol):
+    return {
+        "Global Quote": {
+            "01. symbol": symbol,
+            "05. price": "100.0",
+            "09. change": "1.0",
+            "10. change percent": "1.0%",
+            "06. volume": "1000",
+            "03. high": "101.0",
+            "04. low": "99.0",
+            "02. open": "99.5",
+            "08. previous close": "99.0",
+        }
+    }
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    state = {"in_flight": 0, "peak": 0, "calls": 0}
+
+    async def handler(request):
+        state["calls"] += 1
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.05)
+        state["in_flight"] -= 1
+        return httpx.Response(200, json=_quote_payload(request.url.params["symbol"]))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(market_data, "_client", client)
+    monkeypatch.setattr(market_data, "market_cache", TTLCache())
+    monkeypatch.setattr(market_data, "upstream_scheduler", UpstreamScheduler(calls_per_minute=60000, calls_per_day=10000))
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", "test")
+    yield state
+
+
+@pytest.mark.asyncio
+async def test_get_stock_quotes_fans_out_concurrently(mock_upstream):
+    symbols = [f"SYM{i}" for i in range(50)]
+
+    started = time.perf_counter()
+    quotes = await market_data.get_stock_quotes(symbols, max_concurrency=50)
+    elapsed = time.perf_counter() - started
+
+    assert [q["symbol"] for q in quotes] == symbols
+    assert elapsed < 0.05 * 10
+    await market_data.close_http_client()
+
+
+@pytest.mark.asyncio
+async def test_get_stock_quotes_respects_concurrency_limit(mock_upstream):
+    await market_data.get_stock_quotes([f"SYM{i}" for i in range(20)], max_concurrency=4)
+
+    assert mock_upstream["calls"] == 20
+    assert mock_upstream["peak"] <= 4
+    await market_data.close_http_client()
+
+
+@pytest.mark.asyncio
+async def test_repeated_quotes_are_served_from_cache(mock_upstream):
+    await market_data.get_stock_quotes(["AAPL", "MSFT"])
+    await market_data.get_stock_quotes(["AAPL", "MSFT"])
+
+    assert mock_upstream["calls"] == 2
+    assert market_data.market_cache.hits == 2
+    await market_data.close_http_client()
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import mcp_tools
+from mcp_batch import ToolCall, execute_batch, tool_error
+from mcp_server import mcp_app
+from rate_limiter import RateLimitExceeded
+from tool_registry import ToolArgumentsError, ToolNotFound
+
+
+@pytest.mark.asyncio
+async def test_batch_dedupes_and_runs_concurrently():
+    executed = []
+
+    async def dispatch(tool_name, params):
+        executed.append((tool_name, params["symbol"]))
+        await asyncio.sleep(0.05)
+        if params["symbol"] == "BAD":
+            raise ValueError("unknown symbol")
+        return {"tool": tool_name, "symbol": params["symbol"]}
+
+    calls = [ToolCall(tool_name="get_stock_price", params={"symbol": s}) for s in ("AAPL", "MSFT", "AAPL", "BAD")] * 5
+
+    started = time.perf_counter()
+    response = await execute_batch(calls, dispatch)
+    elapsed = time.perf_counter() - started
+
+    assert response["unique"] == 3
+    assert len(executed) == 3
+    assert [r.get("symbol") for r in response["results"][:4]] == ["AAPL", "MSFT", "AAPL", None]
+    assert response["results"][3] == {"error": "unknown symbol", "error_type": "internal", "status": "error"}
+    assert len(response["results"]) == 20
+    assert elapsed < 0.15
+
+
+def test_call_batch_endpoint():
+    client = TestClient(mcp_app)
+
+    response = client.post("/call_batch", json={"calls": [
+        {"tool_name": "analyze_market", "params": {"timeframe": "1w"}},
+        {"tool_name": "missing_tool"},
+    ]})
+
+    results = response.json()["results"]
+    assert json.loads(results[0])["timeframe"] == "1w"
+    assert results[1] == {"error": "未知工具: missing_tool", "error_type": "not_found", "status": "error"}
+
+
+@pytest.mark.parametrize("error, error_type", [
+    (ToolNotFound("未知工具: x"), "not_found"),
+    (ToolArgumentsError("symbol: Field required"), "invalid_arguments"),
+    (RateLimitExceeded("配额不足"), "rate_limited"),
+    (httpx.ConnectError("connection refused"), "upstream"),
+    (KeyError("price"), "internal"),
+])
+def test_tool_errors_share_one_shape(error, error_type):
+    result = tool_error("get_stock_price", error)
+    assert result["error_type"] == error_type
+    assert result["status"] == "error"
+    assert result["error"]
+
+
+def test_execution_errors_are_structured_in_single_and_batch_calls(monkeypatch):
+    async def throttled(symbol: str):
+        raise RateLimitExceeded("等待 Alpha Vantage 调用配额超时")
+
+    monkeypatch.setattr(mcp_tools.registry.get("get_stock_price"), "func", throttled)
+    client = TestClient(mcp_app)
+
+    single = client.post("/call/get_stock_price", json={"symbol": "AAPL"})
+    assert single.status_code == 200
+    assert single.json()["error_type"] == "rate_limited"
+    assert client.post("/call_tool", params={"tool_name": "get_stock_price"}, json={"symbol": "AAPL"}).json() == single.json()
+
+    batch = client.post("/call_batch", json={"calls": [
+        {"tool_name": "get_stock_price", "params": {"symbol": "AAPL"}},
+        {"tool_name": "get_stock_price", "params": {"ticker": "AAPL"}},
+    ]}).json()["results"]
+    assert [r["error_type"] for r in batch] == ["rate_limited", "invalid_arguments"]
@@ -0,0 +1,163 @@
+import json
+import sys
+
+import httpx
+import pytest
+
+import mcp_client
+from rate_limiter import RateLimitExceeded
+
+
+@pytest.fixture
+def mcp_server(monkeypatch):
+    """模拟 MCP Server：记录请求，可通过 state 配置失败次数与是否支持 /call_batch"""
+    state = {"requests": [], "fail_times": 0, "batch": True}
+
+    def handler(request):
+        state["requests"].append(request.url.path)
+        if state["fail_times"] > 0:
+            state["fail_times"] -= 1
+            return httpx.Response(503)
+        if request.url.path == "/call_batch":
+            if not state["batch"]:
+                return httpx.Response(404)
+            calls = json.loads(request.content)["calls"]
+            return httpx.Response(200, json={"results": [{"tool": c["tool_name"], **c["params"]} for c in calls]})
+        if request.url.path == "/call_tool":
+            return httpx.Response(200, json={"tool": request.url.params["tool_name"], **json.loads(request.content)})
+        return httpx.Response(200, json={"tools": [{"name": "get_stock_price"}]})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(mcp_client, "_async_client", httpx.AsyncClient(base_url="http://mcp", transport=transport))
+    monkeypatch.setattr(mcp_client, "_sync_client", httpx.Client(base_url="http://mcp", transport=transport))
+    monkeypatch.setattr(mcp_client, "MCP_RETRY_BASE_DELAY", 0)
+    yield state
+
+
+@pytest.mark.asyncio
+async def test_batch_is_one_round_trip(mcp_server):
+    calls = [
+        {"tool_name": tool, "params": {"symbol": symbol}}
+        for symbol in ("AAPL", "MSFT", "GOOGL", "AMZN", "TSLA")
+        for tool in ("get_company_overview", "get_stock_price", "get_stock_financials")
+    ]
+
+    results = await mcp_client.call_mcp_tools(calls)
+
+    assert mcp_server["requests"] == ["/call_batch"]
+    assert [(r["tool"], r["symbol"]) for r in results] == [(c["tool_name"], c["params"]["symbol"]) for c in calls]
+
+
+@pytest.mark.asyncio
+async def test_batch_falls_back_to_concurrent_single_calls(mcp_server):
+    mcp_server["batch"] = False
+
+    results = await mcp_client.call_mcp_tools([
+        {"tool_name": "get_stock_price", "params": {"symbol": "AAPL"}},
+        {"tool_name": "get_stock_price", "params": {"symbol": "MSFT"}},
+    ])
+
+    assert [r["symbol"] for r in results] == ["AAPL", "MSFT"]
+    assert mcp_server["requests"] == ["/call_batch", "/call_tool", "/call_tool"]
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_failures(mcp_server):
+    mcp_server["fail_times"] = 2
+
+    result = await mcp_client.acall_mcp_tool("get_stock_price", symbol="AAPL")
+
+    assert result == {"tool": "get_stock_price", "symbol": "AAPL"}
+    assert len(mcp_server["requests"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(mcp_server):
+    mcp_server["fail_times"] = 10
+
+    result = await mcp_client.acall_mcp_tool("get_stock_price", symbol="AAPL")
+
+    assert "503" in result["error"]
+    assert len(mcp_server["requests"]) == mcp_client.MCP_MAX_RETRIES + 1
+
+
+def test_sync_calls_share_pooled_client(mcp_server):
+    assert mcp_client.get_mcp_tools() == [{"name": "get_stock_price"}]
+    assert mcp_client.call_mcp_tool("get_stock_price", symbol="AAPL")["symbol"] == "AAPL"
+
+
+def test_retry_delay_has_jitter(monkeypatch):
+    monkeypatch.setattr(mcp_client, "MCP_RETRY_BASE_DELAY", 1.0)
+    delays = {mcp_client.retry_delay(2) for _ in range(20)}
+
+    assert len(delays) > 1
+    assert all(2.0 <= d <= 6.0 for d in delays)
+
+
+def _load_standalone_mcp_app(monkeypatch):
+    """按文件路径加载 mcp_server/main.py（backend/mcp_server.py 与 mcp_server 包同名，无法直接 import）"""
+    import importlib.util
+    import os
+
+    import mcp_tools
+
+    monkeypatch.setitem(sys.modules, "mcp_server.tools", mcp_tools)
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "mcp_server", "main.py")
+    spec = importlib.util.spec_from_file_location("mcp_server_main", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+@pytest.fixture(params=["backend", "standalone"])
+def real_mcp_server(request, monkeypatch):
+    """让 mcp_client 直连两个真实的 MCP 服务应用，上游行情由假实现代替"""
+    import mcp_tools
+    from mcp_server import mcp_app
+
+    async def fake_price(symbol: str):
+        if symbol == "FAIL":
+            raise RateLimitExceeded("配额不足")
+        return {"symbol": symbol, "price": 100.0}
+
+    monkeypatch.setattr(mcp_tools.registry.get("get_stock_price"), "func", fake_price)
+    app = mcp_app if request.param == "backend" else _load_standalone_mcp_app(monkeypatch)
+    monkeypatch.setattr(mcp_client, "_async_client", httpx.AsyncClient(base_url="http://mcp", transport=httpx.ASGITransport(app=app)))
+    monkeypatch.setattr(mcp_client, "MCP_TRANSPORT", "rest")
+    return app
+
+
+@pytest.mark.asyncio
+async def test_round_trip_returns_one_shape_from_both_servers(real_mcp_server):
+    single = await mcp_client.acall_mcp_tool("get_stock_price", symbol="AAPL")
+    batch = await mcp_client.call_mcp_tools([
+        {"tool_name": "get_stock_price", "params": {"symbol": "AAPL"}},
+        {"tool_name": "get_stock_price", "params": {"symbol": "FAIL"}},
+        {"tool_name": "missing_tool", "params": {}},
+    ])
+
+    assert single == batch[0] == {"symbol": "AAPL", "price": 100.0}
+    assert [r["error_type"] for r in batch[1:]] == ["rate_limited", "not_found"]
+    assert await mcp_client.acall_mcp_tool("get_stock_price", symbol="FAIL") == batch[1]
+
+
+@pytest.mark.asyncio
+async def test_protocol_transport_reaches_both_servers(real_mcp_server, monkeypatch):
+    from mcp.client.streamable_http import streamablehttp_client
+
+    app = real_mcp_server
+
+    def connect():
+        return streamablehttp_client(
+            "http://mcp" + mcp_client.MCP_PROTOCOL_PATH,
+            httpx_client_factory=lambda **kwargs: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), **kwargs),
+        )
+
+    session = mcp_client.MCPSession(connect=connect)
+    monkeypatch.setattr(mcp_client, "mcp_session", session)
+    monkeypatch.setattr(mcp_client, "MCP_TRANSPORT", "mcp")
+    async with app.router.lifespan_context(app):
+        try:
+            assert await mcp_client.acall_mcp_tool("get_stock_price", symbol="AAPL") == {"symbol": "AAPL", "price": 100.0}
+        finally:
+            await session.close()
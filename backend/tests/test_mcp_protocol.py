@@ -0,0 +1,142 @@
+import contextlib
+
+import anyio
+import pytest
+from mcp.shared.memory import create_client_server_memory_streams
+
+from mcp_client import MCPSession
+from mcp_protocol import create_mcp_server
+from tool_registry import ToolRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = ToolRegistry()
+
+    @registry.tool()
+    async def get_stock_price(symbol: str):
+        """获取股票实时价格"""
+        return {"symbol": symbol, "price": 101.5}
+
+    @registry.tool()
+    async def get_stock_info(symbol: str) -> str:
+        """获取股票信息"""
+        return f"{symbol} 信息"
+
+    return registry
+
+
+@pytest.fixture
+def connect(registry):
+    """在内存流上运行 MCP Server，返回 MCPSession 使用的连接工厂，并记录建立的连接数"""
+    server = create_mcp_server(registry)
+    connections = []
+
+    @contextlib.asynccontextmanager
+    async def open_streams():
+        connections.append(1)
+        async with create_client_server_memory_streams() as (client_streams, server_streams):
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(server.run, server_streams[0], server_streams[1], server.create_initialization_options())
+                yield client_streams
+                tg.cancel_scope.cancel()
+
+    open_streams.connections = connections
+    return open_streams
+
+
+@pytest.mark.asyncio
+async def test_one_session_serves_all_calls(connect):
+    session = MCPSession(connect=connect)
+    try:
+        results = [await session.call_tool("get_stock_price", {"symbol": s}) for s in ("AAPL", "MSFT")]
+        text = await session.call_tool("get_stock_info", {"symbol": "AAPL"})
+    finally:
+        await session.close()
+
+    assert results == [{"symbol": "AAPL", "price": 101.5}, {"symbol": "MSFT", "price": 101.5}]
+    assert text == "AAPL 信息"
+    assert len(connect.connections) == 1
+    assert session.sessions_opened == 1
+
+
+@pytest.mark.asyncio
+async def test_tool_errors_are_returned_as_error_dicts(connect):
+    session = MCPSession(connect=connect)
+    try:
+        missing = await session.call_tool("missing_tool", {})
+        invalid = await session.call_tool("get_stock_price", {"ticker": "AAPL"})
+    finally:
+        await session.close()
+
+    assert "missing_tool" in missing["error"]
+    assert "symbol" in invalid["error"]
+
+
+@pytest.mark.asyncio
+async def test_results_are_compact_json(registry, connect):
+    session = MCPSession(connect=connect)
+    try:
+        raw = await (await session.get()).call_tool("get_stock_price", {"symbol": "AAPL"})
+        tools = await (await session.get()).list_tools()
+    finally:
+        await session.close()
+
+    assert raw.content[0].text == '{"symbol":"AAPL","price":101.5}'
+    assert [tool.name for tool in tools.tools] == ["get_stock_price", "get_stock_info"]
+    assert tools.tools[0].inputSchema["required"] == ["symbol"]
+
+
+@pytest.mark.asyncio
+async def test_broken_transport_is_reopened_on_next_call(registry):
+    server = create_mcp_server(registry)
+    state = {"connections": 0, "broken": False}
+
+    class FlakyWriteStream:
+        """客户端写入流：broken 后发送失败，模拟断开的传输"""
+
+        def __init__(self, stream):
+            self._stream = stream
+
+        async def send(self, message):
+            if state["broken"]:
+                raise anyio.BrokenResourceError
+            await self._stream.send(message)
+
+        async def __aenter__(self):
+            await self._stream.__aenter__()
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return await self._stream.__aexit__(*exc_info)
+
+        def __getattr__(self, name):
+            return getattr(self._stream, name)
+
+    @contextlib.asynccontextmanager
+    async def connect():
+        state["connections"] += 1
+        async with create_client_server_memory_streams() as (client_streams, server_streams):
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(server.run, server_streams[0], server_streams[1], server.create_initialization_options())
+                yield client_streams[0], FlakyWriteStream(client_streams[1])
+                tg.cancel_scope.cancel()
+
+    session = MCPSession(connect=connect)
+    try:
+        assert (await session.call_tool("get_stock_price", {"symbol": "AAPL"}))["price"] == 101.5
+        state["broken"] = True
+        assert "error" in await session.call_tool("get_stock_price", {"symbol": "AAPL"})
+        state["broken"] = False
+        assert (await session.call_tool("get_stock_price", {"symbol": "MSFT"}))["symbol"] == "MSFT"
+    finally:
+        await session.close()
+
+    assert state["connections"] == 2
+    assert session.sessions_opened == 2
+    assert session.sessions_discarded == 1
+
+
+def test_session_can_be_created_without_running_loop():
+    session = MCPSession()
+    assert session._lock is None
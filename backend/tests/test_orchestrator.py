@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import agents.fundamental_agent
+from agents.llm_cache import SQLiteLLMCache
+from agents.orchestrator import create_analysis_graph, run_stock_analysis, stream_stock_analysis
+from fakes import FakeChatModel, FakeStreamingChatModel
+
+
+@pytest.fixture(autouse=True)
+def no_mcp_server(monkeypatch):
+    monkeypatch.setattr(agents.fundamental_agent, "get_mcp_tools", lambda: [])
+
+
+@pytest.mark.asyncio
+async def test_branches_run_in_parallel():
+    model = FakeChatModel(delays={"基本面": 0.2, "技术面": 0.2, "估值": 0.2})
+    graph = create_analysis_graph(model, branch_timeout=5)
+
+    started = time.perf_counter()
+    result = await run_stock_analysis("aapl", graph)
+    elapsed = time.perf_counter() - started
+
+    assert set(result["results"]) == {"fundamental", "technical", "valuation"}
+    assert result["results"]["technical"] == "结论: 请对股票 AAPL 进行技术面分析。"
+    assert result["report"].startswith("结论: 请根据以下分析结果撰写报告")
+    assert elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_timed_out_and_failed_branches_are_reported_as_missing():
+    model = FakeChatModel(delays={"技术面": 1.0}, failures={"估值": "upstream down"})
+    graph = create_analysis_graph(model, branch_timeout=0.1)
+
+    result = await run_stock_analysis("AAPL", graph)
+
+    assert set(result["results"]) == {"fundamental"}
+    assert "超时" in result["errors"]["technical"]
+    assert result["errors"]["valuation"] == "upstream down"
+    assert "missing" in result["report"]
+
+
+@pytest.mark.asyncio
+async def test_stream_emits_progress_then_report_tokens():
+    model = FakeStreamingChatModel(delays={"技术面": 0.05}, failures={"估值": "upstream down"}, chunk_delay=0.002)
+    graph = create_analysis_graph(model, branch_timeout=5)
+
+    started = time.perf_counter()
+    records = []
+    first_token_at = None
+    async for record in stream_stock_analysis("aapl", graph):
+        if record["type"] == "token" and first_token_at is None:
+            first_token_at = time.perf_counter() - started
+        records.append(record)
+    total = time.perf_counter() - started
+
+    types = [r["type"] for r in records]
+    assert types[0] == "start" and types[-1] == "done"
+    progress = {r["agent"]: r["status"] for r in records if r["type"] == "progress"}
+    assert progress == {"fundamental": "done", "technical": "done", "valuation": "error"}
+    # 所有进度事件都在报告 token 之前
+    assert types.index("token") > max(i for i, t in enumerate(types) if t == "progress")
+
+    tokens = "".join(r["text"] for r in records if r["type"] == "token")
+    done = records[-1]
+    assert tokens == done["report"]
+    assert done["report"].startswith("结论: 请根据以下分析结果撰写报告")
+    assert done["errors"] == {"valuation": "upstream down"}
+    assert first_token_at < total / 2
+
+
+@pytest.mark.asyncio
+async def test_streamed_report_is_written_to_llm_cache(tmp_path):
+    cache = SQLiteLLMCache(path=str(tmp_path / "llm_cache.sqlite3"))
+    graph = create_analysis_graph(FakeStreamingChatModel(cache=cache, chunk_delay=0), branch_timeout=5)
+
+    first = [r async for r in stream_stock_analysis("AAPL", graph)]
+    second = [r async for r in stream_stock_analysis("AAPL", graph)]
+
+    assert first[-1]["report"] == second[-1]["report"]
+    # 命中缓存时整份报告作为一段文本推送
+    assert len([r for r in second if r["type"] == "token"]) == 1
+    assert cache.stats()["hits"] >= 4
+
+
+@pytest.mark.asyncio
+async def test_closing_stream_cancels_analysis():
+    model = FakeStreamingChatModel(delays={"技术面": 10})
+    graph = create_analysis_graph(model, branch_timeout=30)
+
+    stream = stream_stock_analysis("AAPL", graph)
+    assert (await stream.__anext__())["type"] == "start"
+    started = time.perf_counter()
+    await stream.aclose()
+
+    assert time.perf_counter() - started < 1
@@ -0,0 +1,134 @@
+import asyncio
+
+import numpy as np
+import pytest
+import pytest_asyncio
+
+from persistence import PersistenceStore, async_database_url
+from price_history import PriceHistoryStore
+
+
+def _quote(symbol, price, volume=1000):
+    return {
+        "symbol": symbol,
+        "price": price,
+        "change": 1.0,
+        "change_percent": "0.5",
+        "volume": volume,
+        "high": price + 1,
+        "low": price - 1,
+        "open": price,
+        "previous_close": price - 1,
+        "latest_trading_day": "2024-01-02",
+    }
+
+
+def _bars(timestamps):
+    count = len(timestamps)
+    return {
+        "timestamp": np.asarray(timestamps, dtype=np.int64),
+        "open": np.arange(count, dtype=np.float64) + 100,
+        "high": np.arange(count, dtype=np.float64) + 101,
+        "low": np.arange(count, dtype=np.float64) + 99,
+        "close": np.arange(count, dtype=np.float64) + 100.5,
+        "volume": np.arange(count, dtype=np.float64) * 1000,
+    }
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    store = PersistenceStore(url=f"sqlite:///{tmp_path}/test.sqlite3", batch_size=50, flush_interval=0.01)
+    await store.start()
+    yield store
+    await store.close()
+
+
+def test_async_database_url():
+    assert async_database_url("postgresql://u:p@db:5432/x") == "postgresql+asyncpg://u:p@db:5432/x"
+    assert async_database_url("postgres://u:p@db/x") == "postgresql+asyncpg://u:p@db/x"
+    assert async_database_url("sqlite:////tmp/a.db") == "sqlite+aiosqlite:////tmp/a.db"
+    assert async_database_url(None).startswith("sqlite+aiosqlite:///")
+
+
+@pytest.mark.asyncio
+async def test_quotes_are_batched_and_unchanged_quotes_skipped(store):
+    store.record_quote(_quote("AAPL", 100))
+    store.record_quote(_quote("AAPL", 100))
+    store.record_quote(_quote("AAPL", 101))
+    store.record_quote(_quote("MSFT", 300))
+    store.record_quote({"error": "rate limited"})
+    await store.flush()
+
+    history = await store.quote_history("aapl")
+    assert [row["price"] for row in history] == [101, 100]
+    assert history[0]["change_percent"] == 0.5
+    assert store.stats()["skipped_unchanged_quotes"] == 1
+    assert len(await store.quote_history("MSFT")) == 1
+
+
+@pytest.mark.asyncio
+async def test_background_writer_flushes_without_explicit_flush(store):
+    store.record_quote(_quote("AAPL", 100))
+    for _ in range(100):
+        if store.written:
+            break
+        await asyncio.sleep(0.01)
+    assert store.written == 1
+    assert store.stats()["batches"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_analysis_snapshots_round_trip(store):
+    result = {
+        "symbol": "AAPL",
+        "analysis": {"recommendation": {"action": "买入", "confidence": np.float64(0.8)}},
+        "count": np.int64(3),
+    }
+    store.record_analysis(result, "stock")
+    store.record_analysis({**result, "count": 4}, "batch")
+    store.record_analysis({"error": "boom", "symbol": "AAPL"}, "stock")
+    await store.flush()
+
+    snapshots = await store.analysis_history("AAPL")
+    assert [s["kind"] for s in snapshots] == ["batch", "stock"]
+    assert snapshots[1]["action"] == "买入"
+    assert snapshots[1]["payload"]["count"] == 3
+    assert [s["kind"] for s in await store.analysis_history("AAPL", kind="stock")] == ["stock"]
+
+
+@pytest.mark.asyncio
+async def test_bars_from_history_store_listener_are_deduplicated(store, tmp_path):
+    history = PriceHistoryStore(root=str(tmp_path / "history"))
+    history.listeners.append(store.record_bars)
+    assert history.append("AAPL", "daily", _bars([1, 2, 3])) == 3
+    # 时间相同但数值不同的最后一根 K 线被覆盖
+    assert history.append("AAPL", "daily", _bars([2, 3, 4, 5])) == 3
+    # 重复写入同一批 K 线按主键覆盖，不产生重复行
+    store.record_bars("AAPL", "daily", _bars([4, 5]))
+    await store.flush()
+
+    rows = await store.bars("AAPL", "daily")
+    assert [row["ts"] for row in rows] == [1, 2, 3, 4, 5]
+    # 被修订的第 3 根以最新数值落库
+    assert [row["close"] for row in rows] == [100.5, 101.5, 101.5, 100.5, 101.5]
+    assert [row["ts"] for row in await store.bars("AAPL", "daily", start=2, end=4)] == [2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_records(tmp_path):
+    store = PersistenceStore(url=f"sqlite:///{tmp_path}/drop.sqlite3", queue_size=2)
+    await store.start()
+    try:
+        for price in range(5):
+            store.record_quote(_quote("AAPL", 100 + price))
+        assert store.stats()["dropped"] == 3
+    finally:
+        await store.close()
+    assert store.written == 2
+
+
+@pytest.mark.asyncio
+async def test_records_are_ignored_before_start(tmp_path):
+    store = PersistenceStore(url=f"sqlite:///{tmp_path}/idle.sqlite3")
+    store.record_quote(_quote("AAPL", 100))
+    assert store.stats()["enqueued"] == 0
@@ -0,0 +1,236 @@
+import numpy as np
+import pytest
+import pytest_asyncio
+
+import market_data
+import mcp_tools
+import portfolio as portfolio_engine
+from persistence import PersistenceStore
+from portfolio import Portfolio, PortfolioError, PortfolioManager, aligned_returns
+from price_history import PriceHistoryStore
+
+DAY = 86400
+
+
+def _bars(closes, start=1_700_000_000):
+    closes = np.asarray(closes, dtype=np.float64)
+    count = len(closes)
+    return {
+        "timestamp": start + np.arange(count, dtype=np.int64) * DAY,
+        "open": closes, "high": closes, "low": closes, "close": closes,
+        "volume": np.full(count, 1000.0),
+    }
+
+
+def _random_walk(rng, count, drift=0.0005, scale=0.02):
+    return 100 * np.cumprod(1 + rng.normal(drift, scale, count))
+
+
+@pytest.fixture
+def history(tmp_path):
+    rng = np.random.default_rng(5)
+    store = PriceHistoryStore(root=str(tmp_path / "history"))
+    market = _random_walk(rng, 300, scale=0.01)
+    store.append("SPY", "daily", _bars(market))
+    store.append("AAA", "daily", _bars(market * (1 + rng.normal(0, 0.01, 300))))
+    store.append("BBB", "daily", _bars(_random_walk(rng, 300)))
+    return store
+
+
+@pytest_asyncio.fixture
+async def manager(tmp_path, history):
+    store = PersistenceStore(url=f"sqlite:///{tmp_path}/portfolio.sqlite3")
+    yield PortfolioManager(store, history)
+    await store.close()
+
+
+def test_fifo_sells_realize_gains_net_of_fees():
+    book = Portfolio("t")
+    book.apply("aaa", 10, 100, fees=10, ts=1)
+    book.apply("AAA", 10, 120, ts=2)
+    book.apply("AAA", -15, 130, fees=5, ts=3)
+    # 先卖出第一批 10 股（每股成本 101），再卖出第二批 5 股（成本 120）
+    assert book.realized[0] == pytest.approx(15 * 130 - 5 - (10 * 101 + 5 * 120))
+    assert book.quantity[0] == 5
+    assert book.cost[0] == pytest.approx(600)
+    status = book.status()
+    assert status["positions"][0]["lots"] == 1
+    assert status["positions"][0]["average_cost"] == 120
+    assert status["realized_gain"] == pytest.approx(335)
+
+
+@pytest.mark.parametrize("args", [
+    ("AAA", -1, 100),
+    ("AAA", 0, 100),
+    ("AAA", 1, 0),
+    ("AAA", 1, 100, -1),
+])
+def test_invalid_transactions_rejected(args):
+    book = Portfolio("t")
+    with pytest.raises(PortfolioError):
+        book.apply(*args)
+
+
+def test_backdated_transaction_rejected():
+    book = Portfolio("t")
+    book.apply("AAA", 1, 100, ts=10)
+    with pytest.raises(PortfolioError):
+        book.apply("AAA", 1, 100, ts=5)
+
+
+def test_marks_weights_and_daily_change():
+    book = Portfolio("t")
+    book.apply("AAA", 10, 100, ts=1)
+    book.apply("BBB", 5, 200, ts=2)
+    book.on_quote("AAA", 110, previous_close=105)
+    status = book.status()
+    assert status["total_value"] == 2100
+    assert status["total_gain"] == 100
+    assert [p["symbol"] for p in status["positions"]] == ["AAA", "BBB"]
+    assert [p["weight"] for p in status["positions"]] == pytest.approx([1100 / 21, 1000 / 21], abs=0.01)
+    assert status["positions"][0]["price_source"] == "quote"
+    assert status["positions"][1]["price_source"] == "last_trade"
+    # 只有拿到昨收的股票计入当日涨跌
+    assert status["daily_change"] == 50
+
+
+def test_metrics_match_direct_computation(history):
+    book = Portfolio("t")
+    book.apply("AAA", 30, 100, ts=1)
+    book.apply("BBB", 20, 100, ts=2)
+    book.build_risk(history)
+    metrics = book.status()["performance_metrics"]
+
+    returns = aligned_returns([history.load(s, "daily") for s in ("AAA", "BBB", "SPY")])
+    portfolio_returns = returns[:, :2] @ np.array([0.6, 0.4])
+    assert metrics["observation_days"] == len(returns) == portfolio_engine.PORTFOLIO_LOOKBACK_DAYS
+    assert metrics["volatility"] == pytest.approx(portfolio_returns.std(ddof=1) * np.sqrt(252) * 100, abs=0.01)
+    beta = np.cov(portfolio_returns, returns[:, 2])[0, 1] / returns[:, 2].var(ddof=1)
+    assert metrics["beta"] == pytest.approx(beta, abs=0.01)
+    assert metrics["var"] == pytest.approx(-np.quantile(portfolio_returns, 0.05) * 100, abs=0.01)
+    assert metrics["cvar"] >= metrics["var"]
+    wealth = np.cumprod(1 + portfolio_returns)
+    assert metrics["max_drawdown"] == pytest.approx((wealth / np.maximum.accumulate(wealth) - 1).min() * 100, abs=0.01)
+    assert metrics["history_coverage"] == 100
+
+
+def test_ticks_update_metrics_incrementally(history):
+    book = Portfolio("t")
+    book.apply("AAA", 30, 100, ts=1)
+    book.apply("BBB", 20, 100, ts=2)
+    book.build_risk(history)
+    risk = book.risk
+    for price in (101, 97.5, 120):
+        book.on_quote("AAA", price)
+    book.on_quote("BBB", 80)
+    assert book.risk is risk and book.risk_builds == 1
+    incremental = book.status()["performance_metrics"]
+
+    fresh = Portfolio("t")
+    fresh.apply("AAA", 30, 120, ts=1)
+    fresh.apply("BBB", 20, 80, ts=2)
+    fresh.build_risk(history)
+    assert incremental == fresh.status()["performance_metrics"]
+
+
+def test_missing_history_counts_as_uncovered(history):
+    book = Portfolio("t")
+    book.apply("AAA", 10, 100, ts=1)
+    book.apply("ZZZ", 10, 100, ts=2)
+    book.build_risk(history)
+    assert book.status()["performance_metrics"]["history_coverage"] == 50
+
+
+def test_thousands_of_lots():
+    rng = np.random.default_rng(1)
+    book = Portfolio("t")
+    symbols = [f"S{i}" for i in range(50)]
+    for i in range(5000):
+        book.apply(symbols[i % 50], float(rng.integers(1, 100)), float(rng.uniform(10, 200)), ts=i)
+    held = book.quantity.copy()
+    book.apply("S0", -held[0] / 2, 100, ts=5000)
+    assert book.lot_count == 5000
+    assert book.quantity[0] == pytest.approx(held[0] / 2)
+    assert sum(p["lots"] for p in book.status()["positions"]) <= 5000
+
+
+@pytest.mark.asyncio
+async def test_transactions_persist_and_replay(manager, monkeypatch):
+    async def quotes(symbols):
+        return [{"symbol": s, "price": 150.0, "previous_close": 140.0} if s == "AAA" else {"error": "rate limited"} for s in symbols]
+
+    monkeypatch.setattr(market_data, "get_stock_quotes", quotes)
+    await manager.record_transaction("aaa", 10, 100, fees=1, ts=1)
+    await manager.record_transaction("BBB", 4, 50, ts=2)
+    await manager.record_transaction("AAA", -5, 120, ts=3)
+    with pytest.raises(PortfolioError):
+        await manager.record_transaction("BBB", -10, 50, ts=4)
+
+    status = await manager.status()
+    assert status["total_value"] == 5 * 150 + 4 * 50
+    assert status["daily_change"] == 50
+    assert status["performance_metrics"]["observation_days"] > 0
+
+    rows = await manager.transactions()
+    assert [(r["symbol"], r["quantity"]) for r in rows] == [("AAA", 10), ("BBB", 4), ("AAA", -5)]
+    replayed = await manager.status(refresh=False, reload=True)
+    assert replayed["realized_gain"] == status["realized_gain"]
+    assert replayed["total_cost"] == status["total_cost"]
+
+
+@pytest.mark.asyncio
+async def test_quote_ticks_reach_loaded_portfolios(manager, monkeypatch):
+    async def no_quotes(symbols):
+        return [{"error": "offline"} for _ in symbols]
+
+    monkeypatch.setattr(market_data, "get_stock_quotes", no_quotes)
+    await manager.record_transaction("AAA", 10, 100, ts=1)
+    manager.on_quote({"symbol": "AAA", "price": "105.5", "previous_close": "100"})
+    manager.on_quote({"symbol": "CCC", "price": 1})
+    status = await manager.status()
+    assert status["total_value"] == 1055
+    assert manager.stats()["default"]["ticks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_mcp_tool_reads_persisted_portfolio(manager, monkeypatch):
+    async def no_quotes(symbols):
+        return [{"error": "offline"} for _ in symbols]
+
+    monkeypatch.setattr(market_data, "get_stock_quotes", no_quotes)
+    monkeypatch.setattr(portfolio_engine, "portfolio_manager", manager)
+    await manager.record_transaction("BBB", 2, 100, ts=1, name="growth")
+    result = await mcp_tools.registry.call("get_portfolio_status", {"portfolio": "growth"})
+    assert result["portfolio"] == "growth"
+    assert result["positions"][0]["symbol"] == "BBB"
+
+
+@pytest.mark.asyncio
+async def test_sync_replays_only_when_another_process_wrote(tmp_path, history, monkeypatch):
+    async def no_quotes(symbols):
+        return [{"error": "offline"} for _ in symbols]
+
+    monkeypatch.setattr(market_data, "get_stock_quotes", no_quotes)
+    store = PersistenceStore(url=f"sqlite:///{tmp_path}/shared.sqlite3")
+    # 后端与 MCP 服务两个进程共享同一个数据库
+    backend, mcp = PortfolioManager(store, history), PortfolioManager(store, history)
+    try:
+        await backend.record_transaction("AAA", 10, 100, ts=1)
+        await mcp.status(sync=True)
+        risk = mcp.portfolios["default"].risk
+
+        # 数据库没有变化：沿用内存持仓与已缓存的风险模型
+        await mcp.status(sync=True)
+        assert mcp.portfolios["default"].risk is risk
+        assert mcp.stats()["default"]["reloads"] == 0
+
+        await backend.record_transaction("BBB", 5, 100, ts=2)
+        status = await mcp.status(sync=True)
+        assert [p["symbol"] for p in status["positions"]] == ["AAA", "BBB"]
+        assert mcp.stats()["default"]["reloads"] == 1
+
+        # 本进程自己写入的交易不触发回放
+        await backend.status(sync=True)
+        assert backend.stats()["default"]["reloads"] == 0
+    finally:
+        await store.close()
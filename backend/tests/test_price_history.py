@@ -0,0 +1,112 @@
+import httpx
+import numpy as np
+import pytest
+
+import market_data
+import price_history
+from cache import TTLCache
+from price_history import PriceHistoryStore, ingest_history, parse_time_series
+from rate_limiter import UpstreamScheduler
+
+
+def _daily_payload(dates):
+    return {
+        "Time Series (Daily)": {
+            date: {
+                "1. open": str(100 + i),
+                "2. high": str(101 + i),
+                "3. low": str(99 + i),
+                "4. close": str(100.5 + i),
+                "5. volume": str(1000 * (i + 1)),
+            }
+            # Alpha Vantage 按时间倒序返回
+            for i, date in reversed(list(enumerate(dates)))
+        }
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PriceHistoryStore(root=str(tmp_path))
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    state = {"calls": [], "dates": []}
+
+    async def handler(request):
+        state["calls"].append(dict(request.url.params))
+        return httpx.Response(200, json=_daily_payload(state["dates"]))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(market_data, "_client", client)
+    monkeypatch.setattr(market_data, "market_cache", TTLCache())
+    monkeypatch.setattr(market_data, "upstream_scheduler", UpstreamScheduler(calls_per_minute=60000, calls_per_day=10000))
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", "test")
+    yield state
+
+
+def test_parse_time_series_sorts_ascending():
+    bars = parse_time_series(_daily_payload(["2024-01-02", "2024-01-03", "2024-01-04"]), "daily")
+
+    assert bars["timestamp"].dtype == np.int64
+    assert np.all(np.diff(bars["timestamp"]) > 0)
+    assert bars["close"].tolist() == [100.5, 101.5, 102.5]
+
+
+def test_append_only_adds_newer_bars(store):
+    first = parse_time_series(_daily_payload(["2024-01-02", "2024-01-03"]), "daily")
+    assert store.append("aapl", "daily", first) == 2
+
+    overlapping = parse_time_series(_daily_payload(["2024-01-02", "2024-01-03", "2024-01-04"]), "daily")
+    assert store.append("AAPL", "daily", overlapping) == 1
+    assert store.append("AAPL", "daily", overlapping) == 0
+
+    bars = store.load("AAPL", "daily")
+    assert isinstance(bars["close"], np.memmap)
+    assert len(bars["timestamp"]) == 3
+    assert [row["time"] for row in store.tail("AAPL", "daily", limit=2)] == ["2024-01-03", "2024-01-04"]
+
+
+def test_append_overwrites_revised_last_bar(store):
+    def bars(stamps, closes):
+        closes = np.asarray(closes, dtype=np.float64)
+        return {"timestamp": np.asarray(stamps, dtype=np.int64), **{c: closes for c in ("open", "high", "low", "close", "volume")}}
+
+    seen = []
+    store.listeners.append(lambda symbol, interval, new: seen.append(new["timestamp"].tolist()))
+    assert store.append("AAPL", "daily", bars([1, 2], [10, 11])) == 2
+    # 盘中的第 2 根在收盘后被修订，同时新增第 3 根
+    assert store.append("AAPL", "daily", bars([1, 2, 3], [10, 12.5, 13])) == 2
+    assert store.load("AAPL")["close"].tolist() == [10, 12.5, 13]
+    assert seen[-1] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_append_async_writes_off_loop(store):
+    bars = parse_time_series(_daily_payload(["2024-01-02", "2024-01-03"]), "daily")
+    assert await store.append_async("AAPL", "daily", bars) == 2
+    assert await store.append_async("AAPL", "daily", bars) == 0
+    assert len(store.load("AAPL")["timestamp"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_requests_full_then_compact(store, mock_upstream, monkeypatch):
+    # 固定当前时间，使本地最后一根 K 线与“现在”相差不到一周
+    monkeypatch.setattr(price_history.time, "time", lambda: np.datetime64("2024-01-05", "s").astype(np.int64).item())
+    mock_upstream["dates"] = ["2024-01-02", "2024-01-03"]
+    result = await ingest_history("AAPL", store=store)
+    assert result["appended"] == 2
+    assert mock_upstream["calls"][-1]["outputsize"] == "full"
+
+    # 刷新间隔内不再访问网络
+    result = await ingest_history("AAPL", store=store)
+    assert result["fetched"] is False
+    assert len(mock_upstream["calls"]) == 1
+
+    mock_upstream["dates"] = ["2024-01-02", "2024-01-03", "2024-01-04"]
+    result = await ingest_history("AAPL", store=store, force=True)
+    assert result["appended"] == 1
+    assert mock_upstream["calls"][-1]["outputsize"] == "compact"
+    assert len(store.load("AAPL")["timestamp"]) == 3
+    await market_data.close_http_client()
@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+import quote_feed
+from quote_feed import FeedSubscriber, QuoteFeed
+
+
+def _quote(price, volume=1000):
+    return {"price": price, "change": 0.0, "change_percent": "0", "volume": volume}
+
+
+@pytest.fixture
+def prices():
+    return {}
+
+
+@pytest.fixture
+def feed(prices):
+    calls = []
+
+    async def fetch(symbol):
+        calls.append(symbol)
+        return _quote(prices.get(symbol, 100.0))
+
+    feed = QuoteFeed(fetch, interval=3600)
+    feed.calls = calls
+    return feed
+
+
+@pytest.mark.asyncio
+async def test_one_poller_per_symbol_fans_out(feed):
+    clients = [FeedSubscriber() for _ in range(5)]
+    for client in clients:
+        feed.subscribe(client, "aapl")
+    await asyncio.sleep(0)
+
+    assert feed.calls == ["AAPL"]
+    for client in clients:
+        batch = await client.next_batch()
+        assert batch["AAPL"]["type"] == "snapshot"
+        assert batch["AAPL"]["quote"]["price"] == 100.0
+    await feed.close()
+
+
+@pytest.mark.asyncio
+async def test_only_changed_fields_are_sent(feed, prices):
+    client = FeedSubscriber()
+    feed.subscribe(client, "AAPL")
+    await asyncio.sleep(0)
+    await client.next_batch()
+
+    prices["AAPL"] = 101.0
+    await feed.poll_once("AAPL")
+    assert (await client.next_batch())["AAPL"] == {"type": "update", "symbol": "AAPL", "changes": {"price": 101.0}}
+
+    # 没有变化时不推送
+    await feed.poll_once("AAPL")
+    assert not client._ready.is_set()
+    await feed.close()
+
+
+@pytest.mark.asyncio
+async def test_pending_updates_are_coalesced_for_slow_clients(feed, prices):
+    client = FeedSubscriber()
+    feed.subscribe(client, "AAPL")
+    await asyncio.sleep(0)
+
+    for price in (101.0, 102.0, 103.0):
+        prices["AAPL"] = price
+        await feed.poll_once("AAPL")
+
+    batch = await client.next_batch()
+    assert batch["AAPL"]["type"] == "snapshot"
+    assert batch["AAPL"]["quote"]["price"] == 103.0
+    await feed.close()
+
+
+@pytest.mark.asyncio
+async def test_last_unsubscribe_stops_polling(feed):
+    first, second = FeedSubscriber(), FeedSubscriber()
+    feed.subscribe(first, "AAPL")
+    feed.subscribe(second, "AAPL")
+
+    feed.disconnect(first)
+    assert feed.stats()["symbols"] == 1
+    feed.disconnect(second)
+    assert feed.stats() == {
+        "symbols": 0, "clients": 0, "subscriptions": 0, "polls": feed.polls, "interval": 3600,
+        "errors_sent": 0, "backing_off": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_merging_updates_does_not_leak_between_subscribers(feed, prices):
+    first, second = FeedSubscriber(), FeedSubscriber()
+    feed.subscribe(first, "AAPL")
+    feed.subscribe(second, "AAPL")
+    await asyncio.sleep(0)
+    await first.next_batch()
+    await second.next_batch()
+
+    prices["AAPL"] = 101.0
+    await feed.poll_once("AAPL")
+    # second 先取走更新（可能仍在发送中），first 的待发送更新继续合并
+    taken = await second.next_batch()
+    feed._fetch_quote = lambda symbol: _async(_quote(101.0, volume=2000))
+    await feed.poll_once("AAPL")
+    assert (await first.next_batch())["AAPL"]["changes"] == {"price": 101.0, "volume": 2000}
+    assert taken["AAPL"]["changes"] == {"price": 101.0}
+    assert (await second.next_batch())["AAPL"]["changes"] == {"volume": 2000}
+    await feed.close()
+
+
+async def _async(value):
+    return value
+
+
+@pytest.mark.asyncio
+async def test_errors_sent_only_on_state_change(feed):
+    client = FeedSubscriber()
+    feed.subscribe(client, "AAPL")
+    await asyncio.sleep(0)
+    await client.next_batch()
+
+    feed._fetch_quote = lambda symbol: _async({"error": "rate limited", "rate_limited": True})
+    assert await feed.poll_once("AAPL") is True
+    assert (await client.next_batch())["AAPL"]["type"] == "error"
+    await feed.poll_once("AAPL")
+    assert not client._ready.is_set()
+    # 错误期间加入的订阅者立即收到当前错误
+    late = FeedSubscriber()
+    feed.subscribe(late, "AAPL")
+    assert (await late.next_batch())["AAPL"]["rate_limited"] is True
+
+    # 恢复后发送完整快照，即使价格没有变化
+    feed._fetch_quote = lambda symbol: _async(_quote(100.0))
+    assert await feed.poll_once("AAPL") is False
+    assert (await client.next_batch())["AAPL"]["type"] == "snapshot"
+    assert feed.stats()["errors_sent"] == 1
+    await feed.close()
+
+
+@pytest.mark.asyncio
+async def test_poller_backs_off_while_rate_limited(monkeypatch):
+    responses = [{"error": "rate limited", "rate_limited": True}] * 4 + [_quote(100.0)] + [{"error": "x", "rate_limited": True}]
+    delays = []
+
+    async def fetch(symbol):
+        return responses.pop(0)
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        if not responses:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(quote_feed.asyncio, "sleep", fake_sleep)
+    feed = QuoteFeed(fetch, interval=1, max_backoff=8)
+    with pytest.raises(asyncio.CancelledError):
+        await feed._poll("AAPL")
+    assert delays == [2, 4, 8, 8, 1, 2]
+
+
+def test_websocket_rejects_malformed_messages(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    async def fetch(symbol):
+        return _quote(100.0)
+
+    feed = QuoteFeed(fetch, interval=3600)
+    monkeypatch.setattr(main, "quote_feed", feed)
+
+    with TestClient(main.app).websocket_connect("/api/ws/quotes") as ws:
+        ws.send_json(["AAPL"])
+        assert ws.receive_json()["type"] == "error"
+        # 字符串不会被逐字符拆成 A、A、P、L
+        ws.send_json({"action": "subscribe", "symbols": "AAPL"})
+        assert ws.receive_json()["type"] == "error"
+        assert feed.stats()["symbols"] == 0
+
+        ws.send_json({"action": "subscribe", "symbols": ["aapl"]})
+        messages = [ws.receive_json(), ws.receive_json()]
+        assert {"type": "subscribed", "symbols": ["AAPL"]} in messages
+
+    assert feed.stats()["symbols"] == 0
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    RateLimitExceeded,
+    TokenBucket,
+    UpstreamScheduler,
+    priority_scope,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=1.0, capacity=2, clock=clock)
+
+    assert bucket.try_consume()
+    assert bucket.try_consume()
+    assert not bucket.try_consume()
+    assert bucket.time_until(1) == pytest.approx(1.0)
+
+    clock.now = 1.0
+    assert bucket.try_consume()
+
+
+@pytest.mark.asyncio
+async def test_interactive_calls_jump_the_queue():
+    # 每 10ms 一个令牌，初始只有 1 个突发令牌
+    scheduler = UpstreamScheduler(calls_per_minute=6000, calls_per_day=1000)
+    scheduler.bucket.capacity = 1
+    scheduler.bucket.drain()
+    order = []
+
+    async def call(name, priority):
+        await scheduler.acquire(priority)
+        order.append(name)
+
+    background = [asyncio.create_task(call(f"bg{i}", PRIORITY_BACKGROUND)) for i in range(3)]
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(call("ui", PRIORITY_INTERACTIVE))
+    await asyncio.gather(*background, interactive)
+
+    assert order[0] == "ui"
+    stats = scheduler.stats()
+    assert stats["granted"] == 4
+    assert stats["wait_time"]["background"]["count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_background_cannot_use_interactive_reserve():
+    scheduler = UpstreamScheduler(calls_per_minute=6000, calls_per_day=10, interactive_reserve=0.2)
+
+    with priority_scope(PRIORITY_BACKGROUND):
+        for _ in range(8):
+            await scheduler.acquire()
+        with pytest.raises(RateLimitExceeded):
+            await scheduler.acquire()
+
+    await scheduler.acquire(PRIORITY_INTERACTIVE)
+    assert scheduler.stats()["calls_today"] == 9
+
+
+@pytest.mark.asyncio
+async def test_low_priority_is_deferred_after_max_wait():
+    scheduler = UpstreamScheduler(
+        calls_per_minute=1, calls_per_day=100, max_wait={PRIORITY_BACKGROUND: 0.01}
+    )
+    scheduler.bucket.drain()
+
+    with pytest.raises(RateLimitExceeded):
+        await scheduler.acquire(PRIORITY_BACKGROUND)
+    assert scheduler.deferred == 1
+    assert scheduler.stats()["queue_depth"]["background"] == 0
+
+    # 队列清空后调度任务应自行退出，而不是一直等待下一个令牌
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert scheduler._task.done()
+
+
+@pytest.mark.asyncio
+async def test_timeout_racing_a_grant_returns_the_token(monkeypatch):
+    scheduler = UpstreamScheduler(calls_per_minute=1, calls_per_day=10)
+
+    async def late_timeout(awaitable, timeout):
+        # 许可已发放，但等待方随后才收到超时
+        await awaitable
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(asyncio, "wait_for", late_timeout)
+    with pytest.raises(RateLimitExceeded):
+        await scheduler.acquire(PRIORITY_INTERACTIVE)
+
+    stats = scheduler.stats()
+    assert stats["granted"] == 0
+    assert stats["calls_today"] == 0
+    assert stats["deferred"] == 1
+    assert scheduler.bucket.tokens == pytest.approx(1.0)
@@ -0,0 +1,238 @@
+import asyncio
+import time
+
+import pytest
+
+import redis_cache
+from cache import TTLCache
+from rate_limiter import PRIORITY_INTERACTIVE, RateLimitExceeded, UpstreamScheduler
+from redis_cache import RedisCacheTier, RedisQuota
+
+
+class StandInRedis:
+    """测试用的最小 Redis 替身，支持 get/set(nx, px)/eval(释放与续期锁)/incr/decr/pexpire"""
+
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, name):
+        entry = self.data.get(name)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[name]
+            return None
+        return value
+
+    async def get(self, name):
+        return self._alive(name)
+
+    async def set(self, name, value, nx=False, px=None):
+        if nx and self._alive(name) is not None:
+            return None
+        expires_at = time.monotonic() + px / 1000 if px else None
+        self.data[name] = (value, expires_at)
+        return True
+
+    async def eval(self, script, numkeys, name, token, *args):
+        if self._alive(name) != token:
+            return 0
+        if "pexpire" in script:
+            await self.pexpire(name, int(args[0]))
+        else:
+            del self.data[name]
+        return 1
+
+    async def incr(self, name):
+        value = int(self._alive(name) or 0) + 1
+        expires_at = self.data[name][1] if name in self.data else None
+        self.data[name] = (value, expires_at)
+        return value
+
+    async def decr(self, name):
+        value = int(self._alive(name) or 0) - 1
+        self.data[name] = (value, self.data[name][1] if name in self.data else None)
+        return value
+
+    async def pexpire(self, name, px):
+        if name in self.data:
+            self.data[name] = (self.data[name][0], time.monotonic() + px / 1000)
+
+
+def test_roundtrip_serialization_is_compact():
+    payload = {"Global Quote": {"01. symbol": "AAPL", "05. price": "189.9"}}
+    raw = redis_cache.encode(123.0, payload)
+
+    assert redis_cache.decode(raw) == (123.0, payload)
+    assert b"\n" not in raw
+
+
+def test_redis_key_flattens_tuple_keys():
+    key = ("TIME_SERIES_DAILY", "AAPL", (("outputsize", "full"),))
+    assert redis_cache.redis_key(key).endswith("TIME_SERIES_DAILY:AAPL:outputsize=full")
+
+
+@pytest.mark.asyncio
+async def test_replicas_share_one_upstream_call():
+    shared = StandInRedis()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"price": 100}
+
+    # 模拟三个副本：各自独立的 L1，共享同一个 Redis
+    replicas = []
+    for _ in range(3):
+        l1 = TTLCache()
+        l1.l2 = RedisCacheTier(shared, poll_interval=0.005)
+        replicas.append(l1)
+
+    results = await asyncio.gather(
+        *(replica.get_or_load(("GLOBAL_QUOTE", "AAPL"), loader, ttl=30) for replica in replicas)
+    )
+
+    assert calls == 1
+    assert results == [{"price": 100}] * 3
+    assert sum(r.l2.lock_waits for r in replicas) > 0
+
+
+@pytest.mark.asyncio
+async def test_lock_is_extended_while_loader_waits():
+    shared = StandInRedis()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        # 回源（例如在上游调度队列中排队）耗时远超锁的过期时间
+        await asyncio.sleep(0.35)
+        return "v"
+
+    replicas = [RedisCacheTier(shared, lock_timeout=0.1, lock_wait=5, poll_interval=0.01) for _ in range(2)]
+    first = asyncio.ensure_future(replicas[0].get_or_load("k", loader, ttl=30))
+    await asyncio.sleep(0.01)
+    second = await replicas[1].get_or_load("k", loader, ttl=30)
+
+    assert (await first)[0] == second[0] == "v"
+    assert calls == 1
+    assert replicas[0].lock_extensions >= 2
+    assert redis_cache.redis_key("k") + ":lock" not in shared.data
+
+
+@pytest.mark.asyncio
+async def test_release_keeps_a_lock_taken_over_by_another_replica():
+    shared = StandInRedis()
+    tier = RedisCacheTier(shared, lock_timeout=10)
+    lock_name = redis_cache.redis_key("k") + ":lock"
+
+    async def loader():
+        # 锁已过期并被其他副本重新获取
+        await shared.set(lock_name, "other", px=10_000)
+        return "v"
+
+    await tier.get_or_load("k", loader, ttl=30)
+    assert await shared.get(lock_name) == "other"
+
+
+@pytest.mark.asyncio
+async def test_l1_inherits_remaining_ttl_from_l2():
+    shared = StandInRedis()
+    await shared.set(redis_cache.redis_key("k"), redis_cache.encode(time.time() + 5, "v"))
+
+    l1 = TTLCache()
+    l1.l2 = RedisCacheTier(shared)
+
+    async def loader():
+        raise AssertionError("should be served from L2")
+
+    assert await l1.get_or_load("k", loader, ttl=3600) == "v"
+    expires_at, _ = l1._entries["k"]
+    assert expires_at - time.monotonic() <= 5
+
+
+@pytest.mark.asyncio
+async def test_redis_failure_falls_back_to_loader():
+    class BrokenRedis:
+        async def get(self, name):
+            raise ConnectionError("redis down")
+
+        async def set(self, *args, **kwargs):
+            raise ConnectionError("redis down")
+
+    tier = RedisCacheTier(BrokenRedis())
+
+    async def loader():
+        return "fresh"
+
+    assert await tier.get_or_load("k", loader, ttl=10) == ("fresh", 10)
+    assert tier.errors == 2
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_processes_share_upstream_quota():
+    shared = StandInRedis()
+    clock = FakeClock(30.0)
+    # 模拟后端与 MCP 服务两个进程：本地令牌桶各自充足，配额由 Redis 计数器统一限制
+    processes = []
+    for _ in range(2):
+        scheduler = UpstreamScheduler(calls_per_minute=6000, calls_per_day=4, max_wait={PRIORITY_INTERACTIVE: 0.05})
+        scheduler.shared = RedisQuota(shared, calls_per_minute=3, clock=clock)
+        processes.append(scheduler)
+    backend, mcp = processes
+
+    for _ in range(3):
+        await backend.acquire(PRIORITY_INTERACTIVE)
+    # 本分钟的共享配额已被另一个进程用完
+    with pytest.raises(RateLimitExceeded):
+        await mcp.acquire(PRIORITY_INTERACTIVE)
+    assert mcp.shared.waits >= 1
+    assert mcp.stats()["calls_today"] == 0
+
+    clock.now += 60
+    await mcp.acquire(PRIORITY_INTERACTIVE)
+    assert mcp.stats()["shared"]["calls_today"] == 4
+    # 每日配额按两个进程的总和计算
+    with pytest.raises(RateLimitExceeded):
+        await backend.acquire(PRIORITY_INTERACTIVE)
+    assert backend.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_quota_returned_when_grant_is_abandoned(monkeypatch):
+    shared = StandInRedis()
+    scheduler = UpstreamScheduler(calls_per_minute=6000, calls_per_day=10)
+    scheduler.shared = RedisQuota(shared, calls_per_minute=5, clock=FakeClock(30.0))
+
+    async def late_timeout(awaitable, timeout):
+        # 许可发放后等待才超时
+        await awaitable
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(asyncio, "wait_for", late_timeout)
+    with pytest.raises(RateLimitExceeded):
+        await scheduler.acquire(PRIORITY_INTERACTIVE)
+    assert [value for value, _ in shared.data.values()] == [0, 0]
+    assert scheduler.shared.stats()["calls_today"] == 0
+
+
+@pytest.mark.asyncio
+async def test_quota_falls_back_to_local_limits_when_redis_fails():
+    class BrokenRedis:
+        async def incr(self, name):
+            raise ConnectionError("redis down")
+
+    quota = RedisQuota(BrokenRedis(), calls_per_minute=1)
+    assert await quota.reserve(daily_limit=1) == (0.0, ())
+    assert quota.errors == 1
@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from rules import RuleConfigError, RuleEngine, RuleSet
+
+NUMERIC = ("price", "change_percent", "volume", "rsi", "beta")
+TEXT = ("sector",)
+
+
+def _columns(**values):
+    columns = {field: np.asarray(values.get(field, [np.nan] * len(values["price"])), dtype=np.float64) for field in NUMERIC}
+    columns["sector"] = np.array(values.get("sector", [""] * len(values["price"])), dtype=object)
+    return columns
+
+
+def _rules(config):
+    return RuleSet(config, NUMERIC, TEXT)
+
+
+def test_cases_first_match_wins_and_default():
+    rules = _rules({"outputs": {"trend": {"cases": [
+        {"when": "change_percent > 1", "then": "up"},
+        {"when": "change_percent > 0", "then": "flat-up"},
+        {"when": "30 <= rsi <= 70 and volume > 1M", "then": "normal"},
+    ], "default": "other"}}})
+    result = rules.evaluate(_columns(price=[1] * 4, change_percent=[2, 0.5, -1, np.nan], rsi=[50, 50, 50, 80], volume=[0, 0, 2e6, 2e6]))
+    assert result["trend"] == ["up", "flat-up", "normal", "other"]
+
+
+def test_value_expressions_and_defaults():
+    rules = _rules({
+        "defaults": {"price": 0},
+        "outputs": {"target": {"value": "round(price * 1.1, 2)"}, "beta": {"value": "fill(beta, 1.0)"}, "ratio": {"value": "price / volume"}},
+    })
+    result = rules.evaluate(_columns(price=[50, np.nan], beta=[np.nan, 2], volume=[0, 5]))
+    assert result["target"] == [55.0, 0.0]
+    assert result["beta"] == [1.0, 2.0]
+    # 除以 0 不抛异常
+    assert result["ratio"][0] == np.inf
+
+
+def test_missing_values_never_match_comparisons():
+    rules = _rules({"outputs": {"flag": {"cases": [{"when": "rsi != 50", "then": 1}, {"when": "missing(rsi)", "then": 2}], "default": 0}}})
+    assert rules.evaluate(_columns(price=[1, 1, 1], rsi=[40, np.nan, 50]))["flag"] == [1, 2, 0]
+
+
+def test_insight_groups_templates_and_limit():
+    rules = _rules({"insights": {"limit": 2, "groups": [
+        {"name": "rsi", "cases": [{"when": "rsi > 70", "then": "RSI {rsi:.1f} 超买"}]},
+        {"name": "sector", "when": "sector in ['TECH', 'ENERGY']", "cases": [], "default": "{sector} 行业"},
+        {"name": "always", "cases": [], "default": "兜底"},
+    ]}})
+    result = rules.evaluate(_columns(price=[1, 1, 1], rsi=[75.25, 10, 80], sector=["TECH", "BANK", "ENERGY"]))
+    assert result["insights"] == [["RSI 75.2 超买", "TECH 行业"], ["兜底"], ["RSI 80.0 超买", "ENERGY 行业"]]
+
+
+@pytest.mark.parametrize("config", [
+    {"outputs": {"x": {"value": "unknown + 1"}}},
+    {"outputs": {"x": {"value": "__import__('os')"}}},
+    {"outputs": {"x": {"value": "price +"}}},
+    {"outputs": {"x": {"cases": [{"when": "sector > 'A'", "then": 1}]}}},
+    {"outputs": {"x": {"cases": [{"when": "sector == 1", "then": 1}]}}},
+    {"outputs": {"x": {"cases": [{"then": 1}]}}},
+    {"insights": {"groups": [{"cases": [], "default": "{nope}"}]}},
+    {"defaults": {"nope": 1}},
+])
+def test_invalid_configs_rejected(config):
+    with pytest.raises(RuleConfigError):
+        _rules(config)
+
+
+def test_batch_matches_row_by_row():
+    rng = np.random.default_rng(11)
+    rules = _rules({"outputs": {"risk": {"cases": [
+        {"when": "missing(beta)", "then": "unknown"},
+        {"when": "beta > 1.5 or (rsi > 70 and change_percent > 2)", "then": "high"},
+        {"when": "beta > 1.0", "then": "medium"},
+    ], "default": "low"}}})
+    n = 5000
+    columns = _columns(price=np.ones(n), beta=np.where(rng.random(n) < 0.1, np.nan, rng.uniform(0, 2.5, n)),
+                       rsi=rng.uniform(0, 100, n), change_percent=rng.normal(0, 3, n))
+    batch = rules.evaluate(columns)["risk"]
+    single = [rules.evaluate({k: v[i:i + 1] for k, v in columns.items()})["risk"][0] for i in range(0, n, 97)]
+    assert batch[::97] == single
+
+
+def _write(path, config):
+    path.write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_engine_reloads_on_change_and_keeps_last_good(tmp_path):
+    path = tmp_path / "rules.json"
+    _write(path, {"version": 1, "outputs": {"action": {"cases": [{"when": "change_percent > 3", "then": "sell"}], "default": "hold"}}})
+    engine = RuleEngine(str(path), NUMERIC, TEXT)
+    columns = _columns(price=[1], change_percent=[2.5])
+    assert engine.evaluate(columns)["action"] == ["hold"]
+    # mtime 未变时不重新编译
+    rules = engine.rules
+    engine.evaluate(columns)
+    assert engine.rules is rules and engine.reloads == 1
+
+    _write(path, {"version": 2, "outputs": {"action": {"cases": [{"when": "change_percent > 2", "then": "sell"}], "default": "hold"}}})
+    os.utime(path, (1, 1))
+    assert engine.evaluate(columns)["action"] == ["sell"]
+    assert engine.stats()["version"] == 2
+
+    path.write_text("{not json", encoding="utf-8")
+    os.utime(path, (2, 2))
+    assert engine.evaluate(columns)["action"] == ["sell"]
+    assert engine.stats()["last_error"]
+
+
+def test_engine_first_load_failure_raises(tmp_path):
+    with pytest.raises(RuleConfigError):
+        RuleEngine(str(tmp_path / "missing.json"), NUMERIC).reload()
+    path = tmp_path / "bad.json"
+    _write(path, {"outputs": {"x": {"value": "nope"}}})
+    with pytest.raises(RuleConfigError):
+        RuleEngine(str(path), NUMERIC).reload()
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+import market_data
+from screener import ColumnarTable, ScreenExpressionError, Screener, compile_filter
+
+
+@pytest.fixture
+def screener():
+    screener = Screener(ColumnarTable(capacity=2), universe=["AAPL", "MSFT", "TSLA"])
+    rows = [
+        ("AAA", "Technology", 12, 25, 2_000_000, 50),
+        ("BBB", "technology", 30, 20, 5_000_000, 120),
+        ("CCC", "ENERGY", 8, 28, 3_000_000, 40),
+        ("DDD", "TECHNOLOGY", 14, 45, 500_000, 75),
+        ("EEE", "TECHNOLOGY", None, 22, 1_500_000, 10),
+    ]
+    for symbol, sector, pe, rsi, volume, price in rows:
+        screener.update_overview({"symbol": symbol, "sector": sector, "pe_ratio": str(pe) if pe else "None"})
+        screener.update_quote({"symbol": symbol, "price": price, "change_percent": "1.5%", "volume": volume})
+        screener.update_indicators(symbol, {"rsi": rsi, "source": "history"})
+    return screener
+
+
+def _symbols(result):
+    return [row["symbol"] for row in result["results"]]
+
+
+def test_table_grows_and_updates_in_place(screener):
+    table = screener.table
+    assert len(table) == 5
+    screener.update_quote({"symbol": "aaa", "price": 55, "volume": 1})
+    assert len(table) == 5
+    assert table.column("price")[0] == 55
+    assert table.column("change_percent")[0] == 1.5
+    assert table.column("sector").tolist()[:2] == ["TECHNOLOGY", "TECHNOLOGY"]
+
+
+def test_combined_filter_with_suffixes(screener):
+    result = screener.screen('sector == "technology" and pe < 15 and rsi < 30 and volume > 1M')
+    assert _symbols(result) == ["AAA"]
+    assert result["count"] == 1 and result["total"] == 5
+    assert set(result["results"][0]) >= {"symbol", "price", "pe", "rsi", "volume"}
+
+
+def test_or_not_in_and_chained(screener):
+    assert sorted(_symbols(screener.screen("pe < 10 or rsi > 40"))) == ["CCC", "DDD"]
+    assert sorted(_symbols(screener.screen('not sector in ["TECHNOLOGY"]'))) == ["CCC"]
+    assert sorted(_symbols(screener.screen("10 <= pe < 20"))) == ["AAA", "DDD"]
+    assert sorted(_symbols(screener.screen("15 > pe"))) == ["AAA", "CCC", "DDD"]
+    assert sorted(_symbols(screener.screen("pe != 12"))) == ["BBB", "CCC", "DDD"]
+    assert sorted(_symbols(screener.screen("price >= 50 AND volume <= 2M"))) == ["AAA", "DDD"]
+
+
+def test_missing_values_never_match(screener):
+    assert "EEE" not in _symbols(screener.screen("pe < 100"))
+    assert "EEE" not in _symbols(screener.screen("pe >= 0"))
+
+
+def test_sort_puts_missing_last_and_limits(screener):
+    ascending = screener.screen("", sort="pe")
+    assert _symbols(ascending) == ["CCC", "AAA", "DDD", "BBB", "EEE"]
+    descending = screener.screen("", sort="pe", descending=True, limit=2)
+    assert _symbols(descending) == ["BBB", "DDD"]
+    assert descending["count"] == 5
+
+
+def test_estimated_indicators_are_ignored(screener):
+    screener.update_indicators("AAA", {"rsi": 90, "source": "estimated"})
+    assert screener.table.column("rsi")[0] == 25
+
+
+@pytest.mark.parametrize("expression", [
+    "pe < ",
+    "unknown > 1",
+    "pe < 'cheap'",
+    "sector > 'A'",
+    "pe + 1 > 2",
+    "__import__('os')",
+    "pe in [1, 2]",
+])
+def test_invalid_expressions(screener, expression):
+    with pytest.raises(ScreenExpressionError):
+        screener.screen(expression)
+
+
+def test_invalid_sort_and_fields(screener):
+    with pytest.raises(ScreenExpressionError):
+        screener.screen("", sort="sector")
+    with pytest.raises(ScreenExpressionError):
+        screener.screen("", fields=["nope"])
+
+
+def test_filters_compiled_once_and_index_reused(screener):
+    compile_filter.cache_clear()
+    screener.screen("pe < 20")
+    builds = screener.table.index_builds
+    screener.screen("pe < 20")
+    assert compile_filter.cache_info().hits == 1
+    assert screener.table.index_builds == builds
+    # 写入该列后索引失效并重建
+    screener.update_overview({"symbol": "AAA", "pe_ratio": "40"})
+    assert "AAA" not in _symbols(screener.screen("pe < 20"))
+    assert screener.table.index_builds == builds + 1
+
+
+def test_mask_matches_bruteforce_on_random_universe():
+    rng = np.random.default_rng(7)
+    screener = Screener(ColumnarTable())
+    pe = rng.uniform(0, 40, 3000)
+    pe[rng.random(3000) < 0.1] = np.nan
+    volume = rng.integers(1, 5_000_000, 3000)
+    for i in range(3000):
+        screener.table.upsert(f"S{i}", {"pe": pe[i], "volume": volume[i], "sector": "TECHNOLOGY" if i % 2 else "ENERGY"})
+    result = screener.screen('sector == "TECHNOLOGY" and pe < 15 and volume > 1M', limit=3000)
+    expected = {f"S{i}" for i in range(3000) if i % 2 and pe[i] < 15 and volume[i] > 1e6}
+    assert set(_symbols(result)) == expected
+
+
+@pytest.mark.asyncio
+async def test_refresh_loads_universe_overviews_offline(screener, monkeypatch):
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", None)
+    await screener.refresh()
+    result = screener.screen('sector == "CONSUMER CYCLICAL"', fields=["ev_ebitda"])
+    assert _symbols(result) == ["TSLA"]
+    assert result["results"][0]["ev_ebitda"] == 60
+    assert screener.stats()["refreshes"] == 1
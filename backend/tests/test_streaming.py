@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+from streaming import bounded_map, encode_record
+
+
+@pytest.mark.asyncio
+async def test_bounded_map_limits_in_flight_and_waits_for_consumer():
+    state = {"started": 0, "in_flight": 0, "peak": 0}
+
+    async def work(i):
+        state["started"] += 1
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.001 * (i % 3))
+        state["in_flight"] -= 1
+        return {"i": i}
+
+    stream = bounded_map(work, range(100), limit=4)
+    first = await stream.__anext__()
+    # 消费者没有继续读取时不会启动新任务
+    await asyncio.sleep(0.02)
+    assert state["started"] <= 4 + 1
+
+    rest = [record async for record in stream]
+    assert sorted(r["i"] for r in [first, *rest]) == list(range(100))
+    assert state["peak"] <= 4
+
+
+@pytest.mark.asyncio
+async def test_bounded_map_cancels_pending_on_close():
+    cancelled = []
+
+    async def work(i):
+        try:
+            await asyncio.sleep(0 if i == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+        return {"i": i}
+
+    stream = bounded_map(work, range(10), limit=3)
+    assert await stream.__anext__() == {"i": 0}
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert sorted(cancelled) == [1, 2]
+
+
+def test_encode_record_formats():
+    record = {"type": "result", "symbol": "AAPL"}
+
+    assert json.loads(encode_record(record, "ndjson")) == record
+    assert encode_record(record, "sse") == f"event: result\ndata: {json.dumps(record)}\n\n"
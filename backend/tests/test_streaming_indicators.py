@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+import pytest
+
+import indicators
+from streaming_indicators import LiveIndicatorBook, SymbolIndicators, restore_state
+
+
+@pytest.fixture
+def bars():
+    rng = np.random.default_rng(7)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.02, size=400)))
+    spread = np.abs(rng.normal(0, 0.01, size=400)) * close
+    return {
+        "timestamp": np.arange(400, dtype=np.int64) * 86400,
+        "open": close,
+        "high": close + spread,
+        "low": close - spread,
+        "close": close,
+        "volume": rng.integers(1_000, 100_000, size=400).astype(np.float64),
+    }
+
+
+def _head(bars, n):
+    return {column: values[:n] for column, values in bars.items()}
+
+
+def _bar(bars, i):
+    return bars["high"][i], bars["low"][i], bars["close"][i], bars["volume"][i]
+
+
+def _assert_matches(values, expected):
+    for name, value in expected.items():
+        assert values[name] == pytest.approx(float(value), rel=1e-9, nan_ok=True), name
+
+
+def test_incremental_updates_match_full_recompute(bars):
+    state = SymbolIndicators.from_bars(_head(bars, 5))
+    for i in range(5, 400):
+        values = state.update(*_bar(bars, i))
+
+    _assert_matches(values, indicators.latest_values(indicators.compute_indicators(bars)))
+
+
+def test_preview_does_not_mutate_state(bars):
+    state = SymbolIndicators.from_bars(_head(bars, 399))
+    before = state.snapshot()
+
+    preview = state.preview(*_bar(bars, 399))
+
+    assert state.snapshot() == before
+    _assert_matches(preview, indicators.latest_values(indicators.compute_indicators(bars)))
+
+
+def test_snapshot_round_trips_through_json(bars):
+    state = SymbolIndicators.from_bars(_head(bars, 300))
+    restored = restore_state(json.loads(json.dumps(state.snapshot())))
+
+    for i in range(300, 400):
+        expected = state.update(*_bar(bars, i))
+        actual = restored.update(*_bar(bars, i))
+    assert actual == pytest.approx(expected, nan_ok=True)
+
+
+def test_book_only_feeds_new_bars(bars):
+    book = LiveIndicatorBook()
+    book.evaluate("aapl", _head(bars, 300))
+    state = book.get("AAPL")
+
+    values = book.evaluate("AAPL", bars)
+
+    assert book.get("AAPL") is state
+    assert state.last_timestamp == int(bars["timestamp"][-1])
+    _assert_matches(values, indicators.latest_values(indicators.compute_indicators(bars)))
+
+
+def _revise_last(bars, n, delta):
+    revised = {column: values[:n].copy() for column, values in bars.items()}
+    for column in ("high", "low", "close"):
+        revised[column][-1] += delta
+    return revised
+
+
+def test_book_recomputes_revised_last_bar(bars):
+    book = LiveIndicatorBook()
+    book.evaluate("AAPL", _head(bars, 300))
+    # 增量计入第 301 根，随后这根尚未收盘的 K 线被修订
+    book.evaluate("AAPL", _head(bars, 301))
+    revised = _revise_last(bars, 301, 10.0)
+
+    values = book.evaluate("AAPL", revised)
+
+    assert book.rollbacks == 1
+    _assert_matches(values, indicators.latest_values(indicators.compute_indicators(revised)))
+    # 修订后的状态可以继续增量计入
+    following = {column: np.concatenate([revised[column], bars[column][301:]]) for column in bars}
+    _assert_matches(book.evaluate("AAPL", following), indicators.latest_values(indicators.compute_indicators(following)))
+
+
+def test_book_rebuilds_when_revised_bar_has_no_snapshot(bars):
+    book = LiveIndicatorBook()
+    book.evaluate("AAPL", _head(bars, 300))
+    revised = _revise_last(bars, 300, -5.0)
+
+    values = book.evaluate("AAPL", revised)
+
+    assert book.rebuilds == 1
+    _assert_matches(values, indicators.latest_values(indicators.compute_indicators(revised)))
+
+
+def test_book_previews_live_bar_without_committing(bars):
+    book = LiveIndicatorBook()
+    live = dict(zip(("high", "low", "close", "volume"), _bar(bars, 399)))
+
+    values = book.evaluate("AAPL", bars, live_bar=live, live_timestamp=int(bars["timestamp"][399]))
+
+    assert book.get("AAPL").last_timestamp == int(bars["timestamp"][398])
+    _assert_matches(values, indicators.latest_values(indicators.compute_indicators(bars)))
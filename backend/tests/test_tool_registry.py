@@ -0,0 +1,87 @@
+import asyncio
+from typing import List, Literal
+
+import pytest
+from fastapi.testclient import TestClient
+
+from mcp_server import mcp_app
+from mcp_tools import registry as mcp_registry
+from tool_registry import LatencyHistogram, ToolArgumentsError, ToolNotFound, ToolRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = ToolRegistry()
+
+    @registry.tool()
+    async def get_quotes(symbols: List[str], period: Literal["1d", "1w"] = "1d", limit: int = 10):
+        """批量获取报价
+
+        第二行不会出现在描述里。
+        """
+        await asyncio.sleep(0.002)
+        return {"symbols": symbols, "period": period, "limit": limit}
+
+    @registry.tool(name="boom", description="总是失败")
+    async def fail():
+        raise RuntimeError("boom")
+
+    return registry
+
+
+def test_schema_is_generated_from_signature(registry):
+    tool = registry.list_tools()[0]
+
+    assert tool["name"] == "get_quotes"
+    assert tool["description"] == "批量获取报价"
+    assert tool["parameters"]["required"] == ["symbols"]
+    assert tool["parameters"]["properties"]["period"]["enum"] == ["1d", "1w"]
+    assert tool["parameters"]["properties"]["symbols"]["items"] == {"type": "string"}
+
+
+@pytest.mark.asyncio
+async def test_call_validates_and_coerces_arguments(registry):
+    assert await registry.call("get_quotes", {"symbols": ["AAPL"], "limit": "5"}) == {
+        "symbols": ["AAPL"], "period": "1d", "limit": 5,
+    }
+    with pytest.raises(ToolArgumentsError, match="period"):
+        await registry.call("get_quotes", {"symbols": ["AAPL"], "period": "5y"})
+    with pytest.raises(ToolArgumentsError, match="unknown"):
+        await registry.call("get_quotes", {"symbols": ["AAPL"], "unknown": 1})
+    with pytest.raises(ToolNotFound):
+        await registry.call("missing")
+
+
+@pytest.mark.asyncio
+async def test_latency_is_recorded_per_tool(registry):
+    for _ in range(3):
+        await registry.call("get_quotes", {"symbols": ["AAPL"]})
+    with pytest.raises(RuntimeError):
+        await registry.call("boom")
+
+    stats = registry.stats()
+    assert stats["get_quotes"]["count"] == 3
+    assert stats["get_quotes"]["p50_ms"] >= 1
+    assert stats["boom"]["errors"] == 1
+
+
+def test_histogram_quantiles():
+    histogram = LatencyHistogram(buckets=(10, 100))
+    for elapsed in (1, 2, 3, 50, 500):
+        histogram.observe(elapsed)
+
+    assert histogram.quantile(0.5) == 10
+    assert histogram.quantile(0.8) == 100
+    assert histogram.quantile(1.0) == 500
+    assert histogram.snapshot()["buckets"] == {"<=10ms": 3, "<=100ms": 1, ">100ms": 1}
+
+
+def test_servers_share_one_tool_list():
+    client = TestClient(mcp_app)
+    names = [tool["name"] for tool in client.get("/tools").json()["tools"]]
+
+    assert names == [tool["name"] for tool in mcp_registry.list_tools()]
+    assert {"get_company_overview", "get_stock_price", "get_stock_k_data", "get_stock_info"} <= set(names)
+
+    response = client.post("/call/analyze_market", json={"timeframe": "10y"}).json()
+    assert response["status"] == "error" and "timeframe" in response["error"]
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+import fundamentals
+import market_data
+import valuation
+from cache import TTLCache
+from fundamentals import FundamentalsStore
+from valuation import PeerStats, dcf_per_share, growth_paths, parse_valuation_inputs, value_companies
+
+
+def _overview(symbol, sector="TECHNOLOGY", pe="20", ev_ebitda="15", pb="5", **extra):
+    return {
+        "Symbol": symbol, "Name": symbol, "Sector": sector, "MarketCapitalization": "1000000000",
+        "SharesOutstanding": "10000000", "EPS": "5", "BookValue": "20", "EBITDA": "100000000",
+        "RevenueTTM": "500000000", "ProfitMargin": "0.2", "QuarterlyRevenueGrowthYOY": "0.1", "Beta": "1",
+        "PERatio": pe, "EVToEBITDA": ev_ebitda, "PriceToBookRatio": pb, "PriceToSalesRatioTTM": "2",
+        "PEGRatio": "1.5", "AnalystTargetPrice": "120", **extra,
+    }
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    monkeypatch.setattr(market_data, "ALPHA_VANTAGE_API_KEY", None)
+    monkeypatch.setattr(fundamentals, "fundamentals_store", FundamentalsStore(root=str(tmp_path)))
+    monkeypatch.setattr(valuation, "peer_cache", TTLCache(max_entries=4))
+
+
+def test_inputs_parse_overview_and_drop_negative_multiples():
+    inputs = parse_valuation_inputs(_overview("abc", pe="None", EPS="-2", ev_ebitda="-3"))
+    assert inputs["symbol"] == "ABC"
+    assert inputs["price"] == pytest.approx(100)
+    assert np.isnan(inputs["multiples"]["pe"])
+    assert np.isnan(inputs["multiples"]["ev_ebitda"])
+    assert inputs["multiples"]["pb"] == 5
+
+
+def test_growth_path_fades_to_terminal():
+    path = growth_paths(np.array([0.2]), terminal=0.02)[0]
+    assert path[:valuation.STAGE1_YEARS].tolist() == [0.2] * valuation.STAGE1_YEARS
+    assert path[-1] == pytest.approx(0.02)
+    assert np.all(np.diff(path[valuation.STAGE1_YEARS - 1:]) < 0)
+
+
+def test_dcf_matches_explicit_loop_and_broadcasts_grid():
+    base, shares, rate, growth, terminal = 100.0, 10.0, 0.09, 0.08, 0.025
+    growths = growth_paths(np.array([growth]), terminal)[0]
+    value, cash = 0.0, base
+    for year, g in enumerate(growths, start=1):
+        cash *= 1 + g
+        value += cash / (1 + rate) ** year
+    value += cash * (1 + terminal) / (rate - terminal) / (1 + rate) ** len(growths)
+    assert dcf_per_share(base, shares, rate, growth, terminal) == pytest.approx(value / shares)
+
+    rates = np.array([0.08, 0.09, 0.10])
+    grid = dcf_per_share(base, shares, rates[:, None], np.array([0.06, 0.08])[None, :], terminal)
+    assert grid.shape == (3, 2)
+    assert grid[1, 1] == pytest.approx(value / shares)
+    # 折现率越高价值越低，增长越高价值越高
+    assert np.all(np.diff(grid[:, 0]) < 0) and np.all(grid[:, 1] > grid[:, 0])
+    assert np.isnan(dcf_per_share(base, shares, 0.02, growth, terminal))
+
+
+def test_peer_percentiles_average_ties():
+    stats = PeerStats("TECH", ["A", "B", "C", "D"], np.array([[10.0], [20.0], [20.0], [np.nan]]))
+    assert stats.medians[0] == 20
+    ranks = stats.percentiles(np.array([[5.0], [20.0], [30.0], [np.nan]]))[:, 0]
+    assert ranks[:3].tolist() == pytest.approx([0, 200 / 3, 100])
+    assert np.isnan(ranks[3])
+
+
+def test_value_companies_in_bulk():
+    companies = [parse_valuation_inputs(_overview(s, pe=pe)) for s, pe in (("A", "10"), ("B", "20"), ("C", "30"))]
+    peers = PeerStats("TECHNOLOGY", ["A", "B", "C"], valuation._multiples_matrix(companies))
+    results = value_companies(companies, peers, [(50_000_000, "test")] * 2 + [(-1, "test")])
+    assert [r["peers"]["percentiles"]["pe"] for r in results] == [pytest.approx(100 / 6, abs=0.1), 50.0, pytest.approx(500 / 6, abs=0.1)]
+    # 同行 P/E 中位数 20 × EPS 5
+    assert results[0]["implied_prices"]["pe"] == 100
+    base = results[0]["dcf"]
+    assert base["scenarios"]["bear"] < base["scenarios"]["base"] == base["value_per_share"] < base["scenarios"]["bull"]
+    assert base["sensitivity"]["values"][2][2] == base["value_per_share"]
+    assert len(base["sensitivity"]["values"]) == len(valuation.SENSITIVITY_STEPS)
+    # 自由现金流为负时不做 DCF
+    assert results[2]["dcf"]["value_per_share"] is None
+    assert results[2]["fair_value"] is not None
+
+
+@pytest.mark.asyncio
+async def test_valuation_from_fixtures_uses_statement_fcf(offline):
+    result = await valuation.get_valuation("aapl")
+    assert result["sector"] == "TECHNOLOGY"
+    assert result["peers"]["count"] == 4
+    assert result["dcf"]["fcf_source"] == "free_cash_flow_ttm"
+    assert result["dcf"]["value_per_share"] > 0
+    assert result["fair_value"] > 0
+
+
+@pytest.mark.asyncio
+async def test_peer_universe_cached_per_process(offline, monkeypatch):
+    calls = []
+    original = fundamentals.query_fundamental
+
+    async def counting(symbol, function):
+        calls.append(symbol)
+        return await original(symbol, function)
+
+    monkeypatch.setattr(fundamentals, "query_fundamental", counting)
+    first = await valuation.value_sector("technology")
+    fetched = len(calls)
+    second = await valuation.value_sector("TECHNOLOGY")
+    assert fetched == len(valuation.PEER_UNIVERSE)
+    assert len(calls) == fetched
+    assert first["count"] == second["count"] == 4
+    upsides = [c["upside"] for c in second["companies"]]
+    assert upsides == sorted(upsides, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_unknown_sector_and_symbol(offline):
+    assert "error" in await valuation.value_sector("UTILITIES")
+    assert "error" in await valuation.get_valuation("ZZZZ")
@@ -0,0 +1,145 @@
+"""
+MCP 工具注册表
+用 @registry.tool 声明工具：导入时根据函数签名生成 pydantic 参数模型与 JSON Schema，
+调用时按名称查字典分发，参数由预编译的模型校验，并按工具记录调用耗时直方图。
+两个 MCP Server 与后端的工具列表都来自同一个注册表，不再各自维护。
+"""
+
+import inspect
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pydantic import ConfigDict, ValidationError, create_model
+
+# 耗时直方图的桶上界（毫秒），最后一个桶收纳更慢的调用
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class ToolNotFound(LookupError):
+    """调用了未注册的工具"""
+
+
+class ToolArgumentsError(ValueError):
+    """工具参数校验失败"""
+
+
+class LatencyHistogram:
+    """固定桶的耗时直方图，记录开销为一次二分查找"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float, error: bool = False):
+        self.counts[bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={bound}ms" for bound in self.buckets] + [f">{self.buckets[-1]}ms"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class ToolSpec:
+    """一个已注册的工具：函数、参数模型、JSON Schema 与耗时统计"""
+
+    def __init__(self, name: str, description: str, func: Callable[..., Awaitable[Any]]):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.args_model = _args_model(name, func)
+        self.parameters = self.args_model.model_json_schema()
+        self.parameters.pop("title", None)
+        self.latency = LatencyHistogram()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "description": self.description, "parameters": self.parameters}
+
+
+def _args_model(name: str, func: Callable) -> type:
+    """根据函数签名生成参数模型；未标注类型的参数按 Any 处理，多余参数报错"""
+    fields = {}
+    for param in inspect.signature(func).parameters.values():
+        annotation = Any if param.annotation is inspect.Parameter.empty else param.annotation
+        default = ... if param.default is inspect.Parameter.empty else param.default
+        fields[param.name] = (annotation, default)
+    return create_model(f"{name}_args", __config__=ConfigDict(extra="forbid"), **fields)
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+
+    def tool(self, name: Optional[str] = None, description: Optional[str] = None):
+        """注册异步工具函数；名称默认取函数名，描述默认取文档字符串首行"""
+
+        def decorator(func):
+            tool_name = name or func.__name__
+            if tool_name in self._tools:
+                raise ValueError(f"工具重复注册: {tool_name}")
+            doc = description or ((inspect.getdoc(func) or "").splitlines() or [""])[0]
+            self._tools[tool_name] = ToolSpec(tool_name, doc, func)
+            return func
+
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def get(self, name: str) -> ToolSpec:
+        spec = self._tools.get(name)
+        if spec is None:
+            raise ToolNotFound(f"未知工具: {name}")
+        return spec
+
+    def list_tools(self) -> List[Dict[str, Any]]:
+        return [spec.describe() for spec in self._tools.values()]
+
+    async def call(self, name: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """校验参数并执行工具；未知工具抛出 ToolNotFound，参数不合法抛出 ToolArgumentsError"""
+        spec = self.get(name)
+        try:
+            arguments = spec.args_model.model_validate(params or {})
+        except ValidationError as e:
+            raise ToolArgumentsError(
+                "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            ) from None
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await spec.func(**dict(arguments))
+            failed = False
+            return result
+        finally:
+            spec.latency.observe((time.perf_counter() - started) * 1000, error=failed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: spec.latency.snapshot() for name, spec in self._tools.items()}
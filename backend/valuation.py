@@ -0,0 +1,345 @@
+"""
+估值引擎
+根据 OVERVIEW 字段与本地财报计算多阶段 DCF、P/E、EV/EBITDA、P/B、P/S 等估值，并给出同行业（sector）百分位排名。
+所有计算按公司数组化：同一行业的多家公司、情景分析与“折现率 × 增长率”敏感性矩阵都由一次 NumPy 广播完成；
+观察池的同行统计按行业缓存，缓存有效期内对整个行业估值只需毫秒级的数组运算。
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import fundamentals
+from cache import TTLCache
+
+# 同行比较的观察池
+PEER_UNIVERSE = [
+    s.strip().upper()
+    for s in os.getenv("VALUATION_PEER_UNIVERSE", "AAPL,MSFT,NVDA,ORCL,GOOGL,META,AMZN,TSLA").split(",")
+    if s.strip()
+]
+# 同行统计的缓存时间（秒）
+PEER_STATS_TTL = float(os.getenv("VALUATION_PEER_STATS_TTL", str(6 * 3600)))
+# CAPM 折现率参数与永续增长率
+RISK_FREE_RATE = float(os.getenv("VALUATION_RISK_FREE_RATE", "0.04"))
+EQUITY_RISK_PREMIUM = float(os.getenv("VALUATION_EQUITY_RISK_PREMIUM", "0.055"))
+TERMINAL_GROWTH = float(os.getenv("VALUATION_TERMINAL_GROWTH", "0.025"))
+# DCF 第一阶段（高速增长）与第二阶段（增长率线性回落到永续增长率）的年数
+STAGE1_YEARS = int(os.getenv("VALUATION_STAGE1_YEARS", "5"))
+STAGE2_YEARS = int(os.getenv("VALUATION_STAGE2_YEARS", "5"))
+# 折现率上下限与第一阶段增长率上下限
+DISCOUNT_RATE_RANGE = (0.06, 0.15)
+GROWTH_RANGE = (-0.05, 0.25)
+# 敏感性矩阵：在基准折现率与增长率两侧的偏移
+SENSITIVITY_STEPS = np.array([-0.02, -0.01, 0.0, 0.01, 0.02])
+# 情景分析：(名称, 折现率偏移, 增长率偏移)
+SCENARIOS = (("bear", 0.01, -0.05), ("base", 0.0, 0.0), ("bull", -0.01, 0.05))
+
+# 参与同行比较的估值倍数，数值越低代表越便宜
+MULTIPLES = ("pe", "ev_ebitda", "pb", "ps", "peg")
+
+
+def _float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _positive(value: float) -> float:
+    """亏损或净资产为负时倍数没有可比性，记为 NaN"""
+    return value if value > 0 else np.nan
+
+
+def parse_valuation_inputs(data: Dict[str, Any]) -> Dict[str, Any]:
+    """从 OVERVIEW 原始数据中提取估值所需的数值字段，缺失值为 NaN"""
+    market_cap = _float(data.get("MarketCapitalization"))
+    shares = _float(data.get("SharesOutstanding"))
+    price = market_cap / shares if shares > 0 else np.nan
+    eps = _float(data.get("EPS"))
+    book_value = _float(data.get("BookValue"))
+    ebitda = _float(data.get("EBITDA"))
+    revenue = _float(data.get("RevenueTTM"))
+    ev_ebitda = _float(data.get("EVToEBITDA"))
+    ev_revenue = _float(data.get("EVToRevenue"))
+    # 企业价值：优先用 EV/EBITDA 反推，其次 EV/Revenue
+    enterprise_value = ev_ebitda * ebitda if np.isfinite(ev_ebitda * ebitda) else ev_revenue * revenue
+    pe = _float(data.get("PERatio"))
+    if not np.isfinite(pe) and eps > 0:
+        pe = price / eps
+    pb = _float(data.get("PriceToBookRatio"))
+    if not np.isfinite(pb) and book_value > 0:
+        pb = price / book_value
+    return {
+        "symbol": str(data.get("Symbol", "")).upper(),
+        "name": data.get("Name", ""),
+        "sector": (data.get("Sector") or "").upper(),
+        "price": price,
+        "market_cap": market_cap,
+        "shares": shares,
+        "eps": eps,
+        "book_value": book_value,
+        "ebitda": ebitda,
+        "revenue": revenue,
+        "net_debt": enterprise_value - market_cap,
+        "profit_margin": _float(data.get("ProfitMargin")),
+        "revenue_growth": _float(data.get("QuarterlyRevenueGrowthYOY")),
+        "beta": _float(data.get("Beta")),
+        "analyst_target": _float(data.get("AnalystTargetPrice")),
+        "multiples": {
+            "pe": _positive(pe),
+            "ev_ebitda": _positive(ev_ebitda),
+            "pb": _positive(pb),
+            "ps": _positive(_float(data.get("PriceToSalesRatioTTM"))),
+            "peg": _positive(_float(data.get("PEGRatio"))),
+        },
+    }
+
+
+def discount_rates(betas: np.ndarray) -> np.ndarray:
+    """CAPM 折现率：无风险利率 + beta × 股权风险溢价，beta 缺失按 1 处理"""
+    betas = np.where(np.isfinite(betas), betas, 1.0)
+    return np.clip(RISK_FREE_RATE + betas * EQUITY_RISK_PREMIUM, *DISCOUNT_RATE_RANGE)
+
+
+def growth_paths(growths: np.ndarray, terminal: float = TERMINAL_GROWTH) -> np.ndarray:
+    """
+    各年增长率，最后一维为年份：第一阶段保持 growth，第二阶段线性回落到永续增长率。
+    growths 可为任意形状，返回形状为 growths.shape + (STAGE1_YEARS + STAGE2_YEARS,)
+    """
+    growths = np.asarray(growths, dtype=np.float64)[..., None]
+    stage1 = np.broadcast_to(growths, growths.shape[:-1] + (STAGE1_YEARS,))
+    fade = np.arange(1, STAGE2_YEARS + 1) / STAGE2_YEARS
+    stage2 = growths + (terminal - growths) * fade
+    return np.concatenate([stage1, stage2], axis=-1)
+
+
+def dcf_per_share(base_fcf, shares, rates, growths, terminal: float = TERMINAL_GROWTH) -> np.ndarray:
+    """
+    多阶段 DCF 每股价值。所有参数按 NumPy 规则广播：传入 (公司,) 形状得到每家公司的估值，
+    传入 (公司, 折现率, 1) 与 (公司, 1, 增长率) 得到每家公司的敏感性矩阵。
+    折现率不高于永续增长率时结果为 NaN
+    """
+    base_fcf, shares, rates, growths = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64) for value in (base_fcf, shares, rates, growths))
+    )
+    years = np.arange(1, STAGE1_YEARS + STAGE2_YEARS + 1)
+    cash_flows = base_fcf[..., None] * np.cumprod(1 + growth_paths(growths, terminal), axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discount = (1 + rates[..., None]) ** -years
+        present_value = (cash_flows * discount).sum(axis=-1)
+        terminal_value = cash_flows[..., -1] * (1 + terminal) / (rates - terminal) * discount[..., -1]
+        value = (present_value + terminal_value) / shares
+    return np.where((rates > terminal) & np.isfinite(value), value, np.nan)
+
+
+class PeerStats:
+    """一个行业的同行估值倍数：每个倍数排序后的有效值与中位数，用于二分查找百分位"""
+
+    def __init__(self, sector: str, symbols: List[str], matrix: np.ndarray):
+        self.sector = sector
+        self.symbols = symbols
+        self.columns = [np.sort(column[np.isfinite(column)]) for column in matrix.T]
+        self.medians = np.array([np.median(column) if len(column) else np.nan for column in self.columns])
+
+    def percentiles(self, matrix: np.ndarray) -> np.ndarray:
+        """matrix 为 (公司, 倍数)，返回每个值在同行中的百分位（0~100，并列取平均名次）"""
+        result = np.full(matrix.shape, np.nan)
+        for j, column in enumerate(self.columns):
+            if not len(column):
+                continue
+            values = matrix[:, j]
+            rank = (np.searchsorted(column, values, "left") + np.searchsorted(column, values, "right")) / 2
+            result[:, j] = np.where(np.isfinite(values), rank / len(column) * 100, np.nan)
+        return result
+
+
+class PeerUniverse:
+    """观察池中各公司的估值输入，以及按行业分组的同行统计"""
+
+    def __init__(self, companies: List[Dict[str, Any]]):
+        self.companies = {company["symbol"]: company for company in companies}
+        self.sectors: Dict[str, PeerStats] = {}
+        for sector in sorted({company["sector"] for company in companies if company["sector"]}):
+            members = [company for company in companies if company["sector"] == sector]
+            self.sectors[sector] = PeerStats(sector, [m["symbol"] for m in members], _multiples_matrix(members))
+
+    def members(self, sector: str) -> List[Dict[str, Any]]:
+        stats = self.sectors.get(sector)
+        return [self.companies[symbol] for symbol in stats.symbols] if stats else []
+
+
+def _multiples_matrix(companies: List[Dict[str, Any]]) -> np.ndarray:
+    return np.array([[company["multiples"][name] for name in MULTIPLES] for company in companies], dtype=np.float64).reshape(-1, len(MULTIPLES))
+
+
+# 同行统计缓存：按观察池缓存整个 PeerUniverse，各行业的统计在构建时一次算好
+peer_cache = TTLCache(max_entries=16)
+
+
+async def _load_universe(symbols: List[str]) -> Optional[PeerUniverse]:
+    payloads = await asyncio.gather(*(fundamentals.query_fundamental(symbol, "OVERVIEW") for symbol in symbols))
+    companies = [parse_valuation_inputs(data) for data in payloads if "Symbol" in data]
+    return PeerUniverse(companies) if companies else None
+
+
+async def get_peer_universe(symbols: Optional[List[str]] = None) -> Optional[PeerUniverse]:
+    """获取（缓存未命中时为观察池中每家公司请求 OVERVIEW 并构建）观察池的同行统计；全部拉取失败时不缓存"""
+    symbols = symbols or PEER_UNIVERSE
+    return await peer_cache.get_or_load(
+        ("peer_universe", tuple(symbols)),
+        lambda: _load_universe(symbols),
+        ttl=PEER_STATS_TTL,
+        cacheable=lambda universe: universe is not None,
+    )
+
+
+def base_free_cash_flow(company: Dict[str, Any], store: Optional[fundamentals.FundamentalsStore] = None):
+    """DCF 的基期自由现金流：优先用本地财报的 TTM 自由现金流，其次用 收入 × 净利率 近似，返回 (数值, 来源)"""
+    store = store or fundamentals.fundamentals_store
+    table = store.load(company["symbol"], "quarterly")
+    if table is not None and len(table["fiscal_date"]):
+        fcf = fundamentals.compute_ratios(table, "quarterly")["free_cash_flow"]
+        finite = fcf[np.isfinite(fcf)]
+        if len(finite):
+            return float(finite[-1]), "free_cash_flow_ttm"
+    proxy = company["revenue"] * company["profit_margin"]
+    if np.isfinite(proxy):
+        return float(proxy), "net_income_proxy"
+    return np.nan, None
+
+
+def _round(value: float, digits: int = 2) -> Optional[float]:
+    return round(float(value), digits) if np.isfinite(value) else None
+
+
+def value_companies(
+    companies: List[Dict[str, Any]],
+    peers: Optional[PeerStats],
+    fcf: List[tuple],
+) -> List[Dict[str, Any]]:
+    """
+    对一组公司（通常同属一个行业）一次性估值：倍数百分位、同行中位数隐含价格、
+    DCF 基准值、情景分析与敏感性矩阵都按公司维度广播计算。fcf 为每家公司的 (基期自由现金流, 来源)
+    """
+    if not companies:
+        return []
+    price = np.array([c["price"] for c in companies])
+    shares = np.array([c["shares"] for c in companies])
+    multiples = _multiples_matrix(companies)
+
+    # 同行中位数隐含价格
+    medians = peers.medians if peers is not None else np.full(len(MULTIPLES), np.nan)
+    percentiles = peers.percentiles(multiples) if peers is not None else np.full(multiples.shape, np.nan)
+    median = dict(zip(MULTIPLES, medians))
+    eps = np.array([c["eps"] for c in companies])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied = {
+            "pe": np.where(eps > 0, eps * median["pe"], np.nan),
+            "ev_ebitda": (np.array([c["ebitda"] for c in companies]) * median["ev_ebitda"] - np.array([c["net_debt"] for c in companies])) / shares,
+            "pb": np.array([c["book_value"] for c in companies]) * median["pb"],
+            "ps": np.array([c["revenue"] for c in companies]) / shares * median["ps"],
+        }
+    for values in implied.values():
+        values[~(values > 0)] = np.nan
+
+    # DCF：自由现金流为负时没有意义，不做估值
+    base_fcf = np.array([value for value, _ in fcf], dtype=np.float64)
+    base_fcf[~(base_fcf > 0)] = np.nan
+    rates = discount_rates(np.array([c["beta"] for c in companies]))
+    growths = np.array([c["revenue_growth"] for c in companies])
+    growths = np.clip(np.where(np.isfinite(growths), growths, TERMINAL_GROWTH), *GROWTH_RANGE)
+    dcf = dcf_per_share(base_fcf, shares, rates, growths)
+    rate_shift = np.array([shift for _, shift, _ in SCENARIOS])
+    growth_shift = np.array([shift for _, _, shift in SCENARIOS])
+    scenarios = dcf_per_share(
+        base_fcf[:, None], shares[:, None], rates[:, None] + rate_shift, np.clip(growths[:, None] + growth_shift, *GROWTH_RANGE)
+    )
+    grid_rates = rates[:, None] + SENSITIVITY_STEPS
+    grid_growths = growths[:, None] + SENSITIVITY_STEPS
+    grid = dcf_per_share(base_fcf[:, None, None], shares[:, None, None], grid_rates[:, :, None], grid_growths[:, None, :])
+
+    # 综合公允价值：各隐含价格与 DCF 的中位数
+    candidates = np.column_stack([*implied.values(), dcf])
+    with np.errstate(all="ignore"):
+        fair_value = np.array([np.median(row[np.isfinite(row)]) if np.isfinite(row).any() else np.nan for row in candidates])
+        upside = fair_value / price - 1
+
+    results = []
+    for i, company in enumerate(companies):
+        results.append({
+            "symbol": company["symbol"],
+            "name": company["name"],
+            "sector": company["sector"],
+            "price": _round(price[i]),
+            "multiples": {name: _round(multiples[i, j]) for j, name in enumerate(MULTIPLES)},
+            "peers": {
+                "sector": peers.sector if peers is not None else None,
+                "count": len(peers.symbols) if peers is not None else 0,
+                "medians": {name: _round(medians[j]) for j, name in enumerate(MULTIPLES)},
+                "percentiles": {name: _round(percentiles[i, j], 1) for j, name in enumerate(MULTIPLES)},
+            },
+            "implied_prices": {name: _round(values[i]) for name, values in implied.items()},
+            "dcf": {
+                "discount_rate": _round(rates[i], 4),
+                "growth": _round(growths[i], 4),
+                "terminal_growth": TERMINAL_GROWTH,
+                "base_fcf": _round(base_fcf[i], 0),
+                "fcf_source": fcf[i][1],
+                "value_per_share": _round(dcf[i]),
+                "scenarios": {name: _round(scenarios[i, k]) for k, (name, _, _) in enumerate(SCENARIOS)},
+                "sensitivity": {
+                    "discount_rates": [_round(r, 4) for r in grid_rates[i]],
+                    "growth_rates": [_round(g, 4) for g in grid_growths[i]],
+                    "values": [[_round(v) for v in row] for row in grid[i]],
+                },
+            },
+            "fair_value": _round(fair_value[i]),
+            "upside": _round(upside[i], 4),
+            "analyst_target": _round(company["analyst_target"]),
+        })
+    return results
+
+
+async def get_valuation(symbol: str, store: Optional[fundamentals.FundamentalsStore] = None) -> Dict[str, Any]:
+    """
+    单只股票估值。每次调用都会经 ingest_fundamentals 检查本地财报：超过 FUNDAMENTALS_REFRESH_SECONDS
+    才重新拉取三张报表，否则只读取本地元数据。同行统计来自缓存的观察池，缓存未命中时与 value_sector 一样先构建观察池
+    """
+    symbol = symbol.upper()
+    overview, _, universe = await asyncio.gather(
+        fundamentals.query_fundamental(symbol, "OVERVIEW"),
+        fundamentals.ingest_fundamentals(symbol, store=store),
+        get_peer_universe(),
+    )
+    if "Symbol" not in overview:
+        return {"symbol": symbol, "error": overview.get("error", f"{symbol} 没有基本面数据"), "rate_limited": bool(overview.get("rate_limited"))}
+    company = parse_valuation_inputs(overview)
+    peers = universe.sectors.get(company["sector"]) if universe is not None else None
+    return value_companies([company], peers, [base_free_cash_flow(company, store)])[0]
+
+
+async def value_sector(sector: str, store: Optional[fundamentals.FundamentalsStore] = None) -> Dict[str, Any]:
+    """
+    对观察池中某个行业的全部公司一次性估值，按上行空间从高到低排序。
+    观察池缓存有效期（PEER_STATS_TTL）内只做数组运算；缓存未命中时 get_peer_universe 会为整个观察池
+    请求 OVERVIEW（经共享行情缓存与上游调度器，已缓存的公司不产生上游调用）。
+    自由现金流只读本地财报，不会为此拉取报表，没有本地财报的公司用 收入 × 净利率 近似
+    """
+    started = time.perf_counter()
+    universe = await get_peer_universe()
+    sector = sector.upper()
+    companies = universe.members(sector) if universe is not None else []
+    if not companies:
+        return {"sector": sector, "error": f"观察池中没有 {sector} 行业的公司"}
+    results = value_companies(companies, universe.sectors[sector], [base_free_cash_flow(c, store) for c in companies])
+    results.sort(key=lambda r: r["upside"] if r["upside"] is not None else float("-inf"), reverse=True)
+    return {
+        "sector": sector,
+        "count": len(results),
+        "companies": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
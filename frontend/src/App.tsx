@@ -32,6 +32,9 @@ interface StockData {
   volume: number
 }
 
+// 实时报价推送订阅的股票（与 /api/stocks/realtime 一致）
+const REALTIME_SYMBOLS = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'AMZN']
+
 interface SystemStatus {
   backend: boolean
   database: boolean
@@ -196,6 +199,70 @@ function App() {
     loadRealtimeStocks()
   }, [])
 
+  // 订阅 WebSocket 报价推送，服务端只发送变化的字段；连接断开后按指数退避自动重连
+  useEffect(() => {
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+    let socket: WebSocket | null = null
+    let retryTimer: ReturnType<typeof setTimeout> | undefined
+    let retryDelay = 1000
+    let stopped = false
+
+    const connect = () => {
+      socket = new WebSocket(`${protocol}://${window.location.host}/api/ws/quotes`)
+
+      socket.onopen = () => {
+        retryDelay = 1000
+        socket?.send(JSON.stringify({ action: 'subscribe', symbols: REALTIME_SYMBOLS }))
+      }
+
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data)
+        if (message.type === 'error' && message.rate_limited) {
+          // 服务端只在状态变化时推送一次错误，恢复后会重新发送完整快照
+          setDataSource('Alpha Vantage API (限流中，降低刷新频率)')
+          return
+        }
+        if (message.type !== 'snapshot' && message.type !== 'update') {
+          return
+        }
+        const fields = message.type === 'snapshot' ? message.quote : message.changes
+        const patch: Partial<StockData> = {}
+        if ('price' in fields) patch.price = Number(fields.price) || 0
+        if ('change' in fields) patch.change = Number(fields.change) || 0
+        if ('change_percent' in fields) patch.changePercent = Number(fields.change_percent) || 0
+        if ('volume' in fields) patch.volume = Number(fields.volume) || 0
+
+        setStockData((stocks) => {
+          if (!stocks.some((stock) => stock.symbol === message.symbol)) {
+            return [...stocks, { symbol: message.symbol, price: 0, change: 0, changePercent: 0, volume: 0, ...patch }]
+          }
+          return stocks.map((stock) => (stock.symbol === message.symbol ? { ...stock, ...patch } : stock))
+        })
+        setDataSource('Alpha Vantage API (实时推送)')
+      }
+
+      socket.onerror = (event) => {
+        console.error('实时报价推送连接失败:', event)
+      }
+
+      socket.onclose = () => {
+        if (stopped) {
+          return
+        }
+        retryTimer = setTimeout(connect, retryDelay)
+        retryDelay = Math.min(retryDelay * 2, 30000)
+      }
+    }
+
+    connect()
+
+    return () => {
+      stopped = true
+      clearTimeout(retryTimer)
+      socket?.close()
+    }
+  }, [])
+
   return (
     <div className="app">
       {/* 顶部导航栏 */}
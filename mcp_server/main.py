@@ -1,37 +1,60 @@
 # mcp_server/main.py
+# 与 backend/mcp_server.py 提供相同的接口：REST（/tools、/call_tool、/call_batch）与标准 MCP 协议（/mcp），
+# 因此 mcp_client 的 MCP_SERVER_URL 指向任意一个服务时，MCP_TRANSPORT=rest 与 mcp 都可用
+import contextlib
+
 from fastapi import FastAPI
-from mcp_server.tools import get_company_overview, get_stock_price
+from mcp_server.tools import registry
+from market_data import close_http_client
+from mcp_batch import BatchCallRequest, dispatch_registry_tool, execute_batch
+from mcp_protocol import StreamableHTTPTransport, create_mcp_server
+from redis_cache import close_redis_tier, configure_redis_tier
+
+streamable_http = StreamableHTTPTransport(create_mcp_server(registry))
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """与后端共享 Redis 行情缓存，并在应用生命周期内运行 MCP 会话管理器；退出时关闭上游连接池与 Redis 连接"""
+    configure_redis_tier()
+    try:
+        async with streamable_http.run():
+            yield
+    finally:
+        await close_http_client()
+        await close_redis_tier()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.mount("/mcp", streamable_http)
 
 @app.get("/tools")
 def get_available_tools():
     """
     返回所有可用的工具列表，供 Agent 调用。
     """
-    return {
-        "tools": [
-            {
-                "name": "get_company_overview",
-                "description": "获取公司的基本面概览",
-                "parameters": {"type": "object", "properties": {"symbol": {"type": "string"}}},
-            },
-            {
-                "name": "get_stock_price",
-                "description": "获取股票实时价格",
-                "parameters": {"type": "object", "properties": {"symbol": {"type": "string"}}},
-            },
-        ]
-    }
+    return {"tools": registry.list_tools()}
+
+@app.get("/tools/stats")
+def get_tool_stats():
+    """各工具的调用次数与耗时直方图"""
+    return registry.stats()
+
+async def dispatch_tool(tool_name: str, params: dict):
+    """
+    成功时直接返回工具结果；未知工具、参数错误、上游限流或请求失败等异常
+    统一转换为 {"error", "error_type", "status": "error"}，与 backend/mcp_server.py 的 /call_tool、/call_batch 一致。
+    """
+    return await dispatch_registry_tool(registry, tool_name, params)
 
 @app.post("/call_tool")
-def call_tool(tool_name: str, params: dict):
+async def call_tool(tool_name: str, params: dict):
     """
     根据 Agent 的请求，执行相应的工具函数。
     """
-    if tool_name == "get_company_overview":
-        return get_company_overview(**params)
-    elif tool_name == "get_stock_price":
-        return get_stock_price(**params)
-    else:
-        return {"error": "Tool not found."}
\ No newline at end of file
+    return await dispatch_tool(tool_name, params)
+
+@app.post("/call_batch")
+async def call_batch(request: BatchCallRequest):
+    """
+    一次执行多个工具调用：重复的调用只执行一次，其余并发执行，结果按请求顺序返回。
+    """
+    return await execute_batch(request.calls, dispatch_tool)
\ No newline at end of file